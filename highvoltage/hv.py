@@ -5,8 +5,10 @@ import argparse
 import time
 import cmd2
 import getpass
-import numpy as np
-from hvmodbus import HVModbus
+import shlex
+import sys
+from pymodbus import ModbusException
+from hvmodbus import HVModbus, parseAddressList, statusString, alarmString
 from cmd2.table_creator import (
     Column,
     SimpleTable,
@@ -18,6 +20,10 @@ from typing import (
 
 HV_PASS = 'hv4all'
 
+def addTargetArguments(parser):
+    parser.add_argument('-a', '--addresses', type=str, help='apply to several boards in one pass, e.g. 1-19 (default: selected board)')
+    parser.add_argument('--all-present', action='store_true', help='apply to every board found by probe')
+
 class HighVoltageApp(cmd2.Cmd):
 
     def __init__(self, param):
@@ -54,6 +60,18 @@ class HighVoltageApp(cmd2.Cmd):
     columns.append(Column("", width=14, data_horiz_align=HorizontalAlignment.CENTER))
 
     st = SimpleTable(columns, divider_char=None)
+
+    # multi-board mon: one row per board
+    compactColumns: List[Column] = list()
+    compactColumns.append(Column("", width=4, data_horiz_align=HorizontalAlignment.RIGHT))
+    compactColumns.append(Column("", width=6, data_horiz_align=HorizontalAlignment.CENTER))
+    compactColumns.append(Column("", width=5, data_horiz_align=HorizontalAlignment.RIGHT))
+    compactColumns.append(Column("", width=9, data_horiz_align=HorizontalAlignment.RIGHT))
+    compactColumns.append(Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT))
+    compactColumns.append(Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT))
+    compactColumns.append(Column("", width=12, data_horiz_align=HorizontalAlignment.CENTER))
+
+    stCompact = SimpleTable(compactColumns, divider_char=None)
     
     def prsuccess(self, msg) -> None:
         self.poutput(cmd2.ansi.style(msg, fg=cmd2.ansi.Fg.LIGHT_GREEN))
@@ -98,22 +116,7 @@ class HighVoltageApp(cmd2.Cmd):
             self.perror(f'E: modbus address outside boundary - min:1 max:20')
 
     def statusString(self, statusCode):
-        if statusCode == 0:
-            return 'UP'
-        elif statusCode == 1:
-            return 'DOWN'
-        elif statusCode == 2:
-            return 'RUP'
-        elif statusCode == 3:
-            return 'RDN'
-        elif statusCode == 4:
-            return 'TUP'
-        elif statusCode == 5:
-            return 'TDN'
-        elif statusCode == 6:
-            return 'TRIP'
-        else:
-            return 'undef'
+        return statusString(statusCode)
 
     def statusIcon(self, statusCode):
         if statusCode == 0:
@@ -134,27 +137,145 @@ class HighVoltageApp(cmd2.Cmd):
             return "undef"
 
     def alarmString(self, alarmCode):
-        msg = ' '
         if alarmCode == 0:
             return 'none'
-        if alarmCode & 1:
-            msg = msg + 'OV '
-        if alarmCode & 2:
-            msg = msg + 'UV '
-        if alarmCode & 4:
-            msg = msg + 'OC '
-        if alarmCode & 8:
-            msg = msg + 'OT '
-        return cmd2.ansi.style(msg, fg=cmd2.ansi.Fg.WHITE, bg=cmd2.ansi.Bg.LIGHT_RED)
+        return cmd2.ansi.style(f' {alarmString(alarmCode)} ', fg=cmd2.ansi.Fg.WHITE, bg=cmd2.ansi.Bg.LIGHT_RED)
 
     def printMonitorHeader(self):
         self.poutput(cmd2.ansi.style(self.st.generate_data_row(['','status','Vset','V','I','T','rate UP/DN','limit V/I/T/TRIP','trigger thr','alarm']), fg=cmd2.ansi.Fg.LIGHT_CYAN))
         self.poutput(cmd2.ansi.style(self.st.generate_data_row(['','','[V]','[V]','[uA]','[°C]','[V/s]/[V/s]','[V]/[uA]/[°C]/[s]','[mV]','']), fg=cmd2.ansi.Fg.LIGHT_BLUE))
 
-    def printMonitorRow(self):
-        monData = self.hv.readMonRegisters()
-        self.poutput(self.st.generate_data_row([self.statusIcon(monData['status']), self.statusString(monData['status']), monData['Vset'], f'{monData["V"]:.3f}', f'{monData["I"]:.3f}', monData['T'], f'{monData["rateUP"]}/{monData["rateDN"]}', f'{monData["limitV"]}/{monData["limitI"]}/{monData["limitT"]}/{monData["limitTRIP"]}', monData['threshold'], self.alarmString(monData['alarm'])]))
-
+    def printMonitorRow(self, snap=None, label=None):
+        if snap is None:
+            try:
+                snap = self.hv.snapshot()
+            except ModbusException as e:
+                self.perror(f'HV module {self.hv.getAddress()} - {e}')
+                return
+            if snap is None:
+                self.perror(f'HV module {self.hv.getAddress()} - register read error')
+                return
+        self.poutput(self.st.generate_data_row([self.statusIcon(snap.status) if label is None else label, self.statusString(snap.status), snap.Vset, f'{snap.V:.3f}', f'{snap.I:.3f}', snap.T, f'{snap.rateUP}/{snap.rateDN}', f'{snap.limitV}/{snap.limitI}/{snap.limitT}/{snap.limitTRIP}', snap.threshold, self.alarmString(snap.alarm)]))
+
+
+    def shmSnapshots(self, name):
+        """Snapshots published by hvmon --shm - the selected module or all of them"""
+        from hvshm import ShmReader
+        try:
+            reader = ShmReader(name)
+        except (FileNotFoundError, ValueError) as e:
+            self.perror(f'shared memory {name} not available - is hvmon --shm running? ({e})')
+            return None
+        try:
+            pid, age = reader.writer()
+            if age > 5:
+                self.pwarning(f'shared memory {name} not updated for {age:.0f} s (hvmon pid {pid})')
+            if self.hv.isConnected():
+                snap = reader.read(self.hv.getAddress())
+                return {} if snap is None else {snap.address: snap}
+            return reader.readAll()
+        finally:
+            reader.close()
+
+    def targets(self, spec):
+        """Address list like '1-5,7' or 'all' boards found by probe - None on error"""
+        if spec == 'all':
+            from hvdiscovery import HVDiscovery
+            found = sorted(HVDiscovery(self.hv).probe(range(1,21)).found)
+            if not found:
+                self.perror('no HV module found')
+                return None
+            return found
+        try:
+            return parseAddressList(spec)
+        except ValueError as e:
+            self.perror(f'E: {e}')
+            return None
+
+    def sweep(self, addresses):
+        """One snapshot per board in a single pass - stores the pass duration in self.sweepTime"""
+        start = time.perf_counter()
+        snaps = {}
+        for addr in addresses:
+            try:
+                snaps[addr] = self.hv.snapshot(slave=addr)
+            except Exception:
+                snaps[addr] = None
+        self.sweepTime = time.perf_counter() - start
+        return snaps
+
+    def printCompactHeader(self):
+        self.poutput(cmd2.ansi.style(self.stCompact.generate_data_row(['addr','status','Vset','V','I','T','alarm']), fg=cmd2.ansi.Fg.LIGHT_CYAN))
+        self.poutput(cmd2.ansi.style(self.stCompact.generate_data_row(['','','[V]','[V]','[uA]','[°C]','']), fg=cmd2.ansi.Fg.LIGHT_BLUE))
+
+    def printCompactRow(self, addr, snap):
+        if snap is None:
+            self.poutput(self.stCompact.generate_data_row([addr, cmd2.ansi.style('error', fg=cmd2.ansi.Fg.LIGHT_RED), '', '', '', '', '']))
+            return
+        self.poutput(self.stCompact.generate_data_row([addr, self.statusString(snap.status), snap.Vset, f'{snap.V:.3f}', f'{snap.I:.3f}', snap.T, self.alarmString(snap.alarm)]))
+
+    def batchTargets(self, args):
+        """Boards of -a/--all-present - None without them (selected board), [] on error"""
+        if args.all_present:
+            return self.targets('all') or []
+        if args.addresses is not None:
+            return self.targets(args.addresses) or []
+        return None
+
+    def asyncBatch(self, job):
+        """Run job(AsyncHVModbus) on a fresh connection pool - tcp mode only"""
+        import asyncio
+        from hvasync import AsyncHVModbus
+        loop = asyncio.new_event_loop()
+        ahv = AsyncHVModbus(self.param)
+        try:
+            if not loop.run_until_complete(ahv.connect()):
+                self.perror(f'E: host not reachable or mbusd not running ({self.param.host})')
+                return None
+            return loop.run_until_complete(job(ahv))
+        finally:
+            ahv.close()
+            loop.close()
+
+    def batch(self, name, addresses, value=None):
+        """Apply a COMMANDS entry to every board without select/open - {address: None or error}"""
+        if self.param.mode == 'tcp':
+            # pipelined over the mbusd connection pool
+            result = self.asyncBatch(lambda ahv: ahv.command_all(addresses, name, value))
+            if result is None:
+                return None
+        else:
+            result = {}
+            for addr in addresses:
+                try:
+                    result[addr] = self.hv.command(name, value, slave=addr)
+                except Exception as e:
+                    result[addr] = e
+        return {addr: None if ok is True else ('error response' if ok is False else str(ok)) for addr, ok in result.items()}
+
+    def printBatchSummary(self, what, results, elapsed):
+        for addr in sorted(results):
+            if results[addr] is None:
+                self.prsuccess(f'{addr}: ok')
+            else:
+                self.perror(f'{addr}: failed ({results[addr]})')
+        failed = sum(1 for error in results.values() if error is not None)
+        self.poutput(f'{what}: {len(results) - failed}/{len(results)} boards ok in {elapsed * 1000:.0f} ms')
+
+    def runCommand(self, name, args, value=None):
+        """COMMANDS entry on the selected board, or on the -a/--all-present boards in one pass"""
+        addresses = self.batchTargets(args)
+        if addresses is None:
+            if self.checkConnection() is False:
+                return
+            self.hv.command(name, value)
+            return
+        if not addresses:
+            return
+        start = time.perf_counter()
+        results = self.batch(name, addresses, value)
+        if results is not None:
+            self.printBatchSummary(name, results, time.perf_counter() - start)
     #
     # select
     #
@@ -175,15 +296,17 @@ class HighVoltageApp(cmd2.Cmd):
 
     rampup_parser = rate_subparsers.add_parser('rampup', help='rampup rate')
     rampup_parser.add_argument('value', type=int, help='ramp up voltage rate [V/s] (min:1 max:25)')
+    addTargetArguments(rampup_parser)
 
     rampdown_parser = rate_subparsers.add_parser('rampdown', help='rampdown rate')
     rampdown_parser.add_argument('value', type=int, help='ramp down voltage rate [V/s] (min:1 max:25)')
+    addTargetArguments(rampdown_parser)
 
     def rate_rampup(self, args):
-        if self.checkRange(args.value, 1, 25): self.hv.setRateRampup(args.value)
+        if self.checkRange(args.value, 1, 25): self.runCommand('setRateRampup', args, args.value)
 
     def rate_rampdown(self, args):
-        if self.checkRange(args.value, 1, 25): self.hv.setRateRampdown(args.value)
+        if self.checkRange(args.value, 1, 25): self.runCommand('setRateRampdown', args, args.value)
 
     rampup_parser.set_defaults(func=rate_rampup)
     rampdown_parser.set_defaults(func=rate_rampdown)
@@ -192,8 +315,6 @@ class HighVoltageApp(cmd2.Cmd):
     @cmd2.with_category("High Voltage commands")
     def do_rate(self, args):
         """Change the rampup/rampdown values [V/s]"""
-        if self.checkConnection() is False:
-            return
         func = getattr(args, 'func', None)
         if func is not None:
             func(self, args)
@@ -206,27 +327,31 @@ class HighVoltageApp(cmd2.Cmd):
 
     current_parser = limit_subparsers.add_parser('current', help='current limit')
     current_parser.add_argument('value', type=int, help='current threshold [uA] (min:1 max:10)')
+    addTargetArguments(current_parser)
 
     voltage_parser = limit_subparsers.add_parser('voltage', help='voltage margin +/-')
     voltage_parser.add_argument('value', type=int, help='voltage margin +/- [V] (min:1 max:20)')
+    addTargetArguments(voltage_parser)
 
     temperature_parser = limit_subparsers.add_parser('temperature', help='temperature limit')
     temperature_parser.add_argument('value', type=int, help='temperature threshold [°C] (min:20 max:70)')
+    addTargetArguments(temperature_parser)
 
     triptime_parser = limit_subparsers.add_parser('triptime', help='trip time limit')
     triptime_parser.add_argument('value', type=int, help='trip time threshold [s] (min:1 max:1000)')
+    addTargetArguments(triptime_parser)
 
     def limit_current(self, args):
-        if self.checkRange(args.value, 1, 10): self.hv.setLimitCurrent(args.value)
+        if self.checkRange(args.value, 1, 10): self.runCommand('setLimitCurrent', args, args.value)
 
     def limit_voltage(self, args):
-        if self.checkRange(args.value, 1, 20): self.hv.setLimitVoltage(args.value)
+        if self.checkRange(args.value, 1, 20): self.runCommand('setLimitVoltage', args, args.value)
 
     def limit_temperature(self, args):
-        if self.checkRange(args.value, 20, 70): self.hv.setLimitTemperature(args.value)
+        if self.checkRange(args.value, 20, 70): self.runCommand('setLimitTemperature', args, args.value)
 
     def limit_triptime(self, args):
-        if self.checkRange(args.value, 1, 1000): self.hv.setLimitTriptime(args.value)
+        if self.checkRange(args.value, 1, 1000): self.runCommand('setLimitTriptime', args, args.value)
 
     current_parser.set_defaults(func=limit_current)
     voltage_parser.set_defaults(func=limit_voltage)
@@ -237,107 +362,325 @@ class HighVoltageApp(cmd2.Cmd):
     @cmd2.with_category("High Voltage commands")
     def do_limit(self, args):
         """Set current/voltage/tempreature/trip time limit"""
-        if self.checkConnection() is False:
-            return
         func = getattr(args, 'func', None)
         if func is not None:
             func(self, args)
 
+    #
+    # config voltage / rates / limits in one go
+    #
+    config_parser = argparse.ArgumentParser()
+    config_parser.add_argument('--voltage', type=int, help='voltage level [V] (min:25 max:1500)')
+    config_parser.add_argument('--rampup', type=int, help='ramp up voltage rate [V/s] (min:1 max:25)')
+    config_parser.add_argument('--rampdown', type=int, help='ramp down voltage rate [V/s] (min:1 max:25)')
+    config_parser.add_argument('--current', type=int, help='current threshold [uA] (min:1 max:10)')
+    config_parser.add_argument('--margin', type=int, help='voltage margin +/- [V] (min:1 max:20)')
+    config_parser.add_argument('--temperature', type=int, help='temperature threshold [°C] (min:20 max:70)')
+    config_parser.add_argument('--triptime', type=int, help='trip time threshold [s] (min:1 max:1000)')
+
+    @cmd2.with_argparser(config_parser)
+    @cmd2.with_category("High Voltage commands")
+    def do_config(self, args: argparse.Namespace) -> None:
+        """Set voltage, rates and limits with coalesced register writes"""
+        if self.checkConnection() is False:
+            return
+        settings = [
+            (args.voltage, 25, 1500, self.hv.setVoltageSet),
+            (args.rampup, 1, 25, self.hv.setRateRampup),
+            (args.rampdown, 1, 25, self.hv.setRateRampdown),
+            (args.current, 1, 10, self.hv.setLimitCurrent),
+            (args.margin, 1, 20, self.hv.setLimitVoltage),
+            (args.temperature, 20, 70, self.hv.setLimitTemperature),
+            (args.triptime, 1, 1000, self.hv.setLimitTriptime),
+        ]
+        settings = [s for s in settings if s[0] is not None]
+        if not settings:
+            self.perror('nothing to configure')
+            return
+        for value, minVal, maxVal, _ in settings:
+            if not self.checkRange(value, minVal, maxVal):
+                return
+        with self.hv.staged():
+            for value, _, _, setter in settings:
+                setter(value)
+        if self.hv.mismatch:
+            self.perror(f'readback mismatch on registers {[hex(r) for r in self.hv.mismatch[self.hv.getAddress()]]}')
+        else:
+            self.prsuccess('configuration written and verified')
+
     #
     # voltage
     #
     voltage_parser = argparse.ArgumentParser()
     voltage_parser.add_argument('value', type=int, help='voltage level [V] (min:25 max:1500)')
+    addTargetArguments(voltage_parser)
 
     @cmd2.with_argparser(voltage_parser)
     @cmd2.with_category("High Voltage commands")
     def do_voltage(self, args: argparse.Namespace) -> None:
         """Set voltage"""
-        if self.checkConnection() is False:
-            return
-        if self.checkRange(args.value, 25, 1500): self.hv.setVoltageSet(args.value)
+        if self.checkRange(args.value, 25, 1500): self.runCommand('setVoltageSet', args, args.value)
 
     #
     # on
     #
+    on_parser = argparse.ArgumentParser()
+    addTargetArguments(on_parser)
+
+    @cmd2.with_argparser(on_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_on(self, _) -> None:
+    def do_on(self, args: argparse.Namespace) -> None:
         """Turn on HV"""
-        if self.checkConnection() is False:
-            return
-        self.hv.powerOn()
+        self.runCommand('powerOn', args)
 
     #
     # off
     #
+    off_parser = argparse.ArgumentParser()
+    addTargetArguments(off_parser)
+
+    @cmd2.with_argparser(off_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_off(self, _) -> None:
+    def do_off(self, args: argparse.Namespace) -> None:
         """Turn off HV"""
-        if self.checkConnection() is False:
-            return
-        self.hv.powerOff()
+        self.runCommand('powerOff', args)
 
     #
     # reset
     #
+    reset_parser = argparse.ArgumentParser()
+    addTargetArguments(reset_parser)
+
+    @cmd2.with_argparser(reset_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_reset(self, _) -> None:
+    def do_reset(self, args: argparse.Namespace) -> None:
         """Reset alarms"""
-        if self.checkConnection() is False:
-            return
-        self.hv.reset()
+        self.runCommand('reset', args)
 
     #
     # info
     #
+    info_parser = argparse.ArgumentParser()
+    info_parser.add_argument('--shm', nargs='?', const='hvmon', metavar='NAME', help='read from hvmon shared memory NAME (default: %(const)s), no bus access - all published modules unless one is selected')
+    addTargetArguments(info_parser)
+
+    @cmd2.with_argparser(info_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_info(self, _) -> None:
+    def do_info(self, args: argparse.Namespace) -> None:
         """Print board info"""
-        if self.checkConnection() is False:
+        addresses = self.batchTargets(args)
+        if addresses == []:
+            return
+        if args.shm is not None:
+            snaps = self.shmSnapshots(args.shm) or {}
+            if addresses is not None:
+                snaps = {addr: snaps.get(addr) for addr in addresses}
+        elif addresses is not None:
+            start = time.perf_counter()
+            if self.param.mode == 'tcp':
+                snaps = self.asyncBatch(lambda ahv: ahv.poll_all(addresses))
+                if snaps is None:
+                    return
+            else:
+                snaps = self.sweep(addresses)
+            elapsed = time.perf_counter() - start
+        else:
+            if self.checkConnection() is False:
+                return
+            snap = self.hv.snapshot()
+            if snap is None:
+                self.perror(f'HV module {self.hv.getAddress()} register read error')
+                return
+            self.printInfo(snap)
             return
-        info = self.hv.getInfo()
-        (m,q,t) = self.hv.readCalibRegisters()
-        self.poutput(f'{"FW ver": <25}: {info[0]}')
-        self.poutput(f'{"PMT s/n": <25}: {info[1]}')
-        self.poutput(f'{"HV s/n": <25}: {info[2]}')
-        self.poutput(f'{"FEB s/n": <25}: {info[3]}')
-        self.poutput(f'{"Device ID s/n": <25}: {info[4]}')
-        self.poutput(f'{"Vref": <25}: {self.hv.getVref()} mV')
-        self.poutput(f'{"Calibration slope": <25}: {m}')
-        self.poutput(f'{"Calibration offset": <25}: {q}')
-        self.poutput(f'{"Calibration discrim.": <25}: {int(t)} mV')
+        for addr in sorted(snaps):
+            if len(snaps) > 1:
+                self.poutput(cmd2.ansi.style(f'HV module {addr}', fg=cmd2.ansi.Fg.LIGHT_CYAN))
+            if snaps[addr] is None:
+                self.perror(f'HV module {addr} register read error')
+            else:
+                self.printInfo(snaps[addr])
+        if addresses is not None and args.shm is None:
+            ok = sum(1 for snap in snaps.values() if snap is not None)
+            self.poutput(f'info: {ok}/{len(snaps)} boards ok in {elapsed * 1000:.0f} ms')
+
+    def printInfo(self, snap):
+        self.poutput(f'{"FW ver": <25}: {snap.fwver}')
+        self.poutput(f'{"PMT s/n": <25}: {snap.pmtsn}')
+        self.poutput(f'{"HV s/n": <25}: {snap.hvsn}')
+        self.poutput(f'{"FEB s/n": <25}: {snap.febsn}')
+        self.poutput(f'{"Device ID s/n": <25}: {snap.devid}')
+        self.poutput(f'{"Vref": <25}: {snap.vref} mV')
+        self.poutput(f'{"Calibration slope": <25}: {snap.calibm}')
+        self.poutput(f'{"Calibration offset": <25}: {snap.calibq}')
+        self.poutput(f'{"Calibration discrim.": <25}: {int(snap.calibt)} mV')
 
     #
     # mon
     #
     mon_parser = argparse.ArgumentParser()
     mon_parser.add_argument('seconds',  type=int, default=1, nargs='?', help='number of seconds')
+    mon_parser.add_argument('-a', '--addresses', type=str, help="boards to monitor together, e.g. 1-5,7 or 'all' (default: selected board)")
+    mon_parser.add_argument('-i', '--interval', type=float, default=1, help='seconds between sweeps (default: %(default)s)')
+    mon_parser.add_argument('-d', '--dash', action='store_true', help='full-screen view redrawing only changed values')
+    mon_parser.add_argument('--shm', nargs='?', const='hvmon', metavar='NAME', help='read from hvmon shared memory NAME (default: %(const)s), no bus access - all published modules unless one is selected')
 
     @cmd2.with_argparser(mon_parser)
     @cmd2.with_category("High Voltage commands")
     def do_mon(self, args: argparse.Namespace) -> None:
         """Print monitored values"""
-        if self.checkConnection() is False:
+        addresses = None
+        if args.addresses is not None:
+            addresses = self.targets(args.addresses)
+            if addresses is None:
+                return
+        self.sweepTime = None
+        if args.shm is not None:
+            def fetch():
+                snaps = self.shmSnapshots(args.shm)
+                if snaps is None or addresses is None:
+                    return snaps
+                return {addr: snaps.get(addr) for addr in addresses}
+        elif addresses is not None:
+            fetch = lambda: self.sweep(addresses)
+        elif self.checkConnection() is False:
             return
-        for i in range(0, args.seconds):
-            if i % 20 == 0:
-                self.printMonitorHeader()
-            self.printMonitorRow()
-            if args.seconds > 1:
-                time.sleep(1)
+        else:
+            fetch = lambda: {self.hv.getAddress(): self.hv.snapshot()}
+        sweeps = max(1, round(args.seconds / args.interval))
+        if args.dash:
+            self.monDashboard(fetch, sweeps, args.interval)
+            return
+        for i in range(0, sweeps):
+            start = time.monotonic()
+            snaps = fetch()
+            if snaps is None:
+                return
+            if addresses is None and args.shm is None:
+                if i % 20 == 0:
+                    self.printMonitorHeader()
+                self.printMonitorRow(snaps[self.hv.getAddress()])
+            else:
+                self.printCompactHeader()
+                for addr in sorted(snaps):
+                    self.printCompactRow(addr, snaps[addr])
+                if self.sweepTime is not None:
+                    self.poutput(cmd2.ansi.style(f'sweep: {len(snaps)} boards in {self.sweepTime * 1000:.1f} ms ({self.sweepTime / args.interval:.0%} of interval)', fg=cmd2.ansi.Fg.DARK_GRAY))
+            if sweeps > 1:
+                time.sleep(max(0, args.interval - (time.monotonic() - start)))
+
+    def monDashboard(self, fetch, sweeps, interval):
+        from hvdash import Dashboard, MONITOR_COLUMNS
+        snaps = fetch()
+        if not snaps:
+            return
+        dash = Dashboard(MONITOR_COLUMNS, sorted(snaps), title=f'HV:{self.param.mode} mon - {sweeps} sweeps every {interval:g} s - Ctrl-C to stop', out=self.stdout)
+        dash.start()
+        try:
+            for i in range(0, sweeps):
+                if i > 0:
+                    time.sleep(interval)
+                    snaps = fetch() or {}
+                if self.sweepTime is not None:
+                    dash.message(f'sweep: {len(snaps)} boards in {self.sweepTime * 1000:.1f} ms')
+                dash.render(snaps)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dash.stop()
 
     #
     # probe
     #
+    probe_parser = argparse.ArgumentParser()
+    probe_parser.add_argument('-r', '--rescan', action='store_true', help='ignore the cached address map (re-identify every board)')
+    probe_parser.add_argument('-t', '--timeout', type=float, default=0.05, help='initial presence timeout [s] (default: %(default)s)')
+
+    @cmd2.with_argparser(probe_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_probe(self, _) -> None:
+    def do_probe(self, args: argparse.Namespace) -> None:
         """Probe addresses 1 to 20"""
+        from hvdiscovery import HVDiscovery
+        result = HVDiscovery(self.hv, timeout=args.timeout).probe(range(1,21), rescan=args.rescan)
         for addr in range(1,21):
-            found = self.hv.open(addr)
-            if found:
-                self.prsuccess(f'{addr}')
+            if addr in result.found:
+                devid = result.found[addr]
+                self.prsuccess(f'{addr} (device ID {"unreadable" if devid is None else devid})')
             else:
                 self.perror(f'{addr}')
+        self.poutput(f'probe time: {result.elapsed:.2f} s - {len(result.validated)} cached, {len(result.scanned)} scanned, {len(result.retried)} retried')
+
+    #
+    # inventory
+    #
+    inventory_parser = argparse.ArgumentParser()
+    inventory_parser.add_argument('-a', '--addresses', type=str, help="boards to list, e.g. 1-19 or 'all' (default: boards in the probe cache)")
+    inventory_parser.add_argument('-o', '--output', type=str, help='write the inventory keyed by device ID - CSV for *.csv, JSON otherwise')
+    inventory_parser.add_argument('-r', '--refresh', action='store_true', help='re-read every board even if its device ID and firmware are unchanged')
+    inventory_parser.add_argument('-c', '--cached', action='store_true', help='answer from the inventory cache only, no bus access')
+
+    @cmd2.with_argparser(inventory_parser)
+    @cmd2.with_category("High Voltage commands")
+    def do_inventory(self, args: argparse.Namespace) -> None:
+        """Firmware, serial numbers, Vref and calibration of every board"""
+        from hvinventory import Inventory, writeInventory
+        inventory = Inventory(self.hv)
+        addresses = None
+        if args.addresses is not None:
+            addresses = self.targets(args.addresses)
+            if addresses is None:
+                return
+        if args.cached:
+            boards = inventory.lookup(addresses)
+        else:
+            if addresses is None:
+                from hvdiscovery import HVDiscovery
+                addresses = sorted(HVDiscovery(self.hv).loadCache()) or self.targets('all')
+                if addresses is None:
+                    return
+            result = inventory.collect(addresses, refresh=args.refresh)
+            boards = result.boards
+            for addr in result.failed:
+                self.perror(f'HV module {addr} not responding')
+        self.poutput(cmd2.ansi.style(f'{"addr":>4}  {"device ID":>10}  {"FW":<4}  {"PMT s/n":<12}  {"HV s/n":<12}  {"FEB s/n":<12}  {"Vref":>6}  {"slope":>7}  {"offset":>7}  {"discr":>5}', fg=cmd2.ansi.Fg.LIGHT_CYAN))
+        for addr, entry in sorted(boards.items()):
+            self.poutput(f'{addr:>4}  {entry["devid"]:>10}  {entry["fwver"]:<4}  {entry["pmtsn"]:<12}  {entry["hvsn"]:<12}  {entry["febsn"]:<12}  {entry["vref"]:>6}  {entry["calibm"]:>7}  {entry["calibq"]:>7}  {entry["calibt"]:>5}')
+        if args.cached:
+            self.poutput(f'{len(boards)} boards from cache {inventory.cachefile}')
+        else:
+            self.poutput(f'inventory time: {result.elapsed * 1000:.0f} ms - {len(result.validated)} unchanged, {len(result.read)} read, {len(result.failed)} failed')
+        if args.output:
+            try:
+                writeInventory(args.output, boards)
+            except OSError as e:
+                self.perror(f'E: {e}')
+                return
+            self.poutput(f'inventory written to {args.output}')
+
+    #
+    # busstats
+    #
+    busstats_parser = argparse.ArgumentParser()
+    busstats_parser.add_argument('action', nargs='?', default='show', choices=['show', 'on', 'off', 'reset'], help='action (default: %(default)s)')
+
+    @cmd2.with_argparser(busstats_parser)
+    @cmd2.with_category("High Voltage commands")
+    def do_busstats(self, args: argparse.Namespace) -> None:
+        """Show bus transaction statistics"""
+        if args.action == 'on':
+            self.hv.enableStats(True)
+        elif args.action == 'off':
+            self.hv.enableStats(False)
+        elif args.action == 'reset':
+            self.hv.resetStats()
+        else:
+            if not self.hv.client.busStats.enabled:
+                self.pwarning('bus statistics disabled - use "busstats on" or start with --stats')
+            self.poutput(cmd2.ansi.style(f'{"addr": >4} {"fc": >3} {"count": >7} {"err": >5} {"tmo": >5} {"exc": >5} {"avg": >7} {"p50": >6} {"p99": >6} {"max": >7} {"tx": >9} {"rx": >9}', fg=cmd2.ansi.Fg.LIGHT_CYAN))
+            self.poutput(cmd2.ansi.style(f'{"": >4} {"": >3} {"": >7} {"": >5} {"": >5} {"": >5} {"[ms]": >7} {"[ms]": >6} {"[ms]": >6} {"[ms]": >7} {"[B]": >9} {"[B]": >9}', fg=cmd2.ansi.Fg.LIGHT_BLUE))
+            for slave, functions in self.hv.stats().items():
+                for fc, st in functions.items():
+                    self.poutput(f'{slave: >4} {fc: >3} {st["count"]: >7} {st["errors"]: >5} {st["timeouts"]: >5} {st["exceptions"]: >5} {st["avg_ms"]: >7.2f} {st["p50_ms"]: >6g} {st["p99_ms"]: >6g} {st["max_ms"]: >7.2f} {st["txbytes"]: >9} {st["rxbytes"]: >9}')
 
     #
     # threshold
@@ -373,17 +716,17 @@ class HighVoltageApp(cmd2.Cmd):
     def serial_pmt(self, args):
         if self.checkConnection() is False:
             return
-        if self.checkLength(args.value, 12): self.hv.setPMTSerialNumber(args.sn)
+        if self.checkLength(args.sn, 12): self.hv.setPMTSerialNumber(args.sn)
 
     def serial_hv(self, args):
         if self.checkConnection() is False:
             return
-        if self.checkLength(args.value, 12): self.hv.setHVSerialNumber(args.sn)
+        if self.checkLength(args.sn, 12): self.hv.setHVSerialNumber(args.sn)
 
     def serial_feb(self, args):
         if self.checkConnection() is False:
             return
-        if self.checkLength(args.value, 12): self.hv.setFEBSerialNumber(args.sn)
+        if self.checkLength(args.sn, 12): self.hv.setFEBSerialNumber(args.sn)
 
     pmt_parser.set_defaults(func=serial_pmt)
     hv_parser.set_defaults(func=serial_hv)
@@ -399,6 +742,7 @@ class HighVoltageApp(cmd2.Cmd):
         if func is not None:
             if self.checkPassword(getpass.getpass()):
                 func(self, args)
+                self.invalidateInventory()
             else:
                 self.perror(f'password not correct')
 
@@ -438,6 +782,7 @@ class HighVoltageApp(cmd2.Cmd):
             return
         if self.checkPassword(getpass.getpass()):
             self.hv.writeCalibSlope(args.value)
+            self.invalidateInventory()
         else:
             self.perror(f'password not correct')
 
@@ -455,6 +800,7 @@ class HighVoltageApp(cmd2.Cmd):
             return
         if self.checkPassword(getpass.getpass()):
             self.hv.writeCalibOffset(args.value)
+            self.invalidateInventory()
         else:
             self.perror(f'password not correct')
 
@@ -472,6 +818,7 @@ class HighVoltageApp(cmd2.Cmd):
             return
         if self.checkPassword(getpass.getpass()):
             self.hv.writeCalibDiscr(args.value)
+            self.invalidateInventory()
         else:
             self.perror(f'password not correct')
 
@@ -479,12 +826,24 @@ class HighVoltageApp(cmd2.Cmd):
     #
     # calibration
     #
+    calibration_parser = argparse.ArgumentParser()
+    calibration_parser.add_argument('-a', '--addresses', type=str, help='calibrate boards together, e.g. 1-19 (default: selected board)')
+    calibration_parser.add_argument('-t', '--tolerance', type=float, default=0.05, help='settling tolerance of the trimmed mean [V] (default: %(default)s)')
+
+    @cmd2.with_argparser(calibration_parser)
     @cmd2.with_category("High Voltage commands")
-    def do_calibration(self, _) -> None:
+    def do_calibration(self, args: argparse.Namespace) -> None:
         """Start calibration procedure"""
-        if self.checkConnection() is False:
+        if args.addresses is None and self.checkConnection() is False:
             return
 
+        if args.addresses is not None:
+            try:
+                addresses = parseAddressList(args.addresses)
+            except ValueError as e:
+                self.perror(f'E: {e}')
+                return
+
         if not self.checkPassword(getpass.getpass()):
             self.perror(f'password not correct')
             return
@@ -497,18 +856,26 @@ class HighVoltageApp(cmd2.Cmd):
         if str(ans).upper() != 'Y':
             return
 
+        # slope and offset are reset to 1/0 below
+        self.invalidateInventory(addresses if args.addresses is not None else None)
+
+        if args.addresses is not None:
+            self.calibrateBoards(addresses, args.tolerance)
+            return
+
         self.hv.writeCalibSlope(1)
         self.hv.writeCalibOffset(0)
 
         Vexpect = [25, 50, 100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1100, 1200, 1300, 1400]
         Vread = []
+        Vnoise = []
 
         self.poutput('set fast rampup/rampdown rate (25 V/s)')
-        self.hv.setRateRampup(25)
-        self.hv.setRateRampdown(25)
-
         self.poutput('start calibration with status=DOWN Vset=10V')
-        self.hv.setVoltageSet(10)
+        with self.hv.staged():
+            self.hv.setRateRampup(25)
+            self.hv.setRateRampdown(25)
+            self.hv.setVoltageSet(10)
         self.hv.powerOff()
         self.poutput(f'waiting for voltage < {Vexpect[0]}')
         self.printMonitorHeader()
@@ -534,27 +901,19 @@ class HighVoltageApp(cmd2.Cmd):
                 else:
                     self.printMonitorRow()
                     self.poutput(f'Vset = {v}V reached - collecting samples')
-                    # wait for voltage leveling
-                    time.sleep(2)
-                    Vtemp = []
                     self.printMonitorHeader()
-                    for _ in range(0,10):
-                        self.printMonitorRow()
-                        Vtemp.append(self.hv.getVoltage())
-                        time.sleep(0.5)
-                    Vmeas = np.array(Vtemp)
-                    # delete min/max elements
-                    Vmeas.sort()
-                    Vmeas = np.delete(Vmeas, 0)
-                    Vmeas = np.delete(Vmeas, len(Vmeas)-1)
-                    Vread.append(Vmeas.mean())
-                    self.poutput(f'{Vmeas}')
-                    self.poutput(f'mean = {Vmeas.mean()}')
+                    settle = self.hv.wait_stable('V', tolerance=args.tolerance, callback=lambda _: self.printMonitorRow())
+                    Vread.append(settle.mean)
+                    Vnoise.append(settle.noise())
+                    self.poutput(f'{sorted(settle.values)}')
+                    self.poutput(f'mean = {settle.mean} - noise = {settle.noise():.4f} - {settle.count} samples{"" if settle.stable else " (not settled)"}')
                     break
 
         self.poutput(f'Vexpect => {Vexpect}')
         self.poutput(f'Vread => {Vread}')
+        self.poutput(f'Vnoise => {[round(n, 4) for n in Vnoise]}')
 
+        import numpy as np
         x = np.array(Vread)
         y = np.array(Vexpect)
         # assemble matrix A
@@ -570,6 +929,7 @@ class HighVoltageApp(cmd2.Cmd):
         if str(ans).upper() == 'Y':
             self.hv.writeCalibSlope(float(alpha[0][0]))
             self.hv.writeCalibOffset(float(alpha[1][0]))
+            self.invalidateInventory()
             self.poutput('OK')
 
         self.poutput('stop calibration with status=DOWN Vset=10V')
@@ -578,12 +938,55 @@ class HighVoltageApp(cmd2.Cmd):
 
         self.prsuccess('calibration DONE!')
 
+    def invalidateInventory(self, addresses=None):
+        """Calibration and serial number writes - the cached inventory entry is re-read next time"""
+        from hvinventory import Inventory
+        Inventory(self.hv).invalidate([self.hv.address] if addresses is None else addresses)
+
+    def calibrateBoards(self, addresses, tolerance):
+        from hvcalib import CalibrationEngine
+        engine = CalibrationEngine(self.hv, addresses, tolerance=tolerance, progress=self.poutput)
+        boards = engine.run()
+
+        self.poutput(cmd2.ansi.style(f'{"addr": >4} {"slope": >10} {"offset": >10} {"rms": >8} {"max": >8}  result', fg=cmd2.ansi.Fg.LIGHT_CYAN))
+        self.poutput(cmd2.ansi.style(f'{"": >4} {"": >10} {"[V]": >10} {"[V]": >8} {"[V]": >8}', fg=cmd2.ansi.Fg.LIGHT_BLUE))
+        for addr, board in boards.items():
+            if board.ok():
+                worst = max(board.residuals, key=abs)
+                self.poutput(f'{addr: >4} {board.slope: >10.5f} {board.offset: >10.4f} {board.rms(): >8.4f} {worst: >8.4f}  OK')
+            else:
+                self.perror(f'{addr: >4} {"-": >10} {"-": >10} {"-": >8} {"-": >8}  {board.error}')
+        for addr, board in boards.items():
+            if board.ok():
+                self.poutput(f'address {addr} residuals [V] => {[round(r, 4) for r in board.residuals]}')
+                self.poutput(f'address {addr} noise [V] => {[round(n, 4) for n in board.noise]}')
+
+        if not engine.active():
+            self.perror('no board calibrated')
+            return
+
+        # write calibration registers
+        ans = self.read_input("\033[93mWARNING: do you want to write new calibration values ? (Y/N) \033[0m")
+        if str(ans).upper() == 'Y':
+            engine.write()
+            self.invalidateInventory([board.address for board in engine.active()])
+            self.poutput('OK')
+
+        self.prsuccess('calibration DONE!')
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--mode', default='rtu', const='rtu', nargs='?', choices=['rtu', 'tcp'], help='set modbus interface (default: %(default)s)')
+    parser.add_argument('--mode', default='rtu', const='rtu', nargs='?', choices=['rtu', 'tcp', 'broker'], help='set modbus interface, broker = through hvbroker.py (default: %(default)s)')
     parser.add_argument('--port', action='store', type=str, help='serial port device (default: /dev/ttyPS2)', default='/dev/ttyPS2')
     parser.add_argument('--host', action='store', type=str, help='mbusd hostname (default: localhost)', default='localhost')
+    parser.add_argument('--tcpport', action='store', type=int, help='mbusd TCP port (default: 502)', default=502)
+    parser.add_argument('--socket', action='store', type=str, help='hvbroker socket with --mode broker (default: /tmp/hvbroker-<port>.sock)')
+    parser.add_argument('--stats', action='store_true', help='collect bus transaction statistics from startup (see busstats)')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='run a single shell command and exit, e.g. off -a 1-19')
     args = parser.parse_args()
 
     app = HighVoltageApp(args)
+    if args.command:
+        app.onecmd_plus_hooks(shlex.join(args.command))
+        sys.exit(app.exit_code)
     app.cmdloop()
@@ -0,0 +1,227 @@
+import datetime
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+from hvmodbus import statusString, alarmString
+
+TRIPPED = (5, 6)             # TDN (ramping down after a trip) and TRIP
+
+class AlarmEvent:
+   __slots__ = ('address', 'kind', 'old', 'new', 'timestamp', 'severity')
+
+   def __init__(self, address, kind, old, new, timestamp):
+      self.address = address
+      self.kind = kind              # 'status', 'alarm' or 'comm'
+      self.old = old                # None on the first sample of a module
+      self.new = new
+      self.timestamp = timestamp    # acquisition time of the first sample in the new state
+      self.severity = self.classify()
+
+   def classify(self):
+      if self.kind == 'status':
+         if self.new in TRIPPED:
+            return 'trip'
+         return 'clear' if self.old in TRIPPED else 'info'
+      if self.kind == 'alarm':
+         return 'alarm' if self.new else 'clear'
+      return 'alarm' if self.new == 'lost' else 'clear'
+
+   def text(self, value):
+      if value is None:
+         return '-'
+      if self.kind == 'status':
+         return statusString(value)
+      if self.kind == 'alarm':
+         return alarmString(value)
+      return value
+
+   def describe(self):
+      return f'address {self.address} {self.kind} {self.text(self.old)} -> {self.text(self.new)}'
+
+   def asDict(self):
+      return {'address': self.address, 'kind': self.kind, 'severity': self.severity,
+              'old': self.text(self.old), 'new': self.text(self.new), 'timestamp': self.timestamp}
+
+class Debounce:
+   """Stable value of one signal - a new value is accepted after count consecutive samples"""
+
+   __slots__ = ('stable', 'candidate', 'seen', 'since')
+
+   def __init__(self):
+      self.stable = None
+      self.candidate = None
+      self.seen = 0
+      self.since = 0
+
+   def sample(self, value, timestamp, count):
+      """(old, timestamp) when value becomes the stable value, None otherwise"""
+      if value == self.stable:
+         self.seen = 0
+         return None
+      if self.seen and value == self.candidate:
+         self.seen += 1
+      else:
+         self.candidate = value
+         self.seen = 1
+         self.since = timestamp
+      if self.seen < count:
+         return None
+      old = self.stable
+      self.stable = value
+      self.seen = 0
+      return old, self.since
+
+class LogSink:
+   """Append one line per event to a text file"""
+
+   def __init__(self, filename):
+      self.fhand = open(filename, 'a')
+
+   def send(self, event):
+      stamp = datetime.datetime.fromtimestamp(event.timestamp).isoformat(timespec='milliseconds')
+      self.fhand.write(f'{stamp} {event.severity.upper():<5} {event.describe()}\n')
+      self.fhand.flush()
+
+   def close(self):
+      self.fhand.close()
+
+class SocketSink:
+   """One JSON datagram per event to a Unix datagram socket - dropped when nobody listens"""
+
+   def __init__(self, path):
+      self.path = path
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+      self.sock.setblocking(False)
+
+   def send(self, event):
+      try:
+         self.sock.sendto(json.dumps(event.asDict()).encode(), self.path)
+      except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+         pass
+
+   def close(self):
+      self.sock.close()
+
+class HookSink:
+   """Run a shell command per event, details in HV_* environment variables
+
+   The command is started and not waited for; finished commands are
+   reaped at the next event and on close.
+   """
+
+   def __init__(self, command, timeout=10):
+      self.command = command
+      self.timeout = timeout
+      self.running = []
+
+   def reap(self):
+      self.running = [proc for proc in self.running if proc.poll() is None]
+
+   def send(self, event):
+      self.reap()
+      env = dict(os.environ)
+      env.update({f'HV_{key.upper()}': str(value) for key, value in event.asDict().items()})
+      env['HV_MESSAGE'] = event.describe()
+      self.running.append(subprocess.Popen(self.command, shell=True, env=env, stdin=subprocess.DEVNULL))
+
+   def close(self):
+      deadline = time.monotonic() + self.timeout
+      for proc in self.running:
+         try:
+            proc.wait(max(deadline - time.monotonic(), 0))
+         except subprocess.TimeoutExpired:
+            proc.kill()
+      self.reap()
+
+class CallbackSink:
+   """Pass the event description to a function, e.g. print or Dashboard.message"""
+
+   def __init__(self, report):
+      self.report = report
+
+   def send(self, event):
+      self.report(f'{event.severity.upper()}: {event.describe()}')
+
+   def close(self):
+      pass
+
+class AlarmWatcher(threading.Thread):
+   """Status, alarm and communication transitions of every module, dispatched to sinks
+
+   feed() and lost() run in the poll loop: they compare the sample with
+   the debounced state of the module and queue an event on a transition,
+   never waiting on a sink. A new alarm or status value must be seen in
+   debounce consecutive samples; a trip (TDN, TRIP) is latched by the
+   board and is reported on the first sample. Events carry the
+   acquisition time of the first sample in the new state and are
+   delivered by this thread as soon as they are queued.
+   """
+
+   STOP = object()
+
+   def __init__(self, sinks, debounce=2, maxsize=1000):
+      super().__init__(name='hv-alarm', daemon=True)
+      self.sinks = sinks
+      self.debounce = max(1, debounce)
+      self.events = queue.Queue(maxsize)
+      self.state = {}         # (address, kind) -> Debounce
+      self.detected = 0
+      self.dispatched = 0
+      self.dropped = 0
+      self.errors = 0
+      self.maxDelay = 0.0
+
+   def signal(self, address, kind, value, timestamp, count):
+      state = self.state.get((address, kind))
+      if state is None:
+         state = self.state[(address, kind)] = Debounce()
+      change = state.sample(value, timestamp, count)
+      if change is None:
+         return
+      old, since = change
+      event = AlarmEvent(address, kind, old, value, since)
+      # the first sample of a module is reported only if it is not healthy
+      if old is None and event.severity not in ('trip', 'alarm'):
+         return
+      self.detected += 1
+      try:
+         self.events.put_nowait(event)
+      except queue.Full:
+         self.dropped += 1
+
+   def feed(self, snap):
+      self.signal(snap.address, 'status', snap.status, snap.timestamp, 1 if snap.status in TRIPPED else self.debounce)
+      self.signal(snap.address, 'alarm', snap.alarm, snap.timestamp, self.debounce)
+      self.signal(snap.address, 'comm', 'ok', snap.timestamp, 1)
+
+   def lost(self, address, timestamp=None):
+      self.signal(address, 'comm', 'lost', time.time() if timestamp is None else timestamp, self.debounce)
+
+   def run(self):
+      while True:
+         event = self.events.get()
+         if event is self.STOP:
+            break
+         for sink in self.sinks:
+            try:
+               sink.send(event)
+            except Exception as e:
+               self.errors += 1
+               print(f'E: alarm sink {type(sink).__name__} - {e}')
+         self.dispatched += 1
+         self.maxDelay = max(self.maxDelay, time.time() - event.timestamp)
+
+   def stop(self):
+      self.events.put(self.STOP)
+      self.join()
+      for sink in self.sinks:
+         sink.close()
+
+   def summary(self):
+      return (f'{self.detected} events, {self.dispatched} dispatched, {self.dropped} dropped (queue full), '
+              f'{self.errors} sink errors, max delay from acquisition {self.maxDelay * 1000:.0f} ms')
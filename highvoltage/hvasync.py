@@ -0,0 +1,104 @@
+import asyncio
+
+import pymodbus.client as ModbusClient
+from pymodbus import (
+    FramerType,
+    ModbusException,
+)
+
+from hvmodbus import (
+    COMMANDS,
+    snapshotPlan,
+)
+
+class AsyncHVModbus:
+   """asyncio HV poller keeping several Modbus transactions in flight
+
+   In tcp mode a small pool of connections to mbusd is opened, one per
+   transaction in flight, and mbusd queues the frames on the RS-485 line
+   back to back. In rtu mode the serial line is half duplex, so the pool
+   collapses to a single client.
+   """
+
+   def __init__(self, param, inflight=4):
+      self.param = param
+      self.inflight = inflight if param.mode == 'tcp' else 1
+      self.clients = []
+      self.splitSnapshot = set()
+
+   def newClient(self):
+      if self.param.mode == 'tcp':
+         return ModbusClient.AsyncModbusTcpClient(self.param.host, port=getattr(self.param, 'tcpport', 502), framer=FramerType.SOCKET)
+      return ModbusClient.AsyncModbusSerialClient(
+         self.param.port,
+         framer=FramerType.RTU,
+         baudrate=115200,
+         bytesize=8,
+         parity="N",
+         stopbits=1,
+         timeout=0.5
+      )
+
+   async def connect(self):
+      # connect the pool concurrently, each handshake costs a round trip or more
+      clients = [self.newClient() for _ in range(self.inflight)]
+      for client, ok in zip(clients, await asyncio.gather(*(client.connect() for client in clients))):
+         if ok:
+            self.clients.append(client)
+         else:
+            client.close()
+      return len(self.clients) > 0
+
+   def close(self):
+      for client in self.clients:
+         client.close()
+      self.clients = []
+
+   async def snapshot(self, slave, client=None):
+      client = self.clients[0] if client is None else client
+      plan = snapshotPlan(slave, self.splitSnapshot)
+      try:
+         address, count = next(plan)
+         while True:
+            address, count = plan.send(await client.read_holding_registers(address=address, count=count, slave=slave))
+      except StopIteration as done:
+         return done.value
+
+   async def run_all(self, addresses, job, errors=(ModbusException, OSError)):
+      """Run job(address, client) for every address over the client pool - returns {address: result}
+
+      A job raising one of errors (bus errors and a dropped connection by
+      default) gets the exception as its result, the other addresses carry on.
+      """
+      queue = asyncio.Queue()
+      for addr in addresses:
+         queue.put_nowait(addr)
+      result = dict.fromkeys(addresses)
+
+      async def worker(client):
+         while not queue.empty():
+            addr = queue.get_nowait()
+            try:
+               result[addr] = await job(addr, client)
+            except errors as e:
+               result[addr] = e
+
+      await asyncio.gather(*(worker(client) for client in self.clients))
+      return result
+
+   async def poll_all(self, addresses):
+      """Read a snapshot of every address - returns {address: HVSnapshot or None}"""
+      result = await self.run_all(addresses, self.snapshot)
+      return {addr: None if isinstance(snap, Exception) else snap for addr, snap in result.items()}
+
+   async def command(self, slave, client, name, value=None):
+      kind, address, fixed = COMMANDS[name]
+      if kind == 'coil':
+         rr = await client.write_coil(address=address, value=fixed, slave=slave)
+      else:
+         rr = await client.write_register(address=address, value=value, slave=slave)
+      return not rr.isError()
+
+   async def command_all(self, addresses, name, value=None):
+      """Apply a COMMANDS entry to every address - returns {address: True, False or exception}"""
+      return await self.run_all(addresses, lambda addr, client: self.command(addr, client, name, value))
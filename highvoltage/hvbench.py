@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from hvmodbus import HVModbus, closeClient
+from hvpipeline import (
+    RecordQueue,
+    CsvSink,
+    WriterStage,
+    DisplayStage,
+    CSV_FIELDS,
+    pollHandles,
+    csvRow,
+    monitorTable,
+    monitorLines,
+)
+from hvsched import FixedRateScheduler
+
+# bus: sweep in the poll thread, queue: hand-off to writer and display,
+# csv/display: writer and display threads, per sweep
+STAGES = ('bus', 'queue', 'csv', 'display')
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hvbench-baseline.json')
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class TimedCsvSink(CsvSink):
+    """hvmon CSV sink into memory, accumulating the time spent writing"""
+
+    def __init__(self):
+        super().__init__(io.StringIO(), CSV_FIELDS, csvRow)
+        self.elapsed = 0.0
+
+    def write(self, records):
+        start = time.perf_counter()
+        super().write(records)
+        self.elapsed += time.perf_counter() - start
+
+class Simulator:
+    """hvsim.py in a child process, so CPU figures only account for the client side"""
+
+    def __init__(self, boards, latency, tcpport, rtulink):
+        self.tcpport = tcpport
+        self.rtulink = rtulink
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hvsim.py'),
+               '-n', str(boards), '--tcp', f'127.0.0.1:{tcpport}', '--rtu', rtulink,
+               '--latency', str(latency), '--seed', '1']
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(rtulink):
+            if time.monotonic() > deadline or self.proc.poll() is not None:
+                raise RuntimeError('simulator did not start')
+            time.sleep(0.1)
+        time.sleep(0.5)
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+def runScenario(param, boards, period, duration):
+    """hvmon poll loop and pipeline over boards 1...n - returns timing figures of the scenario"""
+    bus = HVModbus(param)
+    addresses = list(range(1, boards + 1))
+    handles = [bus.handle(addr) for addr in addresses]
+    st = monitorTable()
+    stage = dict.fromkeys(STAGES, 0.0)
+
+    def render(latest):
+        start = time.perf_counter()
+        io.StringIO().write('\n'.join(monitorLines(st, addresses, latest)))
+        stage['display'] += time.perf_counter() - start
+
+    # same stages and defaults as hvmon, display at its default 1/period (10 Hz back to back)
+    records = RecordQueue(1000)
+    sink = TimedCsvSink()
+    writer = WriterStage(records, sink)
+    display = DisplayStage(render, 1 / period if period > 0 else 10)
+    writer.start()
+    display.start()
+    scheduler = FixedRateScheduler(period) if period > 0 else None
+    cycles = []
+    errors = 0
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        result = pollHandles(handles, addresses)
+        t1 = time.perf_counter()
+        for addr, snap in result:
+            # error responses (None) and timeouts or other bus exceptions
+            if snap is None or isinstance(snap, Exception):
+                errors += 1
+                continue
+            records.push(snap)
+            display.update(addr, snap)
+        t2 = time.perf_counter()
+        stage['bus'] += t1 - t0
+        stage['queue'] += t2 - t1
+        cycles.append(t2 - t0)
+        if scheduler is not None:
+            scheduler.wait()
+    elapsed = time.perf_counter() - start
+    display.stop()
+    writer.stop()
+    cpu = time.process_time() - cpu
+    closeClient(param)
+    stage['csv'] = sink.elapsed
+
+    n = len(cycles)
+    return {
+        'sweeps_s': n / elapsed,
+        'p50_ms': percentile(cycles, 50) * 1000,
+        'p99_ms': percentile(cycles, 99) * 1000,
+        'cpu_ms_sweep': cpu / n * 1000,
+        'errors': errors,
+        'stages_ms_sweep': {name: value / n * 1000 for name, value in stage.items()},
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, res in results.items():
+        ref = baseline.get(key)
+        if ref is None:
+            continue
+        if res['sweeps_s'] < ref['sweeps_s'] * (1 - tolerance):
+            regressions.append(f'{key}: sweeps/s {res["sweeps_s"]:.1f} < baseline {ref["sweeps_s"]:.1f}')
+        if res['p99_ms'] > ref['p99_ms'] * (1 + tolerance):
+            regressions.append(f'{key}: p99 {res["p99_ms"]:.2f} ms > baseline {ref["p99_ms"]:.2f} ms')
+        if res['cpu_ms_sweep'] > ref['cpu_ms_sweep'] * (1 + tolerance):
+            regressions.append(f'{key}: cpu/sweep {res["cpu_ms_sweep"]:.2f} ms > baseline {ref["cpu_ms_sweep"]:.2f} ms')
+        if res['errors'] > ref.get('errors', 0):
+            regressions.append(f'{key}: {res["errors"]} errors > baseline {ref.get("errors", 0)}')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HV monitoring benchmark against the local board simulator')
+    parser.add_argument('--modes', default='tcp,rtu', help='comma-separated modbus modes (default: %(default)s)')
+    parser.add_argument('--boards', default='1,5,10,19', help='comma-separated board counts (default: %(default)s)')
+    parser.add_argument('--periods', default='0,1', help='comma-separated poll periods [s], 0 = back to back (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per scenario (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated per-frame bus latency [s] (default: %(default)s)')
+    parser.add_argument('--tcpport', type=int, default=5020, help='simulator TCP port (default: %(default)s)')
+    parser.add_argument('--save', nargs='?', const=BASELINE, help='store results as baseline (default file: %(const)s)')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE, help='compare with baseline (default file: %(const)s)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    boardCounts = [int(x) for x in args.boards.split(',')]
+    periods = [float(x) for x in args.periods.split(',')]
+
+    rtulink = os.path.join(tempfile.mkdtemp(), 'ttyHV')
+    sim = Simulator(max(boardCounts), args.latency, args.tcpport, rtulink)
+
+    results = {}
+    try:
+        print(f'{"scenario": <22} {"sweeps/s": >9} {"p50": >8} {"p99": >8} {"cpu": >8} {"errors": >7}   ' + ' '.join(f'{s: >7}' for s in STAGES))
+        print(f'{"": <22} {"": >9} {"[ms]": >8} {"[ms]": >8} {"[ms]": >8} {"": >7}   ' + ' '.join(f'{"[ms]": >7}' for _ in STAGES))
+        for mode in modes:
+            param = argparse.Namespace(mode=mode, host='127.0.0.1', tcpport=args.tcpport, port=rtulink, stats=False)
+            for boards in boardCounts:
+                for period in periods:
+                    key = f'{mode}/{boards}/{period:g}s'
+                    res = runScenario(param, boards, period, args.duration)
+                    results[key] = res
+                    print(f'{key: <22} {res["sweeps_s"]: >9.2f} {res["p50_ms"]: >8.2f} {res["p99_ms"]: >8.2f} {res["cpu_ms_sweep"]: >8.2f} {res["errors"]: >7}   ' +
+                          ' '.join(f'{res["stages_ms_sweep"][s]: >7.3f}' for s in STAGES))
+    finally:
+        sim.close()
+
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                regressions = compare(results, json.load(f)['results'], args.tolerance)
+        except OSError as e:
+            print(f'E: baseline not readable - {e}')
+            sys.exit(-1)
+        for msg in regressions:
+            print(f'W: regression {msg}')
+        if regressions:
+            sys.exit(1)
+        print('I: no regression against baseline')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'host': platform.node(), 'python': platform.python_version(),
+                       'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'latency': args.latency, 'duration': args.duration, 'results': results}, f, indent=1)
+            f.write('\n')
+        print(f'I: baseline saved to {args.save}')
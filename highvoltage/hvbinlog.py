@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import array
+import json
+import mmap
+import struct
+import sys
+import time
+
+# column name, numpy dtype, array typecode
+SCHEMA = (
+   ('timestamp', '<i8', 'q'),     # acquisition time [us since epoch]
+   ('address', 'u1', 'B'),
+   ('status', 'u1', 'B'),
+   ('alarm', '<u2', 'H'),
+   ('Vset', '<u2', 'H'),
+   ('V', '<f4', 'f'),
+   ('I', '<f4', 'f'),
+   ('T', '<f4', 'f'),
+)
+
+VERSION = 1
+FILE_MAGIC = b'HVBL'
+BLOCK_MAGIC = b'HVDB'
+INDEX_MAGIC = b'HVIX'
+TRAILER_MAGIC = b'HVIE'
+
+FILE_HEADER = struct.Struct('<4sHI')          # magic, version, schema json length
+BLOCK_HEADER = struct.Struct('<4sIqqI4x')     # magic, records, tmin, tmax, address mask
+INDEX_HEADER = struct.Struct('<4sI')          # magic, entries
+INDEX_ENTRY = struct.Struct('<QIqqI')         # block offset, records, tmin, tmax, address mask
+INDEX_TRAILER = struct.Struct('<QQ4s4x')      # previous index offset (0 = none), this index offset, magic
+
+def align8(n):
+   return (n + 7) & ~7
+
+class BinLogWriter:
+   """Append-only columnar HV log - a sink for hvpipeline.WriterStage
+
+   Records are buffered per column and written as one data block per
+   flush (or every blockSize records). Every indexEvery blocks, and on
+   close, an index block lists the preceding data blocks with their time
+   range and address mask and links back to the previous index.
+   """
+
+   def __init__(self, fhand, blockSize=4096, indexEvery=64):
+      self.fhand = fhand
+      self.blockSize = blockSize
+      self.indexEvery = indexEvery
+      self.columns = [array.array(typecode) for _, _, typecode in SCHEMA]
+      self.unindexed = []
+      self.lastIndex = 0
+      schema = json.dumps({'schema': [[name, dtype] for name, dtype, _ in SCHEMA],
+                           'created': time.time(), 'index_every': indexEvery}).encode()
+      header = FILE_HEADER.pack(FILE_MAGIC, VERSION, len(schema)) + schema
+      self.fhand.write(header + bytes(align8(len(header)) - len(header)))
+
+   def append(self, snap):
+      c = self.columns
+      c[0].append(int(snap.timestamp * 1000000))
+      c[1].append(snap.address)
+      c[2].append(snap.status)
+      c[3].append(snap.alarm)
+      c[4].append(snap.Vset)
+      c[5].append(snap.V)
+      c[6].append(snap.I)
+      c[7].append(snap.T)
+      if len(c[0]) >= self.blockSize:
+         self.writeBlock()
+
+   def write(self, records):
+      for snap in records:
+         self.append(snap)
+
+   def writeBlock(self):
+      nrec = len(self.columns[0])
+      if nrec == 0:
+         return
+      tmin, tmax = min(self.columns[0]), max(self.columns[0])
+      mask = 0
+      for addr in set(self.columns[1]):
+         mask |= 1 << addr
+      offset = self.fhand.tell()
+      self.fhand.write(BLOCK_HEADER.pack(BLOCK_MAGIC, nrec, tmin, tmax, mask))
+      for column in self.columns:
+         if sys.byteorder == 'big':
+            column.byteswap()
+         data = column.tobytes()
+         self.fhand.write(data + bytes(align8(len(data)) - len(data)))
+      self.columns = [array.array(typecode) for _, _, typecode in SCHEMA]
+      self.unindexed.append((offset, nrec, tmin, tmax, mask))
+      if len(self.unindexed) >= self.indexEvery:
+         self.writeIndex()
+
+   def writeIndex(self):
+      if not self.unindexed:
+         return
+      offset = self.fhand.tell()
+      self.fhand.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self.unindexed)))
+      for entry in self.unindexed:
+         self.fhand.write(INDEX_ENTRY.pack(*entry))
+      self.fhand.write(INDEX_TRAILER.pack(self.lastIndex, offset, TRAILER_MAGIC))
+      self.lastIndex = offset
+      self.unindexed = []
+
+   def flush(self):
+      self.writeBlock()
+      self.fhand.flush()
+
+   def close(self):
+      self.writeBlock()
+      self.writeIndex()
+      self.fhand.close()
+
+class BinLogReader:
+   """Memory-mapped reader returning NumPy columns filtered by module and time range
+
+   Only block headers (or the index chain of a closed file) are parsed to
+   select blocks; column data is viewed in place with numpy.frombuffer.
+   """
+
+   def __init__(self, filename):
+      import numpy as np
+      self.np = np
+      self.fhand = open(filename, 'rb')
+      self.mm = mmap.mmap(self.fhand.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, version, length = FILE_HEADER.unpack_from(self.mm, 0)
+      if magic != FILE_MAGIC or version != VERSION:
+         self.close()
+         raise ValueError(f'{filename}: not an HV binary log (version {VERSION})')
+      meta = json.loads(bytes(self.mm[FILE_HEADER.size:FILE_HEADER.size + length]))
+      self.names = [name for name, _ in meta['schema']]
+      self.dtypes = {name: np.dtype(dtype) for name, dtype in meta['schema']}
+      self.dataStart = align8(FILE_HEADER.size + length)
+      self.blocks = self.indexedBlocks()
+      if self.blocks is None:
+         self.blocks = self.scanBlocks()
+
+   def close(self):
+      self.mm.close()
+      self.fhand.close()
+
+   def indexedBlocks(self):
+      """Blocks from the index chain of a cleanly closed file, None otherwise"""
+      size = len(self.mm)
+      if size < self.dataStart + INDEX_TRAILER.size:
+         return None
+      prev, offset, magic = INDEX_TRAILER.unpack_from(self.mm, size - INDEX_TRAILER.size)
+      if magic != TRAILER_MAGIC:
+         return None
+      blocks = []
+      while True:
+         magic, n = INDEX_HEADER.unpack_from(self.mm, offset)
+         if magic != INDEX_MAGIC:
+            return None
+         start = offset + INDEX_HEADER.size
+         blocks[:0] = [INDEX_ENTRY.unpack_from(self.mm, start + i * INDEX_ENTRY.size) for i in range(n)]
+         if prev == 0:
+            return blocks
+         offset = prev
+         _, n = INDEX_HEADER.unpack_from(self.mm, offset)
+         prev, _, _ = INDEX_TRAILER.unpack_from(self.mm, offset + INDEX_HEADER.size + n * INDEX_ENTRY.size)
+
+   def scanBlocks(self):
+      """Walk block headers from the start - for files still being written"""
+      blocks = []
+      pos = self.dataStart
+      size = len(self.mm)
+      while pos + 4 <= size:
+         magic = self.mm[pos:pos + 4]
+         if magic == BLOCK_MAGIC and pos + BLOCK_HEADER.size <= size:
+            _, nrec, tmin, tmax, mask = BLOCK_HEADER.unpack_from(self.mm, pos)
+            length = BLOCK_HEADER.size + self.payloadSize(nrec)
+            if pos + length > size:
+               break    # block being written
+            blocks.append((pos, nrec, tmin, tmax, mask))
+            pos += length
+         elif magic == INDEX_MAGIC and pos + INDEX_HEADER.size <= size:
+            _, n = INDEX_HEADER.unpack_from(self.mm, pos)
+            pos += INDEX_HEADER.size + n * INDEX_ENTRY.size + INDEX_TRAILER.size
+         else:
+            break
+      return blocks
+
+   def payloadSize(self, nrec):
+      return sum(align8(nrec * self.dtypes[name].itemsize) for name in self.names)
+
+   def read(self, modules=None, start=None, stop=None, columns=None):
+      """Columns as NumPy arrays for the given modules and [start, stop] epoch seconds"""
+      np = self.np
+      columns = list(self.names) if columns is None else list(columns)
+      mask = 0
+      if modules is not None:
+         for addr in modules:
+            mask |= 1 << addr
+      tmin = None if start is None else int(start * 1000000)
+      tmax = None if stop is None else int(stop * 1000000)
+
+      parts = {name: [] for name in columns}
+      for offset, nrec, btmin, btmax, bmask in self.blocks:
+         if modules is not None and not (bmask & mask):
+            continue
+         if (tmin is not None and btmax < tmin) or (tmax is not None and btmin > tmax):
+            continue
+         base = offset + BLOCK_HEADER.size
+         views = {}
+         pos = base
+         for name in self.names:
+            dtype = self.dtypes[name]
+            views[name] = np.frombuffer(self.mm, dtype=dtype, count=nrec, offset=pos)
+            pos += align8(nrec * dtype.itemsize)
+         select = np.ones(nrec, dtype=bool)
+         if modules is not None:
+            select &= np.isin(views['address'], list(modules))
+         if tmin is not None:
+            select &= views['timestamp'] >= tmin
+         if tmax is not None:
+            select &= views['timestamp'] <= tmax
+         for name in columns:
+            parts[name].append(views[name][select])
+
+      return {name: (np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=self.dtypes[name])) for name in columns}
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='HV binary log reader')
+   parser.add_argument('filename', help='hvmon binary log')
+   parser.add_argument('-m', '--modules', help='comma-separated list of modules')
+   parser.add_argument('--start', type=float, help='start time [epoch s]')
+   parser.add_argument('--stop', type=float, help='stop time [epoch s]')
+   parser.add_argument('--csv', action='store_true', help='dump selected rows as CSV')
+   args = parser.parse_args()
+
+   reader = BinLogReader(args.filename)
+   modules = None if args.modules is None else [int(x) for x in args.modules.split(',')]
+   data = reader.read(modules, args.start, args.stop)
+   if args.csv:
+      names = list(data.keys())
+      print(','.join(names))
+      for row in zip(*(data[name] for name in names)):
+         print(','.join(str(v) for v in row))
+   else:
+      n = len(data['timestamp'])
+      print(f'I: {len(reader.blocks)} blocks, {n} records selected')
+      if n:
+         print(f'I: time range {data["timestamp"].min() / 1e6:.3f} - {data["timestamp"].max() / 1e6:.3f}, modules {sorted(set(data["address"].tolist()))}')
+   reader.close()
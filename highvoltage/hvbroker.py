@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import signal
+import socket
+import time
+from types import SimpleNamespace
+
+from pymodbus import (
+    ModbusException,
+)
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.bit_message import ReadCoilsResponse, WriteSingleCoilResponse
+from pymodbus.pdu.register_message import (
+    ReadHoldingRegistersResponse,
+    ReadInputRegistersResponse,
+    WriteMultipleRegistersResponse,
+    WriteSingleRegisterResponse,
+)
+
+from hvbrokerdefs import SAFETY, INTERACTIVE, MONITOR, PRIORITIES, socketPath
+
+READS = ('read_coils', 'read_holding_registers', 'read_input_registers')
+WRITES = ('write_coil', 'write_register', 'write_registers')
+
+POWER_COIL = 1
+
+# a broker transaction takes up to 3 s x 4 tries (pymodbus default timeout and retries),
+# a client waits for that plus the transactions queued ahead of it
+CLIENT_TIMEOUT = 30
+
+def ownerAlive(path):
+   """True if a broker accepts connections on the socket path, False for a stale socket"""
+   probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   try:
+      probe.connect(path)
+   except OSError:
+      return False
+   finally:
+      probe.close()
+   return True
+
+class Job:
+   __slots__ = ('fn', 'kwargs', 'key', 'priority', 'future', 'queued')
+
+   def __init__(self, fn, kwargs, key, priority, future):
+      self.fn = fn
+      self.kwargs = kwargs
+      self.key = key
+      self.priority = priority
+      self.future = future
+      self.queued = time.monotonic()
+
+class Broker:
+   """Single owner of a Modbus bus client, serving local clients over a Unix socket
+
+   Requests are newline-delimited JSON objects and are executed one at a
+   time, lowest priority value first (safety, interactive, monitor), FIFO
+   within a priority. A read of the same block (function, slave, address,
+   count) as one still queued or in progress shares its transaction; a
+   queued read is promoted when a more urgent client asks for it. Results
+   of reads are also reused for window seconds, until the next write to
+   that slave.
+   """
+
+   def __init__(self, client, path, window=0.05):
+      self.client = client
+      self.path = path
+      self.window = window
+      self.queue = asyncio.PriorityQueue()
+      self.seq = itertools.count()
+      self.inflight = {}      # read key -> Job queued or in progress
+      self.cache = {}         # read key -> (monotonic time, result)
+      # pymodbus sync clients are not thread-safe: one bus thread only
+      self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='hv-bus')
+      self.served = [0] * len(PRIORITIES)
+      self.merged = 0
+      self.cached = 0
+      self.maxWait = [0.0] * len(PRIORITIES)
+
+   def invalidate(self, slave):
+      for key in [key for key in self.cache if key[1] == slave]:
+         del self.cache[key]
+
+   def submit(self, fn, kwargs, priority):
+      loop = asyncio.get_running_loop()
+      key = None
+      if fn in READS:
+         key = (fn, kwargs.get('slave', 1), kwargs.get('address', 0), kwargs.get('count', 1))
+         hit = self.cache.get(key)
+         if hit is not None and time.monotonic() - hit[0] <= self.window:
+            self.cached += 1
+            future = loop.create_future()
+            future.set_result(hit[1])
+            return future
+         job = self.inflight.get(key)
+         if job is not None:
+            self.merged += 1
+            if priority < job.priority and not job.future.done():
+               # promote: the worker skips whichever entry comes second
+               job.priority = priority
+               self.queue.put_nowait((priority, next(self.seq), job))
+            return job.future
+      elif fn in WRITES:
+         self.invalidate(kwargs.get('slave', 1))
+      else:
+         raise ValueError(f'unsupported function {fn}')
+      job = Job(fn, kwargs, key, priority, loop.create_future())
+      if key is not None:
+         self.inflight[key] = job
+      self.queue.put_nowait((priority, next(self.seq), job))
+      return job.future
+
+   def execute(self, fn, kwargs):
+      try:
+         rr = getattr(self.client, fn)(**kwargs)
+      except ModbusIOException as e:
+         return {'ioerror': str(e)}
+      except ModbusException as e:
+         return {'error': str(e)}
+      if rr.isError():
+         return {'exception': getattr(rr, 'exception_code', 0), 'fc': rr.function_code & 0x7F}
+      return {'registers': list(rr.registers), 'bits': [bool(b) for b in rr.bits]}
+
+   async def worker(self):
+      loop = asyncio.get_running_loop()
+      while True:
+         priority, _, job = await self.queue.get()
+         if job.future.done():
+            continue
+         wait = time.monotonic() - job.queued
+         if wait > self.maxWait[job.priority]:
+            self.maxWait[job.priority] = wait
+         try:
+            result = await loop.run_in_executor(self.executor, self.execute, job.fn, job.kwargs)
+         except Exception as e:
+            result = e
+         self.served[job.priority] += 1
+         if job.key is not None:
+            if self.inflight.get(job.key) is job:
+               del self.inflight[job.key]
+            if isinstance(result, dict) and 'bits' in result:
+               self.cache[job.key] = (time.monotonic(), result)
+         else:
+            self.invalidate(job.kwargs.get('slave', 1))
+         # nobody may be waiting any more, e.g. the client is gone
+         if job.future.done():
+            continue
+         if isinstance(result, Exception):
+            job.future.set_exception(result)
+         else:
+            job.future.set_result(result)
+
+   async def reply(self, writer, lock, request):
+      try:
+         priority = min(max(int(request.get('priority', INTERACTIVE)), SAFETY), MONITOR)
+         future = self.submit(request['fn'], request.get('kwargs', {}), priority)
+         # shared with merged requests: a client going away must not cancel it
+         result = dict(await asyncio.shield(future))
+      except Exception as e:
+         result = {'error': str(e)}
+      result['id'] = request.get('id')
+      async with lock:
+         writer.write(json.dumps(result).encode() + b'\n')
+         await writer.drain()
+
+   async def handle(self, reader, writer):
+      # a client may pipeline requests - replies carry the request id
+      lock = asyncio.Lock()
+      tasks = set()
+      try:
+         while line := await reader.readline():
+            task = asyncio.create_task(self.reply(writer, lock, json.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+      except (ConnectionError, ValueError):
+         pass
+      finally:
+         for task in tasks:
+            task.cancel()
+         writer.close()
+
+   async def serve(self):
+      if os.path.exists(self.path):
+         if ownerAlive(self.path):
+            raise RuntimeError(f'broker already running on {self.path}')
+         os.remove(self.path)
+      server = await asyncio.start_unix_server(self.handle, path=self.path)
+      worker = asyncio.create_task(self.worker())
+      try:
+         async with server:
+            await server.serve_forever()
+      finally:
+         worker.cancel()
+         self.executor.shutdown()
+         os.remove(self.path)
+
+   def summary(self):
+      names = {v: k for k, v in PRIORITIES.items()}
+      lines = [f'{names[p]} - {self.served[p]} transactions, max queue wait {self.maxWait[p] * 1000:.1f} ms' for p in range(len(PRIORITIES))]
+      lines.append(f'{self.merged} reads merged with a pending transaction, {self.cached} served from the {self.window * 1000:g} ms window')
+      return lines
+
+class BrokerClient:
+   """Drop-in for the pymodbus sync client talking to an hvbroker
+
+   Writes switching the power coil off are always sent at safety
+   priority, every other request at the priority of the client.
+   """
+
+   RESPONSES = {
+      'read_coils': ReadCoilsResponse,
+      'read_holding_registers': ReadHoldingRegistersResponse,
+      'read_input_registers': ReadInputRegistersResponse,
+      'write_coil': WriteSingleCoilResponse,
+      'write_register': WriteSingleRegisterResponse,
+      'write_registers': WriteMultipleRegistersResponse,
+   }
+
+   def __init__(self, path, priority=INTERACTIVE, timeout=CLIENT_TIMEOUT):
+      self.path = path
+      self.priority = priority
+      self.sock = None
+      self.rfile = None
+      self.ids = itertools.count()
+      # timeouts and retries belong to the broker, kept for HVModbus.setTimeout
+      self.comm_params = SimpleNamespace(timeout_connect=timeout)
+      self.retries = None
+
+   def connect(self):
+      try:
+         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+         self.sock.settimeout(self.comm_params.timeout_connect)
+         self.sock.connect(self.path)
+      except OSError:
+         self.sock = None
+         return False
+      self.rfile = self.sock.makefile('rb')
+      return True
+
+   def close(self):
+      if self.sock is not None:
+         self.rfile.close()
+         self.sock.close()
+         self.sock = None
+
+   def request(self, fn, priority=None, **kwargs):
+      # reconnect after a timeout or a broker restart
+      if self.sock is None and not self.connect():
+         raise ModbusIOException(f'broker {self.path} not reachable')
+      rid = next(self.ids)
+      message = {'id': rid, 'fn': fn, 'kwargs': kwargs, 'priority': self.priority if priority is None else priority}
+      try:
+         self.sock.sendall(json.dumps(message).encode() + b'\n')
+         while True:
+            line = self.rfile.readline()
+            if not line:
+               raise ModbusIOException(f'broker {self.path} closed the connection')
+            result = json.loads(line)
+            if result.get('id') == rid:
+               break
+      except OSError as e:
+         self.close()
+         raise ModbusIOException(f'broker {self.path} - {e}')
+      if 'ioerror' in result:
+         raise ModbusIOException(result['ioerror'])
+      if 'error' in result:
+         raise ModbusException(result['error'])
+      if 'exception' in result:
+         return ExceptionResponse(result['fc'], result['exception'], dev_id=kwargs.get('slave', 1))
+      if fn in ('read_coils',):
+         return self.RESPONSES[fn](bits=result['bits'], dev_id=kwargs.get('slave', 1))
+      return self.RESPONSES[fn](registers=result['registers'], dev_id=kwargs.get('slave', 1))
+
+   def read_coils(self, address, count=1, slave=1):
+      return self.request('read_coils', address=address, count=count, slave=slave)
+
+   def read_holding_registers(self, address, count=1, slave=1):
+      return self.request('read_holding_registers', address=address, count=count, slave=slave)
+
+   def read_input_registers(self, address, count=1, slave=1):
+      return self.request('read_input_registers', address=address, count=count, slave=slave)
+
+   def write_coil(self, address, value, slave=1):
+      priority = SAFETY if address == POWER_COIL and not value else None
+      return self.request('write_coil', priority, address=address, value=value, slave=slave)
+
+   def write_register(self, address, value, slave=1):
+      return self.request('write_register', address=address, value=value, slave=slave)
+
+   def write_registers(self, address, values, slave=1):
+      return self.request('write_registers', address=address, values=list(values), slave=slave)
+
+if __name__ == '__main__':
+   from hvmodbus import openClient
+
+   parser = argparse.ArgumentParser(description='Modbus bus broker - single owner of a serial port or mbusd endpoint')
+   parser.add_argument('--mode', default='rtu', const='rtu', nargs='?', choices=['rtu', 'tcp'], help='set modbus interface (default: %(default)s)')
+   parser.add_argument('--port', action='store', type=str, help='serial port device (default: /dev/ttyPS1)', default='/dev/ttyPS1')
+   parser.add_argument('--host', action='store', type=str, help='mbusd hostname (default: localhost)', default='localhost')
+   parser.add_argument('--tcpport', action='store', type=int, help='mbusd TCP port (default: 502)', default=502)
+   parser.add_argument('--socket', action='store', type=str, help='Unix socket path (default: /tmp/hvbroker-<port or host-tcpport>.sock)')
+   parser.add_argument('--window', action='store', type=float, help='reuse read results for this long [s] (default: %(default)s)', default=0.05)
+   parser.add_argument('--stats', action='store_true', help='print bus transaction statistics on exit')
+   args = parser.parse_args()
+
+   # stop cleanly (socket removed, summary printed) when run as a service
+   signal.signal(signal.SIGTERM, signal.default_int_handler)
+   path = socketPath(args)
+   broker = Broker(openClient(args), path, window=args.window)
+   print(f'I: broker for {args.mode} {args.port if args.mode == "rtu" else args.host} on {path}')
+   try:
+      asyncio.run(broker.serve())
+   except RuntimeError as e:
+      print(f'E: {e}')
+      exit(1)
+   except KeyboardInterrupt:
+      pass
+   for line in broker.summary():
+      print(f'I: {line}')
+   if args.stats:
+      for slave, functions in broker.client.busStats.stats().items():
+         for fc, st in functions.items():
+            print(f'I: address {slave} fc {fc} - {st["count"]} transactions, {st["errors"]} errors, {st["timeouts"]} timeouts, {st["exceptions"]} exceptions, avg {st["avg_ms"]:.2f} ms, p99 {st["p99_ms"]:g} ms, max {st["max_ms"]:.2f} ms')
+   print('Bye!')
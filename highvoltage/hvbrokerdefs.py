@@ -0,0 +1,18 @@
+import os
+
+# request priorities - lower is served first
+SAFETY = 0
+INTERACTIVE = 1
+MONITOR = 2
+PRIORITIES = {'safety': SAFETY, 'interactive': INTERACTIVE, 'monitor': MONITOR}
+
+def socketPath(param):
+   """Default broker socket of a serial port or mbusd endpoint"""
+   path = getattr(param, 'socket', None)
+   if path:
+      return path
+   if param.mode == 'tcp':
+      endpoint = f'{param.host}-{getattr(param, "tcpport", 502)}'
+   else:
+      endpoint = os.path.basename(param.port)
+   return f'/tmp/hvbroker-{endpoint}.sock'
@@ -0,0 +1,191 @@
+import time
+
+import numpy as np
+
+from hvsettle import SettleDetector
+
+STATUS_UP = 0
+STATUS_TRIP = 6
+
+VEXPECT = [25, 50, 100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1100, 1200, 1300, 1400]
+
+class BoardCalibration:
+   __slots__ = ('address', 'vread', 'samples', 'noise', 'slope', 'offset', 'residuals', 'error')
+
+   def __init__(self, address):
+      self.address = address
+      self.vread = []         # trimmed mean per setpoint
+      self.samples = []       # raw samples per setpoint
+      self.noise = []         # sample standard deviation per setpoint
+      self.slope = None
+      self.offset = None
+      self.residuals = []
+      self.error = None       # reason the board dropped out
+
+   def ok(self):
+      return self.error is None
+
+   def fit(self, setpoints):
+      x = np.array(self.vread)
+      y = np.array(setpoints[:len(self.vread)])
+      A = np.vstack([x, np.ones(len(x))]).T
+      (self.slope, self.offset), *_ = np.linalg.lstsq(A, y, rcond=None)
+      self.slope = float(self.slope)
+      self.offset = float(self.offset)
+      self.residuals = list(y - (self.slope * x + self.offset))
+
+   def rms(self):
+      return float(np.sqrt(np.mean(np.square(self.residuals)))) if self.residuals else 0
+
+class CalibrationEngine:
+   """Drive several HV boards through the calibration setpoints together
+
+   Every step (setpoint write, ramp wait, settle, sampling) is applied to
+   all boards before moving on, and reads are interleaved across the
+   slaves on the shared bus, so the wall time is about that of a single
+   board. Each board is fitted on its own; a board that trips or never
+   reaches a setpoint is dropped and powered off, the others carry on.
+   """
+
+   def __init__(self, hv, addresses, setpoints=VEXPECT, tolerance=0.05, minSamples=4, maxSamples=10, interval=0.5, poll=1, timeout=300, progress=print):
+      self.hv = hv
+      self.setpoints = list(setpoints)
+      self.tolerance = tolerance
+      self.minSamples = minSamples
+      self.maxSamples = maxSamples
+      self.interval = interval
+      self.poll = poll
+      self.timeout = timeout
+      self.progress = progress
+      self.boards = {addr: BoardCalibration(addr) for addr in addresses}
+
+   def active(self):
+      return [b for b in self.boards.values() if b.ok()]
+
+   def drop(self, board, reason):
+      board.error = reason
+      self.progress(f'E: address {board.address} dropped - {reason}')
+      try:
+         self.hv.powerOff(slave=board.address)
+      except Exception:
+         pass
+
+   def waitAll(self, predicate, what):
+      pending = self.active()
+      deadline = time.monotonic() + self.timeout
+      while pending:
+         for board in list(pending):
+            try:
+               snap = self.hv.snapshot(board.address)
+            except Exception as e:
+               self.drop(board, f'read error ({e})')
+               pending.remove(board)
+               continue
+            if snap is None:
+               continue
+            if snap.status == STATUS_TRIP:
+               self.drop(board, 'trip')
+               pending.remove(board)
+            elif predicate(snap):
+               pending.remove(board)
+         if not pending:
+            break
+         if time.monotonic() > deadline:
+            for board in pending:
+               self.drop(board, f'timeout waiting for {what}')
+            break
+         time.sleep(self.poll)
+
+   def setAll(self, vset):
+      for board in self.active():
+         try:
+            if not self.hv.setVoltageSet(vset, slave=board.address):
+               self.drop(board, f'Vset = {vset}V refused')
+         except Exception as e:
+            self.drop(board, f'write error ({e})')
+
+   def sample(self):
+      """Interleaved sampling rounds until every board settled - stores trimmed mean and noise"""
+      detectors = {board.address: SettleDetector(self.tolerance, minSamples=self.minSamples, maxSamples=self.maxSamples) for board in self.active()}
+      while True:
+         pending = [board for board in self.active() if not detectors[board.address].done()]
+         if not pending:
+            break
+         start = time.monotonic()
+         for board in pending:
+            try:
+               detectors[board.address].add(self.hv.getVoltage(slave=board.address))
+            except Exception as e:
+               self.drop(board, f'read error ({e})')
+         wait = self.interval - (time.monotonic() - start)
+         if wait > 0:
+            time.sleep(wait)
+
+      for board in self.active():
+         detector = detectors[board.address]
+         board.samples.append(sorted(detector.values))
+         board.vread.append(detector.mean)
+         board.noise.append(detector.noise())
+         if not detector.stable:
+            self.progress(f'W: address {board.address} not settled within {self.maxSamples} samples (noise {detector.noise():.4f} V)')
+
+   def setup(self, board):
+      self.hv.writeCalibSlope(1, slave=board.address)
+      self.hv.writeCalibOffset(0, slave=board.address)
+      with self.hv.staged(verify=False):
+         self.hv.setRateRampup(25, slave=board.address)
+         self.hv.setRateRampdown(25, slave=board.address)
+         self.hv.setVoltageSet(10, slave=board.address)
+      if self.hv.mismatch:
+         raise RuntimeError(f'registers {[hex(r) for r in self.hv.mismatch[board.address]]} refused')
+      self.hv.powerOff(slave=board.address)
+
+   def run(self):
+      # boards are always left at 10 V and powered off, also on Ctrl-C or an unexpected error
+      try:
+         for board in self.active():
+            try:
+               self.setup(board)
+            except Exception as e:
+               self.drop(board, f'write error ({e})')
+
+         self.progress(f'waiting for voltage < {self.setpoints[0]} on {len(self.active())} boards')
+         self.waitAll(lambda snap: snap.V < self.setpoints[0], f'voltage < {self.setpoints[0]}')
+
+         for board in self.active():
+            try:
+               if not self.hv.powerOn(slave=board.address):
+                  self.drop(board, 'power on refused')
+            except Exception as e:
+               self.drop(board, f'write error ({e})')
+
+         for v in self.setpoints:
+            if not self.active():
+               break
+            self.progress(f'Vset = {v}V on {len(self.active())} boards')
+            self.setAll(v)
+            time.sleep(1)
+            self.waitAll(lambda snap: snap.status == STATUS_UP, f'Vset = {v}V')
+            self.sample()
+
+         for board in self.active():
+            if len(board.vread) < 2:
+               self.drop(board, 'not enough setpoints for a fit')
+            else:
+               board.fit(self.setpoints)
+      finally:
+         self.finish()
+      return self.boards
+
+   def finish(self):
+      for board in self.boards.values():
+         try:
+            self.hv.setVoltageSet(10, slave=board.address)
+            self.hv.powerOff(slave=board.address)
+         except Exception:
+            pass
+
+   def write(self):
+      for board in self.active():
+         self.hv.writeCalibSlope(board.slope, slave=board.address)
+         self.hv.writeCalibOffset(board.offset, slave=board.address)
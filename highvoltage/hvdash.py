@@ -0,0 +1,118 @@
+import sys
+import time
+
+from hvmodbus import statusString, alarmString
+
+CSI = '\x1b['
+STYLES = {
+   None: '',
+   'red': CSI + '91m',
+   'yellow': CSI + '93m',
+   'green': CSI + '92m',
+   'cyan': CSI + '96m',
+   'blue': CSI + '94m',
+   'dim': CSI + '2m',
+}
+RESET = CSI + '0m'
+
+STATUS_STYLE = {0: 'green', 2: 'yellow', 3: 'yellow', 4: 'yellow', 5: 'yellow', 6: 'red'}
+
+class Column:
+   __slots__ = ('title', 'unit', 'width', 'cell', 'align')
+
+   def __init__(self, title, unit, width, cell, align='>'):
+      self.title = title
+      self.unit = unit
+      self.width = width
+      self.cell = cell        # snapshot -> (text, style)
+      self.align = align
+
+def statusCell(snap):
+   return statusString(snap.status), STATUS_STYLE.get(snap.status)
+
+def alarmCell(snap):
+   if snap.alarm == 0:
+      return 'none', None
+   return alarmString(snap.alarm), 'red'
+
+MONITOR_COLUMNS = (
+   Column('status', '', 6, statusCell, '^'),
+   Column('Vset', '[V]', 5, lambda s: (str(s.Vset), None)),
+   Column('V', '[V]', 9, lambda s: (f'{s.V:.3f}', None)),
+   Column('I', '[uA]', 7, lambda s: (f'{s.I:.3f}', None)),
+   Column('T', '[°C]', 7, lambda s: (f'{s.T}', None)),
+   Column('rate UP/DN', '[V/s]/[V/s]', 12, lambda s: (f'{s.rateUP}/{s.rateDN}', None)),
+   Column('limit V/I/T/TRIP', '[V]/[uA]/[°C]/[s]', 20, lambda s: (f'{s.limitV}/{s.limitI}/{s.limitT}/{s.limitTRIP}', None)),
+   Column('trigger thr', '[mV]', 13, lambda s: (str(s.threshold), None)),
+   Column('alarm', '', 14, alarmCell, '^'),
+)
+
+class Dashboard:
+   """Full-screen table with one fixed row per module, redrawn by cell
+
+   The screen is drawn once on start(); render() then positions the
+   cursor only on cells whose text or style changed since the previous
+   frame and writes the whole frame in one call, so output cost follows
+   the number of changes rather than rows x refresh rate. render() and
+   message() may be called from different threads, only render() writes.
+   """
+
+   ADDRESS_WIDTH = 4
+   TOP = 4                 # first module row (title and two header lines above)
+
+   def __init__(self, columns, addresses, title='', out=None, gap=2):
+      self.columns = columns
+      self.addresses = list(addresses)
+      self.title = title
+      self.out = sys.stdout if out is None else out
+      self.x = []
+      x = 1 + self.ADDRESS_WIDTH + gap
+      for column in columns:
+         self.x.append(x)
+         x += column.width + gap
+      self.drawn = {}         # (row, column) -> (text, style) on screen
+      self.footer = None
+      self.note = ''
+      self.frames = 0
+      self.cells = 0
+
+   def start(self):
+      frame = [CSI + '?1049h', CSI + '?25l', CSI + '2J', CSI + 'H', self.title]
+      for line, attr, style, first in ((2, 'title', 'cyan', 'addr'), (3, 'unit', 'blue', '')):
+         frame.append(f'{CSI}{line};1H{STYLES[style]}{first:>{self.ADDRESS_WIDTH}}')
+         for x, column in zip(self.x, self.columns):
+            frame.append(f'{CSI}{line};{x}H{getattr(column, attr):^{column.width}}')
+         frame.append(RESET)
+      for row, addr in enumerate(self.addresses):
+         frame.append(f'{CSI}{self.TOP + row};1H{addr:>{self.ADDRESS_WIDTH}}')
+      self.out.write(''.join(frame))
+      self.out.flush()
+
+   def message(self, text):
+      """Show text on the footer line at the next frame"""
+      self.note = text
+
+   def render(self, latest):
+      frame = []
+      for row, addr in enumerate(self.addresses):
+         snap = latest.get(addr)
+         for col, column in enumerate(self.columns):
+            cell = column.cell(snap) if snap is not None else ('-', 'dim')
+            if self.drawn.get((row, col)) == cell:
+               continue
+            self.drawn[(row, col)] = cell
+            text, style = cell
+            frame.append(f'{CSI}{self.TOP + row};{self.x[col]}H{STYLES[style]}{text[:column.width]:{column.align}{column.width}}{RESET if style else ""}')
+      self.cells += len(frame)
+      self.frames += 1
+      footer = f'{time.strftime("%H:%M:%S")}  {self.note}'
+      if footer != self.footer:
+         self.footer = footer
+         frame.append(f'{CSI}{self.TOP + len(self.addresses) + 1};1H{CSI}2K{footer}')
+      if frame:
+         self.out.write(''.join(frame))
+         self.out.flush()
+
+   def stop(self):
+      self.out.write(CSI + '?25h' + CSI + '?1049l')
+      self.out.flush()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import csv
+import datetime
+import math
+import sys
+
+from hvmodbus import MON_FIELDS
+
+# default deadbands: V [V], I [uA], T [°C] - every other field is recorded on any change
+DEADBANDS = {'V': 0.05, 'I': 0.01, 'T': 0.5}
+
+def parseDeadbands(spec):
+   """Parse 'V=0.05,I=0.01' into a deadband dict on top of DEADBANDS"""
+   deadbands = dict(DEADBANDS)
+   for item in filter(None, spec.split(',')):
+      field, _, value = item.partition('=')
+      if field not in MON_FIELDS:
+         raise ValueError(f'unknown field {field}')
+      deadbands[field] = float(value)
+   return deadbands
+
+class DeadbandSink:
+   """Change-only recording - wraps any hvpipeline sink
+
+   A record goes through only when a field moved by more than its
+   deadband from the last record written for that module (exact match
+   for fields without one), or when keyframe seconds passed since then.
+   Comparing against the last written record, not the last seen one,
+   keeps slow drifts from slipping through below the deadband. On close
+   the latest record of every module is written so a reconstruction
+   extends to the end of the run.
+   """
+
+   def __init__(self, sink, deadbands=DEADBANDS, keyframe=60.0):
+      self.sink = sink
+      self.deadbands = dict(deadbands)
+      self.exact = [field for field in MON_FIELDS if field not in self.deadbands]
+      self.keyframe = keyframe
+      self.written = {}       # address -> last record written
+      self.latest = {}        # address -> last record seen, when not written
+      self.seen = 0
+      self.kept = 0
+
+   def changed(self, last, snap):
+      if snap.timestamp - last.timestamp >= self.keyframe:
+         return True
+      for field in self.exact:
+         if getattr(snap, field) != getattr(last, field):
+            return True
+      for field, band in self.deadbands.items():
+         if abs(getattr(snap, field) - getattr(last, field)) > band:
+            return True
+      return False
+
+   def write(self, records):
+      kept = []
+      for snap in records:
+         self.seen += 1
+         last = self.written.get(snap.address)
+         if last is None or self.changed(last, snap):
+            kept.append(snap)
+            self.written[snap.address] = snap
+            self.latest.pop(snap.address, None)
+         else:
+            self.latest[snap.address] = snap
+      if kept:
+         self.kept += len(kept)
+         self.sink.write(kept)
+
+   def flush(self):
+      self.sink.flush()
+
+   def close(self):
+      tail = sorted(self.latest.values(), key=lambda snap: snap.timestamp)
+      if tail:
+         self.kept += len(tail)
+         self.sink.write(tail)
+      self.sink.close()
+
+def readRows(filename):
+   """Rows of an hvmon CSV or binary log as (fields, [dict]) with a float timestamp"""
+   if filename.endswith('.hvb'):
+      from hvbinlog import BinLogReader
+      reader = BinLogReader(filename)
+      data = reader.read()
+      reader.close()
+      fields = list(data.keys())
+      # float32 columns back to the 3-4 digits the boards report
+      columns = [data[name].astype(float).round(4).tolist() if data[name].dtype.kind == 'f' else data[name].tolist() for name in fields]
+      rows = [dict(zip(fields, values)) for values in zip(*columns)]
+      for row in rows:
+         row['timestamp'] /= 1000000
+      return fields, rows
+   with open(filename, newline='') as fhand:
+      reader = csv.DictReader(fhand)
+      rows = list(reader)
+   for row in rows:
+      row['timestamp'] = float(row['timestamp'])
+   return reader.fieldnames, rows
+
+def reconstruct(rows, period, start=None, stop=None, maxHold=None):
+   """Resample change-only rows onto a regular grid per module (sample and hold)
+
+   Yields one row per module and grid instant, holding the last recorded
+   row. With maxHold, a module whose last row is older than maxHold
+   seconds (polling stopped or failed) is left out until the next row.
+   """
+   modules = {}
+   for row in sorted(rows, key=lambda row: row['timestamp']):
+      modules.setdefault(row['address'], []).append(row)
+   if not modules:
+      return
+   if start is None:
+      start = min(series[0]['timestamp'] for series in modules.values())
+   if stop is None:
+      stop = max(series[-1]['timestamp'] for series in modules.values())
+   position = dict.fromkeys(modules, 0)
+   for k in range(int(math.floor((stop - start) / period)) + 1):
+      t = start + k * period
+      for address, series in modules.items():
+         i = position[address]
+         while i + 1 < len(series) and series[i + 1]['timestamp'] <= t:
+            i += 1
+         position[address] = i
+         row = series[i]
+         if row['timestamp'] > t or (maxHold is not None and t - row['timestamp'] > maxHold):
+            continue
+         yield dict(row, timestamp=round(t, 3))
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='rebuild a regular time series from a change-only hvmon log')
+   parser.add_argument('filename', help='hvmon log recorded with --deadband (.csv or .hvb)')
+   parser.add_argument('-p', '--period', type=float, default=1.0, help='output period [s] (default: %(default)s)')
+   parser.add_argument('--start', type=float, help='start time [epoch s]')
+   parser.add_argument('--stop', type=float, help='stop time [epoch s]')
+   parser.add_argument('--max-hold', type=float, help='drop a module from the output when its last row is older than this [s] - use the keyframe interval plus a margin')
+   parser.add_argument('-o', '--output', help='output CSV (default: stdout)')
+   args = parser.parse_args()
+
+   fields, rows = readRows(args.filename)
+   fhand = open(args.output, 'w', newline='') if args.output else sys.stdout
+   writer = csv.DictWriter(fhand, fields, dialect='excel')
+   writer.writeheader()
+   for row in reconstruct(rows, args.period, args.start, args.stop, args.max_hold):
+      if 'time' in row:
+         row['time'] = datetime.datetime.fromtimestamp(row['timestamp'])
+      writer.writerow(row)
+   if args.output:
+      fhand.close()
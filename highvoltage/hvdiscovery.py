@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+from pymodbus import ModbusException
+from pymodbus.exceptions import ModbusIOException
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mpmt-board-cli')
+
+PRESENT = 'present'
+ABSENT = 'absent'
+AMBIGUOUS = 'ambiguous'
+
+def cacheFilename(param, name='hvprobe'):
+   if param.mode == 'tcp':
+      endpoint = f'tcp-{param.host}'
+   else:
+      endpoint = f'rtu-{param.port}'
+   endpoint = endpoint.replace(os.sep, '_')
+   return os.path.join(CACHE_DIR, f'{name}-{endpoint}.json')
+
+class ProbeResult:
+   __slots__ = ('found', 'elapsed', 'validated', 'scanned', 'retried')
+
+   def __init__(self):
+      self.found = {}         # address -> device id
+      self.elapsed = 0
+      self.validated = []     # addresses confirmed from cache
+      self.scanned = []       # addresses scanned with the presence check
+      self.retried = []       # ambiguous addresses retried with full timeout
+
+class HVDiscovery:
+   """HV bus discovery with short adaptive timeout and address map cache
+
+   Presence is checked by reading the device id (0x04-0x05), so the same
+   transaction both detects a slave and identifies it. The timeout starts
+   short and adapts to the slowest reply seen (x margin); only addresses
+   answering with garbage or an exception response are retried with the
+   full bus timeout. Every slot is probed on each run, a board may have
+   been added to an empty one: the cache only orders the scan, so that
+   known boards settle the timeout before the empty slots cost it. Through
+   a broker the timeouts are the broker's, they are not adapted.
+   """
+
+   def __init__(self, hv, cachefile=None, timeout=0.05, maxTimeout=0.5, margin=4):
+      self.hv = hv
+      self.cachefile = cacheFilename(hv.param) if cachefile is None else cachefile
+      self.minTimeout = timeout
+      self.maxTimeout = maxTimeout
+      self.margin = margin
+      self.timeout = timeout
+
+   def loadCache(self):
+      try:
+         with open(self.cachefile) as f:
+            return {int(addr): devid for addr, devid in json.load(f).items()}
+      except (OSError, ValueError):
+         return {}
+
+   def saveCache(self, found):
+      try:
+         os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+         tmpname = self.cachefile + '.tmp'
+         with open(tmpname, 'w') as f:
+            json.dump({str(addr): devid for addr, devid in sorted(found.items())}, f, indent=1)
+         os.replace(tmpname, self.cachefile)
+      except OSError as e:
+         print(f'W: probe cache not saved ({e})')
+
+   def setTimeout(self, timeout, retries=None):
+      if self.hv.param.mode == 'broker':
+         return None
+      return self.hv.setTimeout(timeout, retries)
+
+   def presence(self, addr):
+      start = time.perf_counter()
+      try:
+         rr = self.hv.client.read_holding_registers(address=0x04, count=2, slave=addr)
+      except ModbusIOException:
+         return ABSENT, None
+      except ModbusException:
+         return AMBIGUOUS, None
+
+      if isinstance(rr, ModbusIOException):
+         return ABSENT, None
+      if rr.isError():
+         # exception response: somebody answered at this address
+         return (PRESENT, None) if hasattr(rr, 'exception_code') else (AMBIGUOUS, None)
+
+      rtt = time.perf_counter() - start
+      self.timeout = min(self.maxTimeout, max(self.timeout, self.minTimeout, rtt * self.margin))
+      self.setTimeout(self.timeout)
+      return PRESENT, (rr.registers[1] << 16) + rr.registers[0]
+
+   def scan(self, addresses, result, cache=None):
+      cache = {} if cache is None else cache
+      ambiguous = []
+      for addr in addresses:
+         state, devid = self.presence(addr)
+         if state == PRESENT and devid is not None:
+            result.found[addr] = devid
+            if addr in cache and cache[addr] == devid:
+               result.validated.append(addr)
+               continue
+         elif state != ABSENT:
+            # garbage, or an exception response without the device id
+            ambiguous.append(addr)
+         result.scanned.append(addr)
+
+      if ambiguous:
+         self.setTimeout(self.maxTimeout)
+         for addr in ambiguous:
+            state, devid = self.presence(addr)
+            result.retried.append(addr)
+            if state == PRESENT:
+               # None: the board answers but its device id is unreadable
+               result.found[addr] = devid
+
+   def probe(self, addresses=range(1, 21), rescan=False):
+      """Probe addresses - the cached map is validated first, then the other slots are scanned"""
+      result = ProbeResult()
+      start = time.perf_counter()
+      self.timeout = self.minTimeout
+      previous = self.setTimeout(self.minTimeout, retries=0)
+
+      try:
+         cache = {} if rescan else self.loadCache()
+         addresses = list(addresses)
+         # cached boards first: their replies settle the adaptive timeout
+         # before the (mostly empty) remaining slots are scanned with it
+         ordered = [addr for addr in addresses if addr in cache] + [addr for addr in addresses if addr not in cache]
+         self.scan(ordered, result, cache)
+      finally:
+         if previous is not None:
+            self.hv.setTimeout(*previous)
+
+      # keep cached entries of addresses outside this probe
+      merged = {addr: devid for addr, devid in self.loadCache().items() if addr not in addresses}
+      merged.update(result.found)
+      self.saveCache(merged)
+
+      result.elapsed = time.perf_counter() - start
+      return result
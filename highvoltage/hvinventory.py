@@ -0,0 +1,133 @@
+import csv
+import json
+import os
+import time
+
+from pymodbus import ModbusException
+
+from hvmodbus import decodeString
+from hvdiscovery import cacheFilename
+
+FIELDS = ('devid', 'address', 'fwver', 'pmtsn', 'hvsn', 'febsn', 'vref', 'calibm', 'calibq', 'calibt', 'updated')
+
+class InventoryResult:
+   __slots__ = ('boards', 'elapsed', 'validated', 'read', 'failed')
+
+   def __init__(self):
+      self.boards = {}        # address -> inventory entry
+      self.elapsed = 0
+      self.validated = []     # addresses answered from cache after the identity check
+      self.read = []          # addresses (re)read with a full snapshot
+      self.failed = []
+
+class Inventory:
+   """Fleet table of HV boards keyed by device ID, cached on disk
+
+   An entry comes from a single snapshot read (0x00-0x34) and is reused
+   as long as the board at that address still reports the same device ID
+   and firmware version, checked with one 4-register read (0x02-0x05).
+   Writes to the calibration or serial number registers must invalidate()
+   the entry, the identity check does not see them. lookup() answers from
+   the cache alone, without bus traffic.
+   """
+
+   def __init__(self, hv, cachefile=None):
+      self.hv = hv
+      self.cachefile = cacheFilename(hv.param, 'hvinventory') if cachefile is None else cachefile
+      self.entries = self.loadCache()     # device id (str) -> entry
+
+   def loadCache(self):
+      try:
+         with open(self.cachefile) as f:
+            return json.load(f)
+      except (OSError, ValueError):
+         return {}
+
+   def saveCache(self):
+      try:
+         os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+         tmpname = self.cachefile + '.tmp'
+         with open(tmpname, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+         os.replace(tmpname, self.cachefile)
+      except OSError as e:
+         print(f'W: inventory cache not saved ({e})')
+
+   def identify(self, addr):
+      """(firmware version, device id) of the board at addr, None if it does not answer"""
+      rr = self.hv.client.read_holding_registers(address=0x02, count=4, slave=addr)
+      if rr.isError():
+         return None
+      return decodeString(rr.registers[0:1]), (rr.registers[3] << 16) + rr.registers[2]
+
+   def update(self, snap):
+      entry = {'devid': snap.devid, 'address': snap.address, 'fwver': snap.fwver,
+               'pmtsn': snap.pmtsn.strip(), 'hvsn': snap.hvsn.strip(), 'febsn': snap.febsn.strip(),
+               'vref': snap.vref, 'calibm': snap.calibm, 'calibq': snap.calibq, 'calibt': int(snap.calibt),
+               'updated': snap.timestamp}
+      self.claim(snap.address, snap.devid)
+      self.entries[str(snap.devid)] = entry
+      return entry
+
+   def claim(self, addr, devid):
+      # a board moved away from addr - keep its entry, drop the stale address
+      for key, entry in self.entries.items():
+         if entry['address'] == addr and key != str(devid):
+            entry['address'] = None
+
+   def invalidate(self, addresses):
+      """Drop the entries of the boards at addresses - they are re-read by the next collect()"""
+      stale = [key for key, entry in self.entries.items() if entry['address'] in addresses]
+      for key in stale:
+         del self.entries[key]
+      if stale:
+         self.saveCache()
+
+   def collect(self, addresses, refresh=False):
+      """Inventory entries of the boards at addresses - one transaction per unchanged board"""
+      result = InventoryResult()
+      start = time.perf_counter()
+      for addr in addresses:
+         try:
+            if not refresh:
+               ident = self.identify(addr)
+               if ident is None:
+                  result.failed.append(addr)
+                  continue
+               fwver, devid = ident
+               entry = self.entries.get(str(devid))
+               if entry is not None and entry['fwver'] == fwver:
+                  self.claim(addr, devid)
+                  entry['address'] = addr
+                  result.boards[addr] = entry
+                  result.validated.append(addr)
+                  continue
+            snap = self.hv.snapshot(slave=addr)
+         except ModbusException:
+            snap = None
+         if snap is None:
+            result.failed.append(addr)
+            continue
+         result.boards[addr] = self.update(snap)
+         result.read.append(addr)
+      self.saveCache()
+      result.elapsed = time.perf_counter() - start
+      return result
+
+   def lookup(self, addresses=None):
+      """Cached entries by address - no bus access"""
+      boards = {entry['address']: entry for entry in self.entries.values() if entry['address'] is not None}
+      if addresses is None:
+         return dict(sorted(boards.items()))
+      return {addr: boards[addr] for addr in addresses if addr in boards}
+
+def writeInventory(filename, boards):
+   """Write entries keyed by device ID - CSV for a .csv filename, JSON otherwise"""
+   entries = sorted(boards.values(), key=lambda entry: entry['devid'])
+   with open(filename, 'w', newline='') as f:
+      if filename.endswith('.csv'):
+         writer = csv.DictWriter(f, FIELDS, dialect='excel')
+         writer.writeheader()
+         writer.writerows(entries)
+      else:
+         json.dump({str(entry['devid']): entry for entry in entries}, f, indent=1)
@@ -1,4 +1,6 @@
 import struct
+import time
+from contextlib import contextmanager
 from sys import exit
 
 import pymodbus.client as ModbusClient
@@ -6,33 +8,208 @@ from pymodbus import (
     FramerType,
     ModbusException,
 )
+from pymodbus.pdu import ExceptionResponse
+
+from hvstats import BusStats, InstrumentedClient
+from hvsettle import wait_stable
+from hvbrokerdefs import PRIORITIES, socketPath
+
+SNAPSHOT_COUNT = 0x35      # holding registers 0x00...0x34 (info, monitoring, calibration)
+MONITOR_COUNT = 0x30       # holding registers 0x00...0x2F (info, monitoring)
+
+MON_FIELDS = ('status', 'Vset', 'V', 'I', 'T', 'rateUP', 'rateDN',
+              'limitV', 'limitI', 'limitT', 'limitTRIP', 'threshold', 'alarm')
+
+# single-transaction commands: coil written with a fixed value, or holding register taking the value
+COMMANDS = {
+   'powerOn': ('coil', 1, True),
+   'powerOff': ('coil', 1, False),
+   'reset': ('coil', 2, True),
+   'setLimitTriptime': ('register', 0x22, None),
+   'setRateRampup': ('register', 0x23, None),
+   'setRateRampdown': ('register', 0x24, None),
+   'setLimitCurrent': ('register', 0x25, None),
+   'setVoltageSet': ('register', 0x26, None),
+   'setLimitVoltage': ('register', 0x27, None),
+   'setThreshold': ('register', 0x2D, None),
+   'setLimitTemperature': ('register', 0x2F, None),
+}
+
+# status register 0x06 and alarm bits of register 0x2E
+STATUS_NAMES = ('UP', 'DOWN', 'RUP', 'RDN', 'TUP', 'TDN', 'TRIP')
+ALARM_BITS = ((1, 'OV'), (2, 'UV'), (4, 'OC'), (8, 'OT'))
+
+def statusString(statusCode):
+   return STATUS_NAMES[statusCode] if 0 <= statusCode < len(STATUS_NAMES) else 'undef'
+
+def alarmString(alarmCode):
+   if alarmCode == 0:
+      return 'none'
+   return ' '.join(name for bit, name in ALARM_BITS if alarmCode & bit)
+
+def parseAddressList(spec, minAddr=1, maxAddr=20):
+   """Parse an address list like '1-5,7,9-10' - returns a sorted list of addresses"""
+   addresses = set()
+   for item in spec.split(','):
+      item = item.strip()
+      if '-' in item:
+         first, last = (int(x) for x in item.split('-', 1))
+         addresses.update(range(first, last + 1))
+      elif item:
+         addresses.add(int(item))
+   if not addresses or min(addresses) < minAddr or max(addresses) > maxAddr:
+      raise ValueError(f'address list must be within {minAddr}-{maxAddr} - got "{spec}"')
+   return sorted(addresses)
+
+def decodeString(registers):
+   return struct.pack(f'>{len(registers)}H', *registers).decode(errors='replace')
+
+def decodeInt32(lsb, msb):
+   value = (msb << 16) + lsb
+   return value - (1 << 32) if value & 0x80000000 else value
+
+class HVSnapshot:
+   """Decoded copy of the HV board register map (0x00...0x34)"""
+
+   __slots__ = ('address', 'timestamp', 'registers', 'fwver', 'devid', 'pmtsn', 'hvsn', 'febsn',
+                'status', 'T', 'limitTRIP', 'rateUP', 'rateDN', 'limitI', 'Vset', 'limitV',
+                'I', 'V', 'vref', 'threshold', 'alarm', 'limitT',
+                'calibm', 'calibq', 'calibt')
+
+   def __init__(self, address, registers, timestamp=None):
+      r = registers
+      self.address = address
+      self.timestamp = timestamp    # acquisition time (response received)
+      self.registers = r            # raw block, republished by hvshm
+      self.fwver = decodeString(r[0x02:0x03])
+      self.devid = (r[0x05] << 16) + r[0x04]
+      self.pmtsn = decodeString(r[0x08:0x0E])
+      self.hvsn = decodeString(r[0x0E:0x14])
+      self.febsn = decodeString(r[0x14:0x1A])
+      self.status = r[0x06]
+      self.T = HVModbus.convertTemperature(r[0x07])
+      self.limitTRIP = r[0x22]
+      self.rateUP = r[0x23]
+      self.rateDN = r[0x24]
+      self.limitI = r[0x25]
+      self.Vset = r[0x26]
+      self.limitV = r[0x27]
+      self.I = decodeInt32(r[0x28], r[0x29]) / 1000
+      self.V = decodeInt32(r[0x2A], r[0x2B]) / 1000
+      self.vref = r[0x2C] / 10
+      self.threshold = r[0x2D]
+      self.alarm = r[0x2E]
+      self.limitT = r[0x2F]
+      if len(r) >= SNAPSHOT_COUNT:
+         self.calibm = decodeInt32(r[0x30], r[0x31]) / 10000
+         self.calibq = decodeInt32(r[0x32], r[0x33]) / 10000
+         self.calibt = r[0x34] / 1.6890722
+      else:
+         self.calibm = self.calibq = self.calibt = None
+
+   def info(self):
+      return self.fwver, self.pmtsn, self.hvsn, self.febsn, self.devid
+
+   def calib(self):
+      return self.calibm, self.calibq, self.calibt
+
+   def monData(self):
+      return {field: getattr(self, field) for field in MON_FIELDS}
+
+# bus clients shared by every HVModbus instance, keyed by endpoint
+clientPool = {}
+
+def poolKey(param):
+   if param.mode == 'tcp':
+      return ('tcp', param.host, getattr(param, 'tcpport', 502))
+   if param.mode == 'broker':
+      return ('broker', socketPath(param))
+   return ('rtu', param.port)
+
+def closeClient(param):
+   """Close the pooled bus client of the endpoint - the next openClient() connects again"""
+   client = clientPool.pop(poolKey(param), None)
+   if client is not None:
+      client.close()
+
+def openClient(param):
+   key = poolKey(param)
+   client = clientPool.get(key)
+   if client is not None:
+      return client
+
+   if param.mode == 'tcp':
+      client = ModbusClient.ModbusTcpClient(param.host, port=getattr(param, 'tcpport', 502), framer=FramerType.SOCKET)
+      if not client.connect():
+         print(f'E: host not reachable or mbusd not running ({param.host})')
+         exit(1) 
+   elif param.mode == 'rtu':
+      client = ModbusClient.ModbusSerialClient(
+         param.port, 
+         framer=FramerType.RTU, 
+         baudrate=115200,
+         bytesize=8,
+         parity="N",
+         stopbits=1,
+         timeout=0.5
+      )
+      if not client.connect():
+         print(f'E: port not available ({param.port})')
+         exit(1) 
+   elif param.mode == 'broker':
+      from hvbroker import BrokerClient
+      client = BrokerClient(key[1], priority=PRIORITIES[getattr(param, 'priority', 'interactive')])
+      if not client.connect():
+         print(f'E: broker not running ({key[1]})')
+         exit(1)
+
+   client = InstrumentedClient(client, BusStats(param.mode, enabled=getattr(param, 'stats', False)))
+   clientPool[key] = client
+   return client
+
+def snapshotPlan(slave, splitSnapshot):
+   """Reads of a snapshot, shared by the sync and asyncio clients
+
+   Generator yielding (address, count) of each holding register read and
+   sent its response; returns the HVSnapshot, or None on an error response.
+   """
+   if slave not in splitSnapshot:
+      rr = yield 0, SNAPSHOT_COUNT
+      if not rr.isError():
+         return HVSnapshot(slave, rr.registers, time.time())
+      if getattr(rr, 'exception_code', None) != ExceptionResponse.ILLEGAL_ADDRESS:
+         return None
+      # older firmware rejects reads crossing 0x2F - fall back to two transactions
+      splitSnapshot.add(slave)
+
+   rr = yield 0, MONITOR_COUNT
+   if rr.isError():
+      return None
+   registers = list(rr.registers)
+   rr = yield MONITOR_COUNT, SNAPSHOT_COUNT - MONITOR_COUNT
+   if rr.isError():
+      return None
+   registers.extend(rr.registers)
+   return HVSnapshot(slave, registers, time.time())
 
 class HVModbus:
-   def __init__(self, param):
+   def __init__(self, param, client=None):
       self.devset = [None] * 21     # 1...20 for new boards default address (20)
       self.dev = None
-      self.client = None
       self.address = None
       self.param = param
-
-      if self.param.mode == 'tcp':
-         self.client = ModbusClient.ModbusTcpClient(self.param.host, port=502, framer=FramerType.SOCKET)
-         if not self.client.connect():
-            print(f'E: host not reachable or mbusd not running ({self.param.host})')
-            exit(1) 
-      elif self.param.mode == 'rtu':
-         self.client = ModbusClient.ModbusSerialClient(
-            self.param.port, 
-            framer=FramerType.RTU, 
-            baudrate=115200,
-            bytesize=8,
-            parity="N",
-            stopbits=1,
-            timeout=0.5
-         )
-         if not self.client.connect():
-            print(f'E: port not available ({self.param.port})')
-            exit(1) 
+      self.splitSnapshot = set()    # slaves that refuse a single 0x00...0x34 read
+      self.staging = False
+      self.pending = {}             # slave -> {register: value} staged writes
+      self.mismatch = {}            # result of the last staged() flush
+      self.client = openClient(param) if client is None else client
+
+   def handle(self, addr):
+      """Lightweight view bound to slave addr, sharing this bus client"""
+      hv = HVModbus(self.param, client=self.client)
+      hv.splitSnapshot = self.splitSnapshot
+      hv.address = addr
+      return hv
 
    def open(self, addr):
       try:
@@ -47,12 +224,110 @@ class HVModbus:
       self.address = addr
       return True
       
+   def setTimeout(self, timeout, retries=None):
+      """Change the response timeout (and retries) of the bus client - returns the previous values"""
+      previous = (self.client.comm_params.timeout_connect, getattr(self.client, 'retries', None))
+      self.client.comm_params.timeout_connect = timeout
+      sock = getattr(self.client, 'socket', None)
+      if sock is not None:
+         if hasattr(sock, 'settimeout'):
+            sock.settimeout(timeout)
+         else:
+            sock.timeout = timeout
+      if retries is not None:
+         self.client.retries = retries
+         transaction = getattr(self.client, 'transaction', None)
+         if transaction is not None and hasattr(transaction, 'retries'):
+            transaction.retries = retries
+      return previous
+
+   def enableStats(self, enabled=True):
+      self.client.busStats.enabled = enabled
+
+   def resetStats(self):
+      self.client.busStats.reset()
+
+   def stats(self):
+      """Bus transaction statistics - {slave: {function code: {...}}}"""
+      return self.client.busStats.stats()
+
    def isConnected(self):
       return self.address is not None
 
    def getAddress(self):
       return self.address
 
+   def writeRegister(self, address, value, slave=None):
+      slave = self.address if slave is None else slave
+      if self.staging:
+         self.pending.setdefault(slave, {})[address] = value
+         return True
+      rr = self.client.write_register(address=address, value=value, slave=slave)
+      return not rr.isError()
+
+   def command(self, name, value=None, slave=None):
+      """Apply a COMMANDS entry - True if the board accepted it"""
+      slave = self.address if slave is None else slave
+      kind, address, fixed = COMMANDS[name]
+      if kind == 'coil':
+         # a coil would reach the board ahead of the registers buffered before it
+         if self.staging:
+            raise RuntimeError(f'{name} cannot be issued inside staged()')
+         rr = self.client.write_coil(address=address, value=fixed, slave=slave)
+         return not rr.isError()
+      return self.writeRegister(address, value, slave)
+
+   @contextmanager
+   def staged(self, verify=True):
+      """Buffer setpoint/rate/limit writes and flush them on exit as few write_registers as possible
+
+      Coil commands (powerOn, powerOff, reset) raise RuntimeError while staging - issue them after the block.
+      """
+      self.staging = True
+      try:
+         yield self
+      except BaseException:
+         self.pending = {}
+         raise
+      finally:
+         self.staging = False
+      self.mismatch = self.flush(verify)
+
+   def flush(self, verify=True):
+      """Write staged registers coalescing contiguous ranges - returns {slave: [mismatched registers]}
+
+      A register is reported when its write was refused or, with verify, when the readback differs.
+      """
+      pending, self.pending = self.pending, {}
+      mismatch = {}
+      for slave, regs in pending.items():
+         addresses = sorted(regs)
+         bad = set()
+         start = addresses[0]
+         for i, address in enumerate(addresses):
+            last = (i == len(addresses) - 1)
+            if not last and addresses[i + 1] == address + 1:
+               continue
+            values = [regs[a] for a in range(start, address + 1)]
+            if len(values) == 1:
+               rr = self.client.write_register(address=start, value=values[0], slave=slave)
+            else:
+               rr = self.client.write_registers(address=start, values=values, slave=slave)
+            if rr.isError():
+               bad.update(range(start, address + 1))
+            if not last:
+               start = addresses[i + 1]
+
+         if verify:
+            rr = self.client.read_holding_registers(address=addresses[0], count=addresses[-1] - addresses[0] + 1, slave=slave)
+            if rr.isError():
+               bad.update(addresses)
+            else:
+               bad.update(a for a in addresses if rr.registers[a - addresses[0]] != regs[a])
+         if bad:
+            mismatch[slave] = sorted(bad)
+      return mismatch
+
    def getStatus(self, slave=None):
       slave = self.address if slave is None else slave
       rr = self.client.read_holding_registers(address=6, count=1, slave=slave)
@@ -64,14 +339,18 @@ class HVModbus:
       rr.registers.reverse()
       return self.client.convert_from_registers(rr.registers, data_type=self.client.DATATYPE.INT32) / 1000
 
+   def wait_stable(self, quantity='V', slave=None, **kwargs):
+      """Sample V, I or T until it settles (see hvsettle.wait_stable) - returns the SettleDetector"""
+      slave = self.address if slave is None else slave
+      return wait_stable(self, quantity, slave, **kwargs)
+
    def getVoltageSet(self, slave=None):
       slave = self.address if slave is None else slave
       rr = self.client.read_holding_registers(address=0x26, count=1, slave=slave)
       return rr.registers[0]
 
    def setVoltageSet(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x26, value=value, slave=slave)
+      return self.command('setVoltageSet', value, slave)
 
    def getCurrent(self, slave=None):
       slave = self.address if slave is None else slave
@@ -95,12 +374,10 @@ class HVModbus:
          return rup, rdn
 
    def setRateRampup(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x23, value=value, slave=slave)
+      return self.command('setRateRampup', value, slave)
 
    def setRateRampdown(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x24, value=value, slave=slave)
+      return self.command('setRateRampdown', value, slave)
 
    def getLimit(self, fmt=str, slave=None):
       slave = self.address if slave is None else slave
@@ -117,24 +394,19 @@ class HVModbus:
          return lv, li, lt, ltt
 
    def setLimitVoltage(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x27, value=value, slave=slave)
+      return self.command('setLimitVoltage', value, slave)
 
    def setLimitCurrent(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x25, value=value, slave=slave)
+      return self.command('setLimitCurrent', value, slave)
 
    def setLimitTemperature(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x2F, value=value, slave=slave)
+      return self.command('setLimitTemperature', value, slave)
 
    def setLimitTriptime(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x22, value=value, slave=slave)
+      return self.command('setLimitTriptime', value, slave)
 
    def setThreshold(self, value, slave=None):
-      slave = self.address if slave is None else slave
-      self.client.write_register(address=0x2D, value=value, slave=slave)
+      return self.command('setThreshold', value, slave)
 
    def getThreshold(self, slave=None):
       slave = self.address if slave is None else slave
@@ -152,33 +424,21 @@ class HVModbus:
       return rr.registers[0]/10
 
    def powerOn(self, slave=None):
-      slave = self.address if slave is None else slave
-      rr = self.client.write_coil(address=1, value=True, slave=slave)
-      return not rr.isError()
+      return self.command('powerOn', slave=slave)
 
    def powerOff(self, slave=None):
-      slave = self.address if slave is None else slave
-      rr = self.client.write_coil(address=1, value=False, slave=slave)
-      return not rr.isError()
+      return self.command('powerOff', slave=slave)
 
    def reset(self, slave=None):
-      slave = self.address if slave is None else slave
-      rr = self.client.write_coil(address=2, value=True, slave=slave)
-      return not rr.isError()
+      return self.command('reset', slave=slave)
 
    def getInfo(self, slave=None):
+      """(fwver, pmtsn, hvsn, febsn, devid) - None on an error response"""
       slave = self.address if slave is None else slave
-      l = self.client.read_holding_registers(address=0x02, count=1, slave=slave).registers
-      fwver = struct.pack(f'>{len(l)}h', *l).decode()
-      l = self.client.read_holding_registers(address=0x08, count=6, slave=slave).registers
-      pmtsn = struct.pack(f'>{len(l)}h', *l).decode()
-      l = self.client.read_holding_registers(address=0x0E, count=6, slave=slave).registers
-      hvsn = struct.pack(f'>{len(l)}h', *l).decode()
-      l = self.client.read_holding_registers(address=0x14, count=6, slave=slave).registers
-      febsn = struct.pack(f'>{len(l)}h', *l).decode()
-      l = self.client.read_holding_registers(address=0x04, count=2, slave=slave).registers
-      devid = (l[1] << 16) + l[0]
-      return fwver, pmtsn, hvsn, febsn, devid
+      rr = self.client.read_holding_registers(address=0, count=MONITOR_COUNT, slave=slave)
+      if rr.isError():
+         return None
+      return HVSnapshot(slave, rr.registers).info()
 
    def setPMTSerialNumber(self, sn, slave=None):
       slave = self.address if slave is None else slave
@@ -202,27 +462,22 @@ class HVModbus:
    def readMonRegisters(self, slave=None):
       slave = self.address if slave is None else slave
 
-      monData = {}
-      rr = self.client.read_holding_registers(address=0, count=48, slave=slave)
+      rr = self.client.read_holding_registers(address=0, count=MONITOR_COUNT, slave=slave)
 
       if rr.isError():
          return None
 
-      monData['status'] = rr.registers[0x0006]
-      monData['Vset'] = rr.registers[0x0026]
-      monData['V'] = ((rr.registers[0x002B] << 16) + rr.registers[0x002A]) / 1000
-      monData['I'] = ((rr.registers[0x0029] << 16) + rr.registers[0x0028]) / 1000
-      monData['T'] = self.convertTemperature(rr.registers[0x0007])
-      monData['rateUP'] = rr.registers[0x0023]
-      monData['rateDN'] = rr.registers[0x0024]
-      monData['limitV'] = rr.registers[0x0027]
-      monData['limitI'] = rr.registers[0x0025]
-      monData['limitT'] = rr.registers[0x002F]
-      monData['limitTRIP'] = rr.registers[0x0022]
-      monData['threshold'] = rr.registers[0x002D]
-      monData['alarm'] = rr.registers[0x002E]
-      
-      return monData
+      return HVSnapshot(slave, rr.registers).monData()
+
+   def snapshot(self, slave=None):
+      slave = self.address if slave is None else slave
+      plan = snapshotPlan(slave, self.splitSnapshot)
+      try:
+         address, count = next(plan)
+         while True:
+            address, count = plan.send(self.client.read_holding_registers(address=address, count=count, slave=slave))
+      except StopIteration as done:
+         return done.value
 
    @staticmethod
    def convertTemperature(value):
@@ -231,25 +486,9 @@ class HVModbus:
        return round(q + i, 1)
 
    def readCalibRegisters(self, slave=None):
-      slave = self.address if slave is None else slave
-      rr = self.client.read_holding_registers(address=0x30, count=5, slave=slave)
-      mlsb = rr.registers[0]
-      mmsb = rr.registers[1]
-      qlsb = rr.registers[2]
-      qmsb = rr.registers[3]
-      calibt = rr.registers[4]
-
-      calibm = ((mmsb << 16) + mlsb)
-      calibm = struct.unpack('l', struct.pack('L', calibm & 0xffffffff))[0]
-      calibm = calibm / 10000
-
-      calibq = ((qmsb << 16) + qlsb)
-      calibq = struct.unpack('l', struct.pack('L', calibq & 0xffffffff))[0]
-      calibq = calibq / 10000
-
-      calibt = calibt / 1.6890722
-
-      return calibm, calibq, calibt
+      """(calibm, calibq, calibt) - None on an error response"""
+      snap = self.snapshot(slave)
+      return None if snap is None else snap.calib()
 
    def writeCalibSlope(self, slope, slave=None):
       slave = self.address if slave is None else slave
@@ -2,161 +2,263 @@
 # coding=utf-8
 
 import argparse
-import copy
-import csv
 import os
 import datetime
 import time
 import sys
-from cmd2.table_creator import (
-    Column,
-    SimpleTable,
-    HorizontalAlignment
-)
-from typing import (
-    List,
-)
-from hvmodbus import HVModbus
-
-def alarmString(alarmCode):
-    msg = ' '
-    if (alarmCode == 0):
-        return 'none'
-    if (alarmCode & 1):
-        msg = msg + 'OV '
-    if (alarmCode & 2):
-        msg = msg + 'UV '
-    if (alarmCode & 4):
-        msg = msg + 'OC '
-    if (alarmCode & 8):
-        msg = msg + 'OT '
-    return self.alarm_red(msg)
-
-def statusString(statusCode):
-    if (statusCode == 0):
-        return 'UP'
-    elif (statusCode == 1):
-        return 'DOWN'
-    elif (statusCode == 2):
-        return 'RUP'
-    elif (statusCode == 3):
-        return 'RDN'
-    elif (statusCode == 4):
-        return 'TUP'
-    elif (statusCode == 5):
-        return 'TDN'
-    elif (statusCode == 6):
-        return 'TRIP'
-    else:
-        return 'undef'
 
-def printHeader():
-    print(st.generate_data_row(['addr','status','Vset','V','I','T','rate UP/DN','limit V/I/T/TRIP','trigger thr','alarm']))
-    print(st.generate_data_row(['','','[V]','[V]','[uA]','[°C]','[V/s]/[V/s]','[V]/[uA]/[°C]/[s]','[mV]','']))
+# optional features (--aio, --format bin, --rotate-*, --deadband, --shm, --dashboard)
+# and the scrolling table import their modules only when selected
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--mode', default='rtu', const='rtu', nargs='?', choices=['rtu', 'tcp'], help='set modbus interface (default: %(default)s)') 
+parser.add_argument('--mode', default='rtu', const='rtu', nargs='?', choices=['rtu', 'tcp', 'broker'], help='set modbus interface, broker = through hvbroker.py (default: %(default)s)') 
 parser.add_argument('--host', action='store', type=str, help='mbusd hostname (default: localhost)', default='localhost')
+parser.add_argument('--tcpport', action='store', type=int, help='mbusd TCP port (default: 502)', default=502)
+parser.add_argument('--socket', action='store', type=str, help='hvbroker socket with --mode broker (default: /tmp/hvbroker-<port>.sock)')
 parser.add_argument('--port', action='store', type=str, help='serial port device (default: /dev/ttyPS1)', default='/dev/ttyPS1')
-parser.add_argument('--freq', action='store', type=int, help='monitoring frequency (default: 1 second)', default=1)
+parser.add_argument('--freq', action='store', type=float, help='monitoring period in seconds, sub-second allowed (default: 1 second)', default=1)
 parser.add_argument('-m', '--modules', help='comma-separated list of modules to monitor', required=True)
 parser.add_argument('-f', '--filename', action='store', type=str, help='output filename')
-parser.add_argument('-l', '--filelabel', action='store', type=str, help='output filename <label>-<YYYYMMDD>-<HHMM>.csv')
+parser.add_argument('-l', '--filelabel', action='store', type=str, help='output filename <label>-<YYYYMMDD>-<HHMM>.csv (.hvb with --format bin)')
+parser.add_argument('--format', default='csv', choices=['csv', 'bin'], help='output format - bin is the columnar log read by hvbinlog.py (default: %(default)s)')
+parser.add_argument('--deadband', nargs='?', const='', metavar='FIELD=BAND,...', help='change-only recording: write a row only when a field moves beyond its deadband (default: V=0.05,I=0.01,T=0.5, any change for other fields)')
+parser.add_argument('--keyframe', action='store', type=float, help='with --deadband, write every module at least this often [s] (default: %(default)s)', default=60.0)
+parser.add_argument('--rotate-size', action='store', type=float, metavar='MB', help='start a new output segment when the current one reaches this size')
+parser.add_argument('--rotate-time', action='store', type=float, metavar='S', help='start a new output segment every S seconds of data')
+parser.add_argument('--compress', action='store_true', help='gzip closed segments in the background (with --rotate-size/--rotate-time)')
+parser.add_argument('--shm', nargs='?', const='hvmon', metavar='NAME', help='publish the latest record of every module in shared memory NAME (default: %(const)s) for hv.py mon/info --shm - without -f/-l nothing is recorded')
+parser.add_argument('--alarm-log', action='store', type=str, metavar='FILE', help='append status, alarm and communication transitions to FILE')
+parser.add_argument('--alarm-socket', action='store', type=str, metavar='PATH', help='send transitions as JSON datagrams to Unix socket PATH')
+parser.add_argument('--alarm-hook', action='store', type=str, metavar='CMD', help='run shell command CMD on every transition, details in HV_* environment variables')
+parser.add_argument('--alarm-debounce', action='store', type=int, help='consecutive samples before an alarm or status change is reported, trips are reported at once (default: %(default)s)', default=2)
+parser.add_argument('--stats', action='store_true', help='print bus transaction statistics on exit')
+parser.add_argument('--queue-size', action='store', type=int, help='record queue length between poller and writer (default: %(default)s)', default=1000)
+parser.add_argument('--batch', action='store', type=int, help='rows written per flush (default: %(default)s)', default=100)
+parser.add_argument('--flush-interval', action='store', type=float, help='maximum seconds between flushes (default: %(default)s)', default=1.0)
+parser.add_argument('--display-rate', action='store', type=float, help='terminal refresh rate [Hz], 0 = no display (default: 1/freq)')
+parser.add_argument('--dashboard', action='store_true', help='full-screen view with one fixed row per module, redrawing only changed cells')
+parser.add_argument('--aio', action='store_true', help='concurrent asyncio polling (tcp mode only)')
+parser.add_argument('--inflight', action='store', type=int, help='transactions in flight with --aio (default: %(default)s)', default=4)
+parser.add_argument('--adaptive', action='store_true', help='per-module poll rate: every --freq period while ramping, alarmed or current changing, backing off when steady')
+parser.add_argument('--max-interval', action='store', type=float, help='longest poll interval of a steady module with --adaptive [s] (default: %(default)s)', default=10.0)
+parser.add_argument('--bus-budget', action='store', type=float, help='fraction of each period spent on the bus with --adaptive (default: %(default)s)', default=0.5)
+# through a broker, monitoring yields to interactive and safety requests
+parser.set_defaults(priority='monitor')
 args = parser.parse_args()
 
-if args.filename is None and args.filelabel is None:
-    print('E: filename (-f) or filelabel (-l) option is required')
+# after argument parsing: --help and usage errors return without loading the Modbus stack
+from hvmodbus import HVModbus
+from hvpipeline import RecordQueue, CsvSink, WriterStage, DisplayStage, CSV_FIELDS, pollHandles, csvRow, monitorTable, monitorLines
+from hvsched import FixedRateScheduler, AdaptivePoller
+
+if args.aio and args.mode != 'tcp':
+    print('E: --aio requires --mode tcp')
+    sys.exit(-1)
+
+recording = args.filename is not None or args.filelabel is not None
+if not recording and args.shm is None:
+    print('E: filename (-f) or filelabel (-l) option is required (or --shm)')
     sys.exit(-1)
 
+if args.deadband is not None:
+    from hvdeadband import DeadbandSink, parseDeadbands
+    try:
+        deadbands = parseDeadbands(args.deadband)
+    except ValueError as e:
+        print(f'E: failed to parse --deadband - {e}')
+        sys.exit(-1)
+
 try:
     hvModList = [int(x) for x in args.modules.split(",")]
 except:
     raise ValueError('E: failed to parse --modules - should be comma-separated list of integers')
 
+bus = HVModbus(args)
 hvList = []
 for addr in hvModList:
-    hv = HVModbus(args)
-    res = hv.open(addr)
+    res = bus.open(addr)
     if res != True:
         print(f'E: failed to open module {addr}')
         sys.exit(-1)
     else:
-        hvList.append(copy.copy(hv))
+        hvList.append(bus.handle(addr))
         print(f'I: module {addr} ok')
 
-if args.filename:
-    fname = args.filename
-elif args.filelabel:
-    d = datetime.datetime.now()
-    fname = args.filelabel + '-' + str(d.year) + str(d.month) + str(d.day) + '-' + str(d.hour) + str(d.minute) + '.csv'
+if args.aio:
+    import asyncio
+    from hvasync import AsyncHVModbus
+    loop = asyncio.new_event_loop()
+    ahv = AsyncHVModbus(args, inflight=args.inflight)
+    if not loop.run_until_complete(ahv.connect()):
+        print(f'E: host not reachable or mbusd not running ({args.host})')
+        sys.exit(-1)
 
-if os.path.exists(fname):
-    while True:
-        res = input(f'I: file {fname} exists - do you want overwrite (Y/N)')
-        if res.lower() == 'y':
-            break
-        elif res.lower() == 'n':
-            print('E: specify different filename')
+def sweep(addresses):
+    if args.aio:
+        return list(loop.run_until_complete(ahv.poll_all(addresses)).items())
+    return pollHandles(hvList, addresses)
+
+if recording:
+    if args.filename:
+        fname = args.filename
+    elif args.filelabel:
+        d = datetime.datetime.now()
+        fname = args.filelabel + '-' + str(d.year) + str(d.month) + str(d.day) + '-' + str(d.hour) + str(d.minute) + ('.hvb' if args.format == 'bin' else '.csv')
+
+    rotate = args.rotate_size is not None or args.rotate_time is not None
+    if rotate:
+        # segments <base>-NNNN<ext>, listed in <base>.manifest.json - an existing manifest is continued
+        base, ext = os.path.splitext(fname)
+    elif os.path.exists(fname):
+        while True:
+            res = input(f'I: file {fname} exists - do you want overwrite (Y/N)')
+            if res.lower() == 'y':
+                break
+            elif res.lower() == 'n':
+                print('E: specify different filename')
+                sys.exit(-1)
+
+    if not rotate:
+        try:
+            fhand = open(fname, 'wb' if args.format == 'bin' else 'w')
+        except Exception as e:
+            print(f'E: output file open error - {e}')
             sys.exit(-1)
+        print(f'I: output filename: {fname}')
+    else:
+        print(f'I: output segments: {base}-NNNN{ext}, manifest {base}.manifest.json')
 
-try:
-    fhand = open(fname, 'w')
-except Exception as e:
-    print(f'E: output file open error - {e}')
-    sys.exit(-1)
+def render(latest):
+    print('\n'.join(monitorLines(st, hvModList, latest)))
+
+records = RecordQueue(args.queue_size)
+writer = None
+if recording:
+    if args.format == 'bin':
+        from hvbinlog import BinLogWriter
+
+    def makeSink(fhand):
+        return BinLogWriter(fhand) if args.format == 'bin' else CsvSink(fhand, CSV_FIELDS, csvRow)
+
+    if rotate:
+        from hvrotate import RotatingSink
+        sink = RotatingSink(makeSink, base, ext, binary=args.format == 'bin',
+                            maxBytes=None if args.rotate_size is None else args.rotate_size * 1e6,
+                            maxAge=args.rotate_time, compress=args.compress)
+        rotator = sink
+    else:
+        sink = makeSink(fhand)
+    if args.deadband is not None:
+        sink = DeadbandSink(sink, deadbands, keyframe=args.keyframe)
+    writer = WriterStage(records, sink, batch=args.batch, interval=args.flush_interval)
+    writer.start()
 
-print(f'I: output filename: {fname}')
-
-fields = list(hv.readMonRegisters().keys())
-fields.insert(0, 'timestamp')
-fields.insert(1, 'time')
-fields.insert(2, 'address')
-writer = csv.DictWriter(fhand, fields, dialect='excel')
-writer.writeheader()
-
-columns: List[Column] = list()
-columns.append(Column("", width=6, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=6, data_horiz_align=HorizontalAlignment.CENTER))
-columns.append(Column("", width=5, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=9, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=12, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=20, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=13, data_horiz_align=HorizontalAlignment.RIGHT))
-columns.append(Column("", width=14, data_horiz_align=HorizontalAlignment.CENTER))
-
-st = SimpleTable(columns, divider_char=None)
+shm = None
+if args.shm is not None:
+    from hvshm import ShmPublisher
+    shm = ShmPublisher(args.shm)
+    print(f'I: publishing to shared memory {args.shm}')
+
+displayRate = 1 / args.freq if args.display_rate is None else args.display_rate
+display = None
+dash = None
+report = print
+if displayRate > 0 and args.dashboard:
+    from hvdash import Dashboard, MONITOR_COLUMNS
+    dash = Dashboard(MONITOR_COLUMNS, hvModList, title=f'hvmon - {args.mode} - {len(hvModList)} modules every {args.freq:g} s - Ctrl-C to stop')
+    # poll loop messages go to the footer instead of scrolling the screen
+    report = dash.message
+    dash.start()
+    display = DisplayStage(dash.render, displayRate)
+    display.start()
+elif displayRate > 0:
+    st = monitorTable()
+    display = DisplayStage(render, displayRate)
+    display.start()
+
+alarms = None
+if args.alarm_log or args.alarm_socket or args.alarm_hook:
+    from hvalarm import AlarmWatcher, LogSink, SocketSink, HookSink, CallbackSink
+    sinks = [CallbackSink(report)]
+    if args.alarm_log:
+        sinks.append(LogSink(args.alarm_log))
+    if args.alarm_socket:
+        sinks.append(SocketSink(args.alarm_socket))
+    if args.alarm_hook:
+        sinks.append(HookSink(args.alarm_hook))
+    alarms = AlarmWatcher(sinks, debounce=args.alarm_debounce)
+    alarms.start()
+
+scheduler = FixedRateScheduler(args.freq)
+poller = AdaptivePoller(hvModList, args.freq, maxInterval=args.max_interval, budget=args.bus_budget, log=report) if args.adaptive else None
+tick = 0
 try:
-    i = 1
     while True:
-        start = datetime.datetime.now()
-        printHeader()
-        for hv in hvList:
-            try:
-                mon = hv.readMonRegisters()
-            except Exception as e:
-                print(f'E: address {hv.address} - {e}')
+        addresses = hvModList if poller is None else poller.due(tick)
+        start = time.monotonic()
+        result = sweep(addresses)
+        if poller is not None:
+            poller.busTime(time.monotonic() - start, len(addresses))
+        for addr, snap in result:
+            if snap is None or isinstance(snap, Exception):
+                report(f'E: address {addr} - {snap if snap is not None else "register read error"}')
+                if poller is not None:
+                    poller.update(tick, addr, None)
+                if alarms is not None:
+                    alarms.lost(addr)
                 continue
             else:
-                mon['timestamp'] = int(time.time())
-                mon['time'] = datetime.datetime.now()
-                mon['address'] = hv.address
-                mon['status'] = statusString(mon['status'])
-                mon['alarm'] = alarmString(mon['alarm'])
-                writer.writerow(mon)
-                print(st.generate_data_row([mon['address'], mon['status'], mon['Vset'], f'{mon["V"]:.3f}', f'{mon["I"]:.3f}', mon['T'], f'{mon["rateUP"]}/{mon["rateDN"]}', f'{mon["limitV"]}/{mon["limitI"]}/{mon["limitT"]}/{mon["limitTRIP"]}', mon['threshold'], mon['alarm']]))
-                stop = datetime.datetime.now()
-                fhand.flush()
-
-        delta = stop - start
-        sleep_value = ((args.freq * 1000) - (delta.total_seconds() * 1000)) / 1000
-        if sleep_value > 0:
-           time.sleep(((args.freq * 1000) - (delta.total_seconds() * 1000)) / 1000)
+                if writer is not None:
+                    records.push(snap)
+                if shm is not None:
+                    shm.publish(snap)
+                if alarms is not None:
+                    alarms.feed(snap)
+                if poller is not None:
+                    poller.update(tick, addr, snap)
+                if display is not None:
+                    display.update(addr, snap)
+        if shm is not None:
+            shm.heartbeat()
+        tick = scheduler.wait()
 
 except KeyboardInterrupt:
     pass
 
-fhand.close()
-print(f'I: output file {fname} closed')
+if alarms is not None:
+    alarms.stop()
+if display is not None:
+    display.stop()
+if dash is not None:
+    dash.stop()
+    print(f'I: dashboard - {dash.frames} frames, {dash.cells} cells redrawn')
+if shm is not None:
+    shm.close()
+if writer is not None:
+    writer.stop()
+    print(f'I: {records.pushed} records queued, {records.dropped} dropped (queue full), queue high-water {records.highWater}/{args.queue_size}')
+print(f'I: scheduler - {scheduler.summary()}')
+if alarms is not None:
+    print(f'I: alarms - {alarms.summary()}')
+if poller is not None:
+    for line in poller.summary():
+        print(f'I: {line}')
+if writer is not None:
+    print(f'I: {writer.written} records written in {writer.flushes} flushes, {writer.errors} write errors')
+    if args.deadband is not None:
+        print(f'I: deadband - {sink.kept} of {sink.seen} records kept')
+
+if args.aio:
+    ahv.close()
+    loop.close()
+
+if recording and rotate:
+    print(f'I: {rotator.rotations} segments closed, {rotator.compressor.errors} finalization errors, manifest {base}.manifest.json')
+elif recording:
+    print(f'I: output file {fname} closed')
+
+if args.stats:
+    for slave, functions in bus.stats().items():
+        for fc, st in functions.items():
+            print(f'I: address {slave} fc {fc} - {st["count"]} transactions, {st["errors"]} errors, {st["timeouts"]} timeouts, {st["exceptions"]} exceptions, avg {st["avg_ms"]:.2f} ms, p99 {st["p99_ms"]:g} ms, max {st["max_ms"]:.2f} ms')
 print('Bye!')
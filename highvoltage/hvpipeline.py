@@ -0,0 +1,175 @@
+import csv
+import datetime
+import queue
+import threading
+import time
+
+from hvmodbus import MON_FIELDS, statusString, alarmString
+
+CSV_FIELDS = ['timestamp', 'time', 'address'] + list(MON_FIELDS)
+
+def pollHandles(handles, addresses):
+   """One synchronous sweep of hvmon - [(address, snapshot or the exception raised)]"""
+   result = []
+   for hv in handles:
+      if hv.address not in addresses:
+         continue
+      try:
+         result.append((hv.address, hv.snapshot()))
+      except Exception as e:
+         result.append((hv.address, e))
+   return result
+
+def csvRow(snap):
+   mon = snap.monData()
+   mon['timestamp'] = round(snap.timestamp, 3)
+   mon['time'] = datetime.datetime.fromtimestamp(snap.timestamp)
+   mon['address'] = snap.address
+   mon['status'] = statusString(mon['status'])
+   mon['alarm'] = alarmString(mon['alarm'])
+   return mon
+
+def monitorTable():
+   from cmd2.table_creator import Column, SimpleTable, HorizontalAlignment
+   columns = [Column("", width=6, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=6, data_horiz_align=HorizontalAlignment.CENTER),
+              Column("", width=5, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=9, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=7, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=12, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=20, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=13, data_horiz_align=HorizontalAlignment.RIGHT),
+              Column("", width=14, data_horiz_align=HorizontalAlignment.CENTER)]
+   return SimpleTable(columns, divider_char=None)
+
+def monitorLines(st, addresses, latest):
+   """hvmon scrolling display: header and one row per module"""
+   lines = [st.generate_data_row(['addr','status','Vset','V','I','T','rate UP/DN','limit V/I/T/TRIP','trigger thr','alarm']),
+            st.generate_data_row(['','','[V]','[V]','[uA]','[°C]','[V/s]/[V/s]','[V]/[uA]/[°C]/[s]','[mV]',''])]
+   for addr in addresses:
+      snap = latest.get(addr)
+      if snap is not None:
+         lines.append(st.generate_data_row([snap.address, statusString(snap.status), snap.Vset, f'{snap.V:.3f}', f'{snap.I:.3f}', snap.T, f'{snap.rateUP}/{snap.rateDN}', f'{snap.limitV}/{snap.limitI}/{snap.limitT}/{snap.limitTRIP}', snap.threshold, alarmString(snap.alarm)]))
+   return lines
+
+class RecordQueue:
+   """Bounded record queue - push() never blocks, records are dropped when full"""
+
+   def __init__(self, maxsize=1000):
+      self.queue = queue.Queue(maxsize)
+      self.pushed = 0
+      self.dropped = 0
+      self.highWater = 0
+
+   def push(self, record):
+      try:
+         self.queue.put_nowait(record)
+      except queue.Full:
+         self.dropped += 1
+         return False
+      self.pushed += 1
+      size = self.queue.qsize()
+      if size > self.highWater:
+         self.highWater = size
+      return True
+
+   def get(self, timeout):
+      return self.queue.get(timeout=timeout)
+
+class CsvSink:
+   """CSV output - rowFormat turns a record into a DictWriter row"""
+
+   def __init__(self, fhand, fields, rowFormat):
+      self.fhand = fhand
+      self.rowFormat = rowFormat
+      self.writer = csv.DictWriter(fhand, fields, dialect='excel')
+      self.writer.writeheader()
+
+   def write(self, records):
+      self.writer.writerows(self.rowFormat(r) for r in records)
+
+   def flush(self):
+      self.fhand.flush()
+
+   def close(self):
+      self.fhand.close()
+
+class WriterStage(threading.Thread):
+   """Drain a RecordQueue into a sink in batches, flushing on a size or time budget"""
+
+   STOP = object()
+
+   def __init__(self, records, sink, batch=100, interval=1.0):
+      super().__init__(name='hv-writer', daemon=True)
+      self.records = records
+      self.sink = sink
+      self.batch = batch
+      self.interval = interval
+      self.written = 0
+      self.flushes = 0
+      self.errors = 0
+
+   def flush(self, pending):
+      try:
+         self.sink.write(pending)
+         self.sink.flush()
+      except Exception as e:
+         self.errors += 1
+         print(f'E: output write error - {e}')
+         return
+      self.written += len(pending)
+      self.flushes += 1
+
+   def run(self):
+      pending = []
+      deadline = time.monotonic() + self.interval
+      while True:
+         try:
+            record = self.records.get(timeout=max(deadline - time.monotonic(), 0.01))
+         except queue.Empty:
+            record = None
+         if record is self.STOP:
+            break
+         if record is not None:
+            pending.append(record)
+         if len(pending) >= self.batch or (pending and time.monotonic() >= deadline):
+            self.flush(pending)
+            pending = []
+         if time.monotonic() >= deadline:
+            deadline = time.monotonic() + self.interval
+      if pending:
+         self.flush(pending)
+      self.sink.close()
+
+   def stop(self):
+      # the stop marker must get through even when the queue is full
+      self.records.queue.put(self.STOP)
+      self.join()
+
+class DisplayStage(threading.Thread):
+   """Render the latest record of every module at its own rate"""
+
+   def __init__(self, render, rate=1.0):
+      super().__init__(name='hv-display', daemon=True)
+      self.render = render
+      self.period = 1 / rate
+      self.latest = {}        # address -> record, plain dict assignment from the poll thread
+      self.updated = False
+      self.renders = 0
+      self.stopped = threading.Event()
+
+   def update(self, address, record):
+      self.latest[address] = record
+      self.updated = True
+
+   def run(self):
+      while not self.stopped.wait(self.period):
+         if self.updated:
+            self.updated = False
+            self.render(dict(self.latest))
+            self.renders += 1
+
+   def stop(self):
+      self.stopped.set()
+      self.join()
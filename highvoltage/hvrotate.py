@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+class Compressor(threading.Thread):
+   """Finalize closed segments off the writer thread
+
+   Every segment is optionally gzipped, renamed from .part to its final
+   name in one atomic step and then appended to the manifest, which is
+   itself rewritten atomically, so a reader never sees a partial file.
+   """
+
+   STOP = object()
+
+   def __init__(self, manifest, compress=True):
+      super().__init__(name='hv-compress', daemon=True)
+      self.manifest = manifest
+      self.compress = compress
+      self.pending = queue.Queue()
+      self.segments = []
+      self.errors = 0
+      if os.path.exists(manifest):
+         with open(manifest) as fhand:
+            self.segments = json.load(fhand)['segments']
+
+   def run(self):
+      while True:
+         item = self.pending.get()
+         if item is self.STOP:
+            break
+         try:
+            self.finalize(*item)
+         except Exception as e:
+            self.errors += 1
+            print(f'E: segment {item[0]} finalization error - {e}')
+
+   def finalize(self, partname, filename, info):
+      final = filename + '.gz' if self.compress else filename
+      if os.path.exists(final):
+         raise FileExistsError(f'{final} exists, {partname} kept')
+      if self.compress:
+         with open(partname, 'rb') as src, gzip.open(filename + '.gz.part', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+         os.replace(filename + '.gz.part', filename + '.gz')
+         os.remove(partname)
+         filename += '.gz'
+      else:
+         os.replace(partname, filename)
+      info['file'] = os.path.basename(filename)
+      info['bytes'] = os.path.getsize(filename)
+      self.segments.append(info)
+      tmpname = self.manifest + '.part'
+      with open(tmpname, 'w') as fhand:
+         json.dump({'segments': self.segments}, fhand, indent=1)
+      os.replace(tmpname, self.manifest)
+
+   def stop(self):
+      self.pending.put(self.STOP)
+      self.join()
+
+class RotatingSink:
+   """Segmented output - rotates the wrapped sink by size or time
+
+   makeSink(fhand) builds the sink for a new segment (CsvSink or
+   BinLogWriter). Segments are written as <base>-NNNN<ext>.part and
+   handed to a Compressor once closed, so rotation costs the writer
+   thread only a close and an open. Segment time ranges come from the
+   record timestamps. A restart finalizes the .part segment left by the
+   previous run and numbers on from the highest segment on disk; an
+   existing segment is never overwritten.
+   """
+
+   def __init__(self, makeSink, base, ext, binary=False, maxBytes=None, maxAge=None, compress=True):
+      self.makeSink = makeSink
+      self.base = base
+      self.ext = ext
+      self.binary = binary
+      self.maxBytes = maxBytes
+      self.maxAge = maxAge
+      self.compressor = Compressor(base + '.manifest.json', compress)
+      self.compressor.start()
+      self.index = self.recover()
+      self.sink = None
+      self.rotations = 0
+
+   def recover(self):
+      """Finalize segments left open by a previous run - returns the highest segment index on disk"""
+      directory = os.path.dirname(self.base) or '.'
+      pattern = re.compile(re.escape(os.path.basename(self.base)) + r'-(\d+)' + re.escape(self.ext) + r'(\.gz)?(\.part)?')
+      highest = len(self.compressor.segments)
+      for name in sorted(os.listdir(directory)):
+         match = pattern.fullmatch(name)
+         if match is None:
+            continue
+         index = int(match.group(1))
+         highest = max(highest, index)
+         if match.group(3) and not match.group(2):
+            # time range and record count are unknown, the file is kept as written
+            filename = os.path.join(directory, name[:-len('.part')])
+            print(f'W: recovering segment {filename} left open by a previous run')
+            self.compressor.pending.put((filename + '.part', filename,
+                                         {'start': None, 'stop': None, 'records': None, 'closed': os.path.getmtime(filename + '.part'), 'recovered': True}))
+      return highest
+
+   def open(self, timestamp):
+      self.index += 1
+      self.filename = f'{self.base}-{self.index:04d}{self.ext}'
+      self.fhand = open(self.filename + '.part', 'wb' if self.binary else 'w')
+      self.sink = self.makeSink(self.fhand)
+      self.start = self.stop = timestamp
+      self.records = 0
+
+   def rotate(self):
+      self.sink.close()
+      self.compressor.pending.put((self.filename + '.part', self.filename,
+                                   {'start': self.start, 'stop': self.stop, 'records': self.records, 'closed': time.time()}))
+      self.sink = None
+      self.rotations += 1
+
+   def write(self, records):
+      chunk = []
+      for snap in records:
+         if self.sink is not None and self.maxAge and snap.timestamp - self.start >= self.maxAge:
+            self.sink.write(chunk)
+            chunk = []
+            self.rotate()
+         if self.sink is None:
+            self.open(snap.timestamp)
+         chunk.append(snap)
+         self.stop = max(self.stop, snap.timestamp)
+         self.records += 1
+      if chunk:
+         self.sink.write(chunk)
+
+   def flush(self):
+      if self.sink is None:
+         return
+      self.sink.flush()
+      if self.maxBytes and self.fhand.tell() >= self.maxBytes:
+         self.rotate()
+
+   def close(self):
+      if self.sink is not None:
+         self.rotate()
+      self.compressor.stop()
@@ -0,0 +1,134 @@
+import time
+
+from hvmodbus import statusString
+
+# lateness histogram bucket upper bounds [ms]
+LATENESS_BUCKETS = (1, 10, 100, 1000, 10000, float('inf'))
+
+class FixedRateScheduler:
+   """Monotonic fixed-rate grid t0 + k * period
+
+   wait() sleeps until the next grid instant. A sweep running past it is
+   a missed deadline: the lateness is recorded and the schedule resumes
+   on the next grid instant still ahead, so the period never stretches
+   and sample instants never drift.
+   """
+
+   def __init__(self, period):
+      self.period = period
+      self.t0 = time.monotonic()
+      self.tick = 0
+      self.ticks = 0
+      self.missed = 0         # grid instants skipped because of overruns
+      self.overruns = 0       # sweeps ending after their deadline
+      self.maxLateness = 0.0
+      self.histogram = [0] * len(LATENESS_BUCKETS)
+
+   def wait(self):
+      self.tick += 1
+      self.ticks += 1
+      target = self.t0 + self.tick * self.period
+      now = time.monotonic()
+      if now > target:
+         lateness = now - target
+         self.overruns += 1
+         skipped = int(lateness // self.period) + 1
+         self.missed += skipped
+         self.tick += skipped
+         target = self.t0 + self.tick * self.period
+         if lateness > self.maxLateness:
+            self.maxLateness = lateness
+         ms = lateness * 1000
+         for i, bound in enumerate(LATENESS_BUCKETS):
+            if ms <= bound:
+               self.histogram[i] += 1
+               break
+      delay = target - time.monotonic()
+      if delay > 0:
+         time.sleep(delay)
+      return self.tick
+
+   def summary(self):
+      hist = ', '.join(f'<={b:g}ms: {n}' for b, n in zip(LATENESS_BUCKETS, self.histogram) if n)
+      return f'{self.ticks} sweeps, {self.overruns} overruns, {self.missed} missed deadlines, max lateness {self.maxLateness * 1000:.1f} ms' + (f' ({hist})' if hist else '')
+
+# HV status codes polled at the fast rate: RUP, RDN, TUP, TDN
+FAST_STATUS = {code: statusString(code) for code in (2, 3, 4, 5)}       # ramping
+
+class ModuleRate:
+   __slots__ = ('address', 'interval', 'due', 'lastI', 'polls', 'reason')
+
+   def __init__(self, address):
+      self.address = address
+      self.interval = 1       # poll interval [scheduler ticks]
+      self.due = 0            # next tick the module is due
+      self.lastI = None
+      self.polls = 0
+      self.reason = 'startup'
+
+class AdaptivePoller:
+   """Per-module poll intervals on top of the FixedRateScheduler grid
+
+   A module is polled every tick while it is ramping or in a trip timer
+   (RUP/RDN/TUP/TDN), has an alarm set or its current moved by more than
+   currentDelta since the previous poll. Once steady its interval doubles
+   on every poll, up to maxInterval seconds. Each tick only as many due
+   modules are read as fit in budget (fraction of the period) at the
+   measured per-read bus time; fast modules go first, then the most
+   overdue, and the rest are deferred to the next tick.
+   """
+
+   def __init__(self, addresses, period, maxInterval=10.0, budget=0.5, currentDelta=0.05, log=print):
+      self.period = period
+      self.maxTicks = max(1, round(maxInterval / period))
+      self.budget = budget * period
+      self.currentDelta = currentDelta
+      self.log = log
+      self.modules = {addr: ModuleRate(addr) for addr in addresses}
+      self.cost = None        # moving average of one module read [s]
+      self.deferred = 0
+      self.start = time.monotonic()
+
+   def due(self, tick):
+      """Addresses to poll on this tick, within the bus-time budget"""
+      due = sorted((m for m in self.modules.values() if m.due <= tick), key=lambda m: (m.interval > 1, m.due))
+      n = len(due)
+      if self.cost:
+         n = min(n, max(1, int(self.budget / self.cost)))
+      self.deferred += len(due) - n
+      return [m.address for m in due[:n]]
+
+   def busTime(self, elapsed, reads):
+      """Feed the wall time of a sweep of `reads` module reads"""
+      if reads:
+         cost = elapsed / reads
+         self.cost = cost if self.cost is None else 0.8 * self.cost + 0.2 * cost
+
+   def update(self, tick, address, snap):
+      """Reschedule a module from its latest snapshot (None on read error)"""
+      m = self.modules[address]
+      m.polls += 1
+      if snap is None:
+         m.due = tick + m.interval
+         return
+      if snap.status in FAST_STATUS:
+         reason = FAST_STATUS[snap.status]
+      elif snap.alarm:
+         reason = 'alarm'
+      elif m.lastI is not None and abs(snap.I - m.lastI) > self.currentDelta:
+         reason = 'current changing'
+      else:
+         reason = None
+      m.lastI = snap.I
+      interval = 1 if reason else min(m.interval * 2, self.maxTicks)
+      if interval != m.interval or (reason and reason != m.reason):
+         self.log(f'I: module {address} poll rate {1 / (interval * self.period):.3g} Hz ({reason or "steady"})')
+      m.interval = interval
+      m.reason = reason
+      m.due = tick + interval
+
+   def summary(self):
+      elapsed = time.monotonic() - self.start
+      lines = [f'module {m.address} - {m.polls} polls, effective rate {m.polls / elapsed:.3g} Hz, current {1 / (m.interval * self.period):.3g} Hz' for m in self.modules.values()]
+      lines.append(f'{self.deferred} polls deferred by the bus-time budget' + (f' (avg read {self.cost * 1000:.2f} ms)' if self.cost else ''))
+      return lines
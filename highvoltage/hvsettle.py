@@ -0,0 +1,99 @@
+import math
+import time
+from collections import deque
+
+class SettleDetector:
+   """Streaming convergence detector over a sliding window of samples
+
+   Keeps running sums of the last `window` samples (shifted by the first
+   sample to avoid cancellation) for an O(1) variance and least-squares
+   drift; only the trimmed mean (min/max dropped) sorts the window. The
+   value is considered stable once at least `minSamples` are in, the
+   drift across the samples in the window is below `tolerance` and the
+   standard error of their mean is below `tolerance` as well.
+   """
+
+   def __init__(self, tolerance=0.05, window=10, minSamples=4, maxSamples=10):
+      self.tolerance = tolerance
+      self.minSamples = max(minSamples, 3)
+      self.maxSamples = maxSamples
+      self.values = deque(maxlen=window)
+      self.shift = None
+      self.sum = 0.0
+      self.sumsq = 0.0
+      self.sumkx = 0.0        # sum of position in the window * shifted sample
+      self.count = 0
+      self.mean = None        # trimmed mean of the window
+      self.stable = False
+
+   def add(self, value):
+      if self.shift is None:
+         self.shift = value
+      if len(self.values) == self.values.maxlen:
+         old = self.values[0] - self.shift
+         self.sum -= old
+         self.sumsq -= old * old
+         # the others move down one position, the oldest was at position 0
+         self.sumkx -= self.sum
+         position = len(self.values) - 1
+      else:
+         position = len(self.values)
+      self.values.append(value)
+      x = value - self.shift
+      self.sum += x
+      self.sumsq += x * x
+      self.sumkx += position * x
+      self.count += 1
+
+      ordered = sorted(self.values)
+      # delete min/max elements
+      trimmed = ordered[1:-1] if len(ordered) > 2 else ordered
+      self.mean = sum(trimmed) / len(trimmed)
+
+      self.stable = (self.count >= self.minSamples and
+                     abs(self.drift()) <= self.tolerance and
+                     self.noise() / math.sqrt(len(self.values)) <= self.tolerance)
+      return self.stable
+
+   def drift(self):
+      """Change of the least-squares line through the window, first to last sample"""
+      n = len(self.values)
+      if n < 2:
+         return 0.0
+      # sum((k - center)^2) over positions 0...n-1 is n(n^2 - 1)/12
+      sxy = self.sumkx - (n - 1) / 2 * self.sum
+      return sxy / (n * (n * n - 1) / 12) * (n - 1)
+
+   def done(self):
+      return self.stable or self.count >= self.maxSamples
+
+   def noise(self):
+      """Standard deviation of the samples in the window"""
+      n = len(self.values)
+      if n < 2:
+         return 0.0
+      var = (self.sumsq - self.sum * self.sum / n) / (n - 1)
+      return math.sqrt(max(var, 0.0))
+
+READERS = {
+   'V': 'getVoltage',
+   'I': 'getCurrent',
+   'T': 'getTemperature',
+}
+
+def wait_stable(hv, quantity='V', slave=None, tolerance=0.05, interval=0.5, minSamples=4, maxSamples=10, callback=None):
+   """Sample hv quantity ('V', 'I' or 'T') until it settles - returns the SettleDetector"""
+   read = getattr(hv, READERS[quantity])
+   detector = SettleDetector(tolerance=tolerance, minSamples=minSamples, maxSamples=maxSamples)
+   while not detector.done():
+      start = time.monotonic()
+      value = read(slave=slave)
+      detector.add(value)
+      if callback is not None:
+         callback(value)
+      if detector.done():
+         break
+      wait = interval - (time.monotonic() - start)
+      if wait > 0:
+         time.sleep(wait)
+   return detector
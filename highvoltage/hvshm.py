@@ -0,0 +1,147 @@
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+from hvmodbus import HVSnapshot, SNAPSHOT_COUNT
+
+VERSION = 1
+MAGIC = b'HVSM'
+DEFAULT_NAME = 'hvmon'
+SLOTS = 21                    # indexed by modbus address 0...20
+STALE_AFTER = 600             # [s] without heartbeat, the writer pid is taken as reused by another process
+
+HEADER = struct.Struct('<4sHHI4xd')                     # magic, version, slots, writer pid, heartbeat
+SEQ = struct.Struct('<I')
+RECORD = struct.Struct(f'<Hxxd{SNAPSHOT_COUNT}H')     # register count, acquisition time, registers
+SLOT_SIZE = (SEQ.size + RECORD.size + 7) & ~7
+SIZE = HEADER.size + SLOTS * SLOT_SIZE
+
+def slotOffset(address):
+   return HEADER.size + address * SLOT_SIZE
+
+def processAlive(pid):
+   try:
+      os.kill(pid, 0)
+   except ProcessLookupError:
+      return False
+   except PermissionError:
+      pass
+   return True
+
+class ShmPublisher:
+   """Latest register block of every module in a shared-memory segment
+
+   Each slot is a seqlock: the sequence counter is odd while the slot is
+   being written and is bumped to the next even value when done, so
+   readers never block the poll loop and detect torn reads. The header
+   heartbeat is refreshed every sweep so readers can tell a stale segment
+   left behind by a dead writer; a new publisher only replaces such a
+   segment and refuses to start while its writer is alive.
+   """
+
+   def __init__(self, name=DEFAULT_NAME):
+      try:
+         self.shm = shared_memory.SharedMemory(name, create=True, size=SIZE)
+      except FileExistsError:
+         owner = self.owner(name)
+         if owner is not None:
+            print(f'E: shared memory {name} in use - {owner}')
+            exit(1)
+         # left over by a writer that did not exit cleanly
+         stale = shared_memory.SharedMemory(name)
+         stale.close()
+         stale.unlink()
+         self.shm = shared_memory.SharedMemory(name, create=True, size=SIZE)
+      self.buf = self.shm.buf
+      self.buf[:SIZE] = bytes(SIZE)
+      HEADER.pack_into(self.buf, 0, MAGIC, VERSION, SLOTS, os.getpid(), time.time())
+      self.seq = [0] * SLOTS
+
+   @staticmethod
+   def owner(name):
+      """Description of the live writer or foreign owner of an existing segment, None if it is stale"""
+      shm = attach(name)
+      try:
+         if shm.size < HEADER.size:
+            return 'not an HV monitor segment'
+         magic, version, slots, pid, heartbeat = HEADER.unpack_from(shm.buf, 0)
+      finally:
+         shm.close()
+      if magic != MAGIC:
+         return 'not an HV monitor segment'
+      age = time.time() - heartbeat
+      if processAlive(pid) and age < STALE_AFTER:
+         return f'writer pid {pid}, heartbeat {age:.1f} s ago'
+      return None
+
+   def publish(self, snap):
+      offset = slotOffset(snap.address)
+      seq = self.seq[snap.address]
+      registers = list(snap.registers[:SNAPSHOT_COUNT])
+      count = len(registers)
+      registers += [0] * (SNAPSHOT_COUNT - count)
+      SEQ.pack_into(self.buf, offset, seq + 1)
+      RECORD.pack_into(self.buf, offset + SEQ.size, count, snap.timestamp, *registers)
+      SEQ.pack_into(self.buf, offset, seq + 2)
+      self.seq[snap.address] = seq + 2
+
+   def heartbeat(self):
+      HEADER.pack_into(self.buf, 0, MAGIC, VERSION, SLOTS, os.getpid(), time.time())
+
+   def close(self):
+      self.buf = None
+      self.shm.close()
+      self.shm.unlink()
+
+def attach(name):
+   """Open an existing segment without handing it to this process' resource tracker"""
+   try:
+      return shared_memory.SharedMemory(name, track=False)
+   except TypeError:
+      # Python < 3.13 registers every attached segment and unlinks it when the reader exits
+      from multiprocessing import resource_tracker
+      shm = shared_memory.SharedMemory(name)
+      resource_tracker.unregister(shm._name, 'shared_memory')
+      return shm
+
+class ShmReader:
+   """Read the latest snapshots published by hvmon --shm - no bus transactions"""
+
+   def __init__(self, name=DEFAULT_NAME, retries=100):
+      self.shm = attach(name)
+      self.buf = self.shm.buf
+      self.retries = retries
+      magic, version, slots, _, _ = HEADER.unpack_from(self.buf, 0)
+      if magic != MAGIC or version != VERSION or slots != SLOTS:
+         self.close()
+         raise ValueError(f'shared memory {name} is not an HV monitor segment (version {VERSION})')
+
+   def close(self):
+      self.buf = None
+      self.shm.close()
+
+   def writer(self):
+      """(pid, heartbeat age in seconds) of the publishing process"""
+      _, _, _, pid, heartbeat = HEADER.unpack_from(self.buf, 0)
+      return pid, time.time() - heartbeat
+
+   def read(self, address):
+      """HVSnapshot of a module, None if it was never published"""
+      offset = slotOffset(address)
+      for _ in range(self.retries):
+         seq, = SEQ.unpack_from(self.buf, offset)
+         if seq == 0:
+            return None
+         if seq & 1:
+            continue
+         count, timestamp, *registers = RECORD.unpack_from(self.buf, offset + SEQ.size)
+         if SEQ.unpack_from(self.buf, offset)[0] == seq:
+            return HVSnapshot(address, registers[:count], timestamp)
+      raise TimeoutError(f'shared memory slot {address} busy')
+
+   def addresses(self):
+      return [addr for addr in range(SLOTS) if SEQ.unpack_from(self.buf, slotOffset(addr))[0]]
+
+   def readAll(self):
+      return {addr: self.read(addr) for addr in self.addresses()}
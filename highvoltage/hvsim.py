@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import asyncio
+import os
+import random
+import select
+import signal
+import threading
+import time
+import tty
+
+from pymodbus import FramerType
+from pymodbus.datastore import (
+    ModbusSequentialDataBlock,
+    ModbusSlaveContext,
+    ModbusServerContext,
+)
+from pymodbus.server import (
+    StartAsyncTcpServer,
+    StartAsyncSerialServer,
+)
+
+REGISTER_COUNT = 0x40
+LEGACY_BOUNDARY = 0x30         # older firmware refuses reads crossing 0x2F...0x30
+
+STATUS_UP = 0
+STATUS_DOWN = 1
+STATUS_RUP = 2
+STATUS_RDN = 3
+STATUS_TUP = 4
+STATUS_TDN = 5
+STATUS_TRIP = 6
+
+ALARM_OV = 1
+ALARM_UV = 2
+ALARM_OC = 4
+ALARM_OT = 8
+
+def encodeString(text, count):
+   data = text.ljust(count * 2)[:count * 2].encode()
+   return [(data[i] << 8) + data[i + 1] for i in range(0, count * 2, 2)]
+
+def encodeInt32(value):
+   value = int(value) & 0xFFFFFFFF
+   return [value & 0xFFFF, (value >> 16) & 0xFFFF]
+
+def decodeInt32(lsb, msb):
+   value = (msb << 16) + lsb
+   return value - (1 << 32) if value & 0x80000000 else value
+
+def encodeTemperature(value):
+   return (int(value) << 8) | min(255, int(round((value % 1) * 1000)))
+
+class HVBoard:
+   """Model of one HV board: ramping, alarms, trips and readback calibration error
+
+   The true output ramps toward Vset at the configured rates while powered.
+   The readback is raw = gain * Vout + offset, reported as m * raw + q with
+   the calibration registers, so a calibration fit recovers 1/gain, -offset/gain.
+   """
+
+   def __init__(self, address, rng):
+      self.address = address
+      self.rng = rng
+      self.devid = 0x4D500000 + address * 7919
+      self.fwver = 'V4'
+      self.pmtsn = f'PMT{address:04d}'
+      self.hvsn = f'HV{address:04d}'
+      self.febsn = f'FEB{address:04d}'
+      self.power = False
+      self.status = STATUS_DOWN
+      self.alarm = 0
+      self.vset = 25
+      self.vout = 0.0
+      self.rateUP = 10
+      self.rateDN = 10
+      self.limitV = 10
+      self.limitI = 10
+      self.limitT = 50
+      self.limitTRIP = 5
+      self.threshold = 100
+      self.vref = 2500
+      self.calibm = 1.0
+      self.calibq = 0.0
+      self.calibt = 0
+      self.resistance = 300          # divider load [MOhm]
+      self.leak = 0.0                # extra load current [uA] - fault injection
+      self.legacy = False            # older firmware: ILLEGAL_ADDRESS on accesses crossing 0x2F
+      self.gain = rng.uniform(0.98, 1.02)
+      self.offset = rng.uniform(-2, 2)
+      self.ambient = 30 + rng.uniform(-2, 2)
+      self.overcurrent = 0.0         # time spent above the current limit [s]
+      self.last = time.monotonic()
+
+   def current(self):
+      return self.vout / self.resistance + self.leak
+
+   def temperature(self):
+      return self.ambient + self.vout / 200
+
+   def update(self):
+      now = time.monotonic()
+      dt = now - self.last
+      self.last = now
+
+      if self.status in (STATUS_TDN, STATUS_TRIP):
+         target, rate = 0, max(self.rateDN, 1)
+      elif self.power:
+         target = self.vset
+         rate = self.rateUP if target > self.vout else self.rateDN
+      else:
+         target, rate = 0, max(self.rateDN, 1)
+
+      step = rate * dt
+      if abs(target - self.vout) <= step:
+         self.vout = float(target)
+      else:
+         self.vout += step if target > self.vout else -step
+
+      if self.status == STATUS_TDN:
+         if self.vout == 0:
+            self.status = STATUS_TRIP
+      elif self.status != STATUS_TRIP:
+         if self.vout == target:
+            self.status = STATUS_UP if self.power else STATUS_DOWN
+         else:
+            self.status = STATUS_RUP if target > self.vout else STATUS_RDN
+
+      alarm = self.alarm & ALARM_OC
+      if self.status == STATUS_UP:
+         if self.vout > self.vset + self.limitV:
+            alarm |= ALARM_OV
+         elif self.vout < self.vset - self.limitV:
+            alarm |= ALARM_UV
+      if self.current() > self.limitI:
+         alarm |= ALARM_OC
+         self.overcurrent += dt
+         if self.overcurrent >= self.limitTRIP and self.status not in (STATUS_TDN, STATUS_TRIP):
+            self.status = STATUS_TDN
+            self.power = False
+      else:
+         self.overcurrent = 0.0
+      if self.temperature() > self.limitT:
+         alarm |= ALARM_OT
+      self.alarm = alarm
+
+   def readback(self):
+      raw = self.gain * self.vout + self.offset + self.rng.gauss(0, 0.02)
+      if self.vout == 0 and not self.power:
+         raw = abs(self.rng.gauss(0, 0.02))
+      return self.calibm * raw + self.calibq
+
+   def registers(self):
+      r = [0] * REGISTER_COUNT
+      r[0x00] = self.address
+      r[0x02:0x03] = encodeString(self.fwver, 1)
+      r[0x04:0x06] = [self.devid & 0xFFFF, self.devid >> 16]
+      r[0x06] = self.status
+      r[0x07] = encodeTemperature(self.temperature())
+      r[0x08:0x0E] = encodeString(self.pmtsn, 6)
+      r[0x0E:0x14] = encodeString(self.hvsn, 6)
+      r[0x14:0x1A] = encodeString(self.febsn, 6)
+      r[0x22] = self.limitTRIP
+      r[0x23] = self.rateUP
+      r[0x24] = self.rateDN
+      r[0x25] = self.limitI
+      r[0x26] = self.vset
+      r[0x27] = self.limitV
+      r[0x28:0x2A] = encodeInt32(round((self.current() + self.rng.gauss(0, 0.005)) * 1000))
+      r[0x2A:0x2C] = encodeInt32(round(self.readback() * 1000))
+      r[0x2C] = int(self.vref * 10)
+      r[0x2D] = self.threshold
+      r[0x2E] = self.alarm
+      r[0x2F] = self.limitT
+      r[0x30:0x32] = encodeInt32(round(self.calibm * 10000))
+      r[0x32:0x34] = encodeInt32(round(self.calibq * 10000))
+      r[0x34] = int(self.calibt * 1.6890722)
+      return r
+
+   def written(self, address, values, block):
+      """Apply a holding register write - returns the new modbus address if changed"""
+      newAddress = None
+      for offset, value in enumerate(values):
+         reg = address + offset
+         if reg == 0x00 and 1 <= value <= 247:
+            newAddress = value
+         elif reg == 0x22:
+            self.limitTRIP = value
+         elif reg == 0x23:
+            self.rateUP = value
+         elif reg == 0x24:
+            self.rateDN = value
+         elif reg == 0x25:
+            self.limitI = value
+         elif reg == 0x26:
+            self.vset = value
+         elif reg == 0x27:
+            self.limitV = value
+         elif reg == 0x2D:
+            self.threshold = value
+         elif reg == 0x2F:
+            self.limitT = value
+         elif reg == 0x34:
+            self.calibt = value / 1.6890722
+      regs = block.values
+      if address <= 0x31 and address + len(values) > 0x30:
+         self.calibm = decodeInt32(regs[0x30], regs[0x31]) / 10000
+      if address <= 0x33 and address + len(values) > 0x32:
+         self.calibq = decodeInt32(regs[0x32], regs[0x33]) / 10000
+      if address < 0x1A and address + len(values) > 0x08:
+         self.pmtsn = bytes(b for reg in regs[0x08:0x0E] for b in reg.to_bytes(2, 'big')).decode(errors='replace')
+         self.hvsn = bytes(b for reg in regs[0x0E:0x14] for b in reg.to_bytes(2, 'big')).decode(errors='replace')
+         self.febsn = bytes(b for reg in regs[0x14:0x1A] for b in reg.to_bytes(2, 'big')).decode(errors='replace')
+      return newAddress
+
+   def coil(self, address, value):
+      if address == 1:
+         if value and self.status not in (STATUS_TDN, STATUS_TRIP):
+            self.power = True
+         elif not value:
+            self.power = False
+      elif address == 2 and value:
+         self.alarm = 0
+         self.overcurrent = 0.0
+         if self.status in (STATUS_TDN, STATUS_TRIP):
+            self.status = STATUS_DOWN
+
+# the slave context shifts every request address by one: blocks start at 1
+# so that values[n] is protocol address n
+
+class HoldingRegisters(ModbusSequentialDataBlock):
+   def __init__(self, sim, board):
+      super().__init__(1, [0] * REGISTER_COUNT)
+      self.sim = sim
+      self.board = board
+
+   def validate(self, address, count=1):
+      # validate() runs exactly once per request: charge the bus latency here
+      self.sim.frameDelay()
+      if self.board.legacy and address - 1 < LEGACY_BOUNDARY < address - 1 + count:
+         return False
+      return super().validate(address, count)
+
+   def getValues(self, address, count=1):
+      with self.sim.lock:
+         self.board.update()
+         self.values = self.board.registers()
+      return super().getValues(address, count)
+
+   def setValues(self, address, values):
+      with self.sim.lock:
+         self.board.update()
+         self.values = self.board.registers()
+         super().setValues(address, values)
+         newAddress = self.board.written(address - 1, values if isinstance(values, list) else [values], self)
+      if newAddress is not None:
+         self.sim.readdress(self.board, newAddress)
+
+class Coils(ModbusSequentialDataBlock):
+   def __init__(self, sim, board):
+      super().__init__(1, [False] * 8)
+      self.sim = sim
+      self.board = board
+
+   def validate(self, address, count=1):
+      self.sim.frameDelay()
+      return super().validate(address, count)
+
+   def getValues(self, address, count=1):
+      self.values[1] = self.board.power
+      return super().getValues(address, count)
+
+   def setValues(self, address, values):
+      values = values if isinstance(values, list) else [values]
+      with self.sim.lock:
+         self.board.update()
+         for offset, value in enumerate(values):
+            self.board.coil(address - 1 + offset, bool(value))
+      super().setValues(address, values)
+
+class HVSimulator:
+   """Up to 20 simulated HV slaves on a local Modbus TCP server and/or pty RTU endpoint"""
+
+   def __init__(self, addresses=range(1, 20), latency=0.0, seed=None):
+      self.rng = random.Random(seed)
+      self.latency = latency
+      self.lock = threading.Lock()
+      self.boards = {addr: HVBoard(addr, self.rng) for addr in addresses}
+      self.context = ModbusServerContext(slaves={addr: self.slaveContext(board) for addr, board in self.boards.items()}, single=False)
+      self.loop = None
+      self.task = None
+      self.thread = None
+      self.rtuPath = None
+      self.link = None
+
+   def slaveContext(self, board):
+      return ModbusSlaveContext(co=Coils(self, board), hr=HoldingRegisters(self, board))
+
+   def frameDelay(self):
+      # blocking on purpose: like a real RS-485 line, one frame at a time
+      if self.latency > 0:
+         time.sleep(self.latency)
+
+   def readdress(self, board, address):
+      old = board.address
+      board.address = address
+      self.boards[address] = self.boards.pop(old)
+      self.context[address] = self.context[old]
+      del self.context[old]
+
+   def board(self, address):
+      return self.boards[address]
+
+   def ptyPair(self, link=None):
+      """Two raw ptys bridged back to back - returns (server path, client path)"""
+      m1, s1 = os.openpty()
+      m2, s2 = os.openpty()
+      tty.setraw(s1)
+      tty.setraw(s2)
+      serverPath, clientPath = os.ttyname(s1), os.ttyname(s2)
+
+      def bridge():
+         peer = {m1: m2, m2: m1}
+         while True:
+            ready, _, _ = select.select([m1, m2], [], [])
+            for fd in ready:
+               try:
+                  os.write(peer[fd], os.read(fd, 4096))
+               except OSError:
+                  return
+
+      threading.Thread(target=bridge, daemon=True).start()
+      if link is not None:
+         if os.path.lexists(link):
+            os.unlink(link)
+         os.symlink(clientPath, link)
+         self.link = clientPath = link
+      self.rtuPath = clientPath
+      return serverPath, clientPath
+
+   async def serve(self, tcp=None, rtu=None):
+      servers = []
+      if tcp is not None:
+         servers.append(StartAsyncTcpServer(context=self.context, address=tcp, ignore_missing_slaves=True))
+      if rtu is not None:
+         serverPath, _ = self.ptyPair(rtu if isinstance(rtu, str) else None)
+         servers.append(StartAsyncSerialServer(context=self.context, framer=FramerType.RTU, port=serverPath,
+                                               baudrate=115200, ignore_missing_slaves=True))
+      await asyncio.gather(*servers)
+
+   def start(self, tcp=None, rtu=None):
+      """Serve from a background thread - returns once the servers are listening"""
+      self.loop = asyncio.new_event_loop()
+      self.task = self.loop.create_task(self.serve(tcp, rtu))
+      self.thread = threading.Thread(target=self.run, daemon=True)
+      self.thread.start()
+      time.sleep(0.5)
+      return self
+
+   def run(self):
+      try:
+         self.loop.run_until_complete(self.task)
+      except asyncio.CancelledError:
+         pass
+
+   def removeLink(self):
+      if self.link is not None and os.path.islink(self.link):
+         os.unlink(self.link)
+      self.link = None
+
+   def stop(self):
+      if self.loop is not None:
+         self.loop.call_soon_threadsafe(self.task.cancel)
+         self.thread.join(timeout=2)
+         self.loop = None
+      self.removeLink()
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='HV board simulator')
+   parser.add_argument('-n', '--boards', type=int, default=19, help='number of boards, addresses 1...n (default: %(default)s, max: 20)')
+   parser.add_argument('--tcp', type=str, default='127.0.0.1:5020', help='Modbus TCP listen address (default: %(default)s)')
+   parser.add_argument('--rtu', type=str, help='create pty RTU endpoint and symlink it here (e.g. /tmp/ttyHV)')
+   parser.add_argument('--latency', type=float, default=0.0, help='per-frame bus latency [s] (default: %(default)s)')
+   parser.add_argument('--leak', action='append', default=[], help='inject leakage current <address>:<uA> (repeatable)')
+   parser.add_argument('--legacy', type=int, action='append', default=[], help='emulate older firmware on this address (repeatable)')
+   parser.add_argument('--seed', type=int, help='random seed')
+   args = parser.parse_args()
+
+   if not 1 <= args.boards <= 20:
+      parser.error('--boards must be 1...20')
+
+   sim = HVSimulator(range(1, args.boards + 1), latency=args.latency, seed=args.seed)
+   for leak in args.leak:
+      addr, value = leak.split(':')
+      sim.board(int(addr)).leak = float(value)
+   for addr in args.legacy:
+      sim.board(addr).legacy = True
+
+   host, port = args.tcp.rsplit(':', 1)
+   print(f'I: {args.boards} HV boards on tcp {host}:{port}' + (f' and rtu {args.rtu}' if args.rtu else ''))
+   # stop cleanly (rtu link removed) when run in the background
+   signal.signal(signal.SIGTERM, signal.default_int_handler)
+   try:
+      asyncio.run(sim.serve(tcp=(host, int(port)), rtu=args.rtu))
+   except KeyboardInterrupt:
+      pass
+   finally:
+      sim.removeLink()
+   print('Bye!')
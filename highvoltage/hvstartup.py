@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNCONTROL = os.path.join(os.path.dirname(HERE), 'runcontrol')
+
+BASELINE = os.path.join(HERE, 'hvstartup-baseline.json')
+
+# name -> (working directory, interpreter arguments); --help exits right after argument parsing,
+# so it measures imports and module setup only. rc.py opens /dev/uio0 on start: import it instead.
+SCENARIOS = {
+    'python': (HERE, ['-c', 'pass']),
+    'hv.py --help': (HERE, ['hv.py', '--help']),
+    'hvmon.py --help': (HERE, ['hvmon.py', '--help']),
+    'hvbroker.py --help': (HERE, ['hvbroker.py', '--help']),
+    'import rc': (RUNCONTROL, ['-c', 'import rc']),
+}
+
+def runOnce(cwd, argv, importtime=False):
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + argv
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f'{" ".join(argv)} exited with {proc.returncode}: {proc.stderr.strip().splitlines()[-1:]}')
+    return elapsed, proc.stderr
+
+def topImports(stderr, count):
+    """Top-level imports by cumulative time [ms] from -X importtime output"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nesting is shown by indentation - keep direct imports of the script
+        if not name.startswith('  '):
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+def runScenario(cwd, argv, runs):
+    runOnce(cwd, argv)      # warm the page cache and the bytecode cache
+    times = [runOnce(cwd, argv)[0] * 1000 for _ in range(runs)]
+    return {'min_ms': min(times), 'median_ms': statistics.median(times), 'max_ms': max(times)}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, res in results.items():
+        ref = baseline.get(key)
+        if ref is None:
+            continue
+        if res['median_ms'] > ref['median_ms'] * (1 + tolerance):
+            regressions.append(f'{key}: median {res["median_ms"]:.1f} ms > baseline {ref["median_ms"]:.1f} ms')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold start time of the HV and run control tools')
+    parser.add_argument('--runs', type=int, default=10, help='runs per scenario (default: %(default)s)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated scenarios (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=0, help='also list the N slowest top-level imports of each scenario')
+    parser.add_argument('--save', nargs='?', const=BASELINE, help='store results as baseline (default file: %(const)s)')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE, help='compare with baseline (default file: %(const)s)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"scenario": <20} {"min": >8} {"median": >8} {"max": >8}')
+    print(f'{"": <20} {"[ms]": >8} {"[ms]": >8} {"[ms]": >8}')
+    for key in args.scenarios.split(','):
+        if key not in SCENARIOS:
+            print(f'E: unknown scenario {key} - one of {", ".join(SCENARIOS)}')
+            sys.exit(-1)
+        cwd, argv = SCENARIOS[key]
+        try:
+            res = runScenario(cwd, argv, args.runs)
+        except (OSError, RuntimeError) as e:
+            print(f'W: {key} skipped - {e}')
+            continue
+        results[key] = res
+        print(f'{key: <20} {res["min_ms"]: >8.1f} {res["median_ms"]: >8.1f} {res["max_ms"]: >8.1f}')
+        if args.top:
+            for ms, name in topImports(runOnce(cwd, argv, importtime=True)[1], args.top):
+                print(f'{"": <20} {ms: >8.1f}   {name}')
+
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                regressions = compare(results, json.load(f)['results'], args.tolerance)
+        except OSError as e:
+            print(f'E: baseline not readable - {e}')
+            sys.exit(-1)
+        for msg in regressions:
+            print(f'W: regression {msg}')
+        if regressions:
+            sys.exit(1)
+        print('I: no regression against baseline')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'host': platform.node(), 'python': platform.python_version(),
+                       'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'runs': args.runs, 'results': results}, f, indent=1)
+            f.write('\n')
+        print(f'I: baseline saved to {args.save}')
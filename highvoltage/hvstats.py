@@ -0,0 +1,154 @@
+import time
+
+from pymodbus.exceptions import ModbusIOException
+
+# latency histogram bucket upper bounds [ms]
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+
+# function code, request PDU size, response PDU size (per item count)
+FUNCTIONS = {
+   'read_coils': (1, lambda n: 5, lambda n: 2 + (n + 7) // 8),
+   'read_holding_registers': (3, lambda n: 5, lambda n: 2 + 2 * n),
+   'read_input_registers': (4, lambda n: 5, lambda n: 2 + 2 * n),
+   'write_coil': (5, lambda n: 5, lambda n: 5),
+   'write_register': (6, lambda n: 5, lambda n: 5),
+   'write_registers': (16, lambda n: 6 + 2 * n, lambda n: 5),
+}
+
+FRAME_OVERHEAD = {'rtu': 3, 'tcp': 7}     # address + CRC / MBAP header
+
+class TxStats:
+   __slots__ = ('count', 'errors', 'timeouts', 'exceptions', 'txbytes', 'rxbytes', 'latency', 'maxLatency', 'histogram')
+
+   def __init__(self):
+      self.count = 0
+      self.errors = 0         # exception responses
+      self.timeouts = 0       # no response
+      self.exceptions = 0     # any other failure (CRC, framing, connection)
+      self.txbytes = 0
+      self.rxbytes = 0
+      self.latency = 0.0      # sum [s]
+      self.maxLatency = 0.0
+      self.histogram = [0] * len(LATENCY_BUCKETS)
+
+   def percentile(self, p):
+      """Upper bound [ms] of the bucket holding the p-th percentile"""
+      total = sum(self.histogram)
+      if total == 0:
+         return 0
+      threshold = total * p / 100
+      acc = 0
+      for bound, n in zip(LATENCY_BUCKETS, self.histogram):
+         acc += n
+         if acc >= threshold:
+            return bound if bound != float('inf') else self.maxLatency * 1000
+      return self.maxLatency * 1000
+
+   def asdict(self):
+      return {
+         'count': self.count,
+         'errors': self.errors,
+         'timeouts': self.timeouts,
+         'exceptions': self.exceptions,
+         'txbytes': self.txbytes,
+         'rxbytes': self.rxbytes,
+         'avg_ms': (self.latency / self.count * 1000) if self.count else 0,
+         'max_ms': self.maxLatency * 1000,
+         'p50_ms': self.percentile(50),
+         'p99_ms': self.percentile(99),
+         'histogram': dict(zip(LATENCY_BUCKETS, self.histogram)),
+      }
+
+class BusStats:
+   """Per-slave, per-function-code transaction counters"""
+
+   def __init__(self, mode, enabled=False):
+      self.enabled = enabled
+      self.overhead = FRAME_OVERHEAD.get(mode, 0)
+      self.table = {}         # (slave, function code) -> TxStats
+      self.since = time.time()
+
+   def reset(self):
+      self.table = {}
+      self.since = time.time()
+
+   def record(self, slave, name, n, latency, rr, exc):
+      fc, reqSize, respSize = FUNCTIONS[name]
+      entry = self.table.get((slave, fc))
+      if entry is None:
+         entry = self.table[(slave, fc)] = TxStats()
+
+      entry.count += 1
+      entry.txbytes += reqSize(n) + self.overhead
+      if exc is not None or isinstance(rr, ModbusIOException):
+         if isinstance(exc, ModbusIOException) or isinstance(rr, ModbusIOException):
+            entry.timeouts += 1
+         else:
+            entry.exceptions += 1
+         return
+      if rr.isError():
+         entry.errors += 1
+         entry.rxbytes += 3 + self.overhead
+      else:
+         entry.rxbytes += respSize(n) + self.overhead
+
+      entry.latency += latency
+      if latency > entry.maxLatency:
+         entry.maxLatency = latency
+      ms = latency * 1000
+      for i, bound in enumerate(LATENCY_BUCKETS):
+         if ms <= bound:
+            entry.histogram[i] += 1
+            break
+
+   def stats(self):
+      result = {}
+      for (slave, fc), entry in sorted(self.table.items()):
+         result.setdefault(slave, {})[fc] = entry.asdict()
+      return result
+
+class InstrumentedClient:
+   """Bus client proxy timing every Modbus transaction into a BusStats"""
+
+   def __init__(self, client, stats):
+      object.__setattr__(self, 'client', client)
+      object.__setattr__(self, 'busStats', stats)
+
+   def __getattr__(self, name):
+      return getattr(self.client, name)
+
+   def __setattr__(self, name, value):
+      setattr(self.client, name, value)
+
+   def transaction(self, name, n, kwargs):
+      method = getattr(self.client, name)
+      if not self.busStats.enabled:
+         return method(**kwargs)
+
+      slave = kwargs.get('slave', 1)
+      start = time.perf_counter()
+      try:
+         rr = method(**kwargs)
+      except Exception as e:
+         self.busStats.record(slave, name, n, time.perf_counter() - start, None, e)
+         raise
+      self.busStats.record(slave, name, n, time.perf_counter() - start, rr, None)
+      return rr
+
+   def read_coils(self, **kwargs):
+      return self.transaction('read_coils', kwargs.get('count', 1), kwargs)
+
+   def read_holding_registers(self, **kwargs):
+      return self.transaction('read_holding_registers', kwargs.get('count', 1), kwargs)
+
+   def read_input_registers(self, **kwargs):
+      return self.transaction('read_input_registers', kwargs.get('count', 1), kwargs)
+
+   def write_coil(self, **kwargs):
+      return self.transaction('write_coil', 1, kwargs)
+
+   def write_register(self, **kwargs):
+      return self.transaction('write_register', 1, kwargs)
+
+   def write_registers(self, **kwargs):
+      return self.transaction('write_registers', len(kwargs.get('values', ())), kwargs)
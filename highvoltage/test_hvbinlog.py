@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from hvbinlog import BinLogWriter, BinLogReader
+
+T0 = 1700000000.0
+
+def snapshots(count, addresses=(1, 2, 3)):
+   """count rounds of monitoring records, one per address, 1 s apart"""
+   return [SimpleNamespace(timestamp=T0 + k, address=addr, status=k % 7, alarm=addr, Vset=1000 + k,
+                           V=1000.5 + k, I=2.25 * addr, T=25.5)
+           for k in range(count) for addr in addresses]
+
+class BinLogTest(unittest.TestCase):
+
+   def setUp(self):
+      self.filename = os.path.join(tempfile.mkdtemp(), 'hv.bin')
+      self.addCleanup(os.remove, self.filename)
+
+   def write(self, records, blockSize=16, indexEvery=2, close=True):
+      writer = BinLogWriter(open(self.filename, 'wb'), blockSize=blockSize, indexEvery=indexEvery)
+      writer.write(records)
+      if close:
+         writer.close()
+      else:
+         writer.flush()
+      return writer
+
+   def read(self, *args, **kwargs):
+      reader = BinLogReader(self.filename)
+      try:
+         return len(reader.blocks), {name: column.tolist() for name, column in reader.read(*args, **kwargs).items()}
+      finally:
+         reader.close()
+
+   def assertRecords(self, data, records):
+      self.assertEqual(data['timestamp'], [int(r.timestamp * 1000000) for r in records])
+      for name in ('address', 'status', 'alarm', 'Vset', 'V', 'I', 'T'):
+         self.assertEqual(data[name], [getattr(r, name) for r in records], name)
+
+   def test_round_trip(self):
+      records = snapshots(40)
+      self.write(records)
+      blocks, data = self.read()
+      self.assertEqual(blocks, 8)
+      self.assertRecords(data, records)
+
+   def test_unclosed_file(self):
+      # no trailing index: the reader walks the block headers
+      records = snapshots(20)
+      writer = self.write(records, close=False)
+      blocks, data = self.read()
+      writer.fhand.close()
+      self.assertEqual(blocks, 4)
+      self.assertRecords(data, records)
+
+   def test_module_and_time_filter(self):
+      records = snapshots(40)
+      self.write(records)
+      _, data = self.read(modules=[2], start=T0 + 10, stop=T0 + 19)
+      self.assertRecords(data, [r for r in records if r.address == 2 and 10 <= r.timestamp - T0 <= 19])
+
+   def test_columns(self):
+      self.write(snapshots(5))
+      _, data = self.read(columns=['address', 'V'])
+      self.assertEqual(list(data), ['address', 'V'])
+      _, data = self.read(modules=[9])
+      self.assertEqual(data['V'], [])
+
+   def test_not_a_binlog(self):
+      with open(self.filename, 'wb') as f:
+         f.write(b'timestamp,address\n' * 4)
+      with self.assertRaises(ValueError):
+         BinLogReader(self.filename)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from hvbroker import Broker, MONITOR
+
+class SlowClient:
+   """Bus client answering every read after delay seconds"""
+
+   def __init__(self, delay):
+      self.delay = delay
+      self.calls = 0
+
+   def read_holding_registers(self, address, count=1, slave=1):
+      self.calls += 1
+      time.sleep(self.delay)
+      return ReadHoldingRegistersResponse(registers=list(range(address, address + count)), dev_id=slave)
+
+class BrokerDisconnectTest(unittest.IsolatedAsyncioTestCase):
+
+   async def asyncSetUp(self):
+      self.path = os.path.join(tempfile.mkdtemp(), 'hvbroker.sock')
+      self.client = SlowClient(0.2)
+      self.broker = Broker(self.client, self.path)
+      self.server = asyncio.create_task(self.broker.serve())
+      while not os.path.exists(self.path):
+         await asyncio.sleep(0.01)
+
+   async def asyncTearDown(self):
+      self.server.cancel()
+      try:
+         await self.server
+      except asyncio.CancelledError:
+         pass
+
+   async def request(self, rid, address):
+      reader, writer = await asyncio.open_unix_connection(self.path)
+      message = {'id': rid, 'fn': 'read_holding_registers', 'priority': MONITOR,
+                 'kwargs': {'address': address, 'count': 2, 'slave': 1}}
+      writer.write(json.dumps(message).encode() + b'\n')
+      await writer.drain()
+      return reader, writer
+
+   async def test_disconnect_during_request(self):
+      # the first client leaves while its read is on the bus
+      _, writer = await self.request(1, 0)
+      await asyncio.sleep(0.05)
+      writer.close()
+      await writer.wait_closed()
+
+      # a second client merges with the abandoned transaction, a third one queues behind it
+      merged, mergedWriter = await self.request(2, 0)
+      queued, queuedWriter = await self.request(3, 10)
+      reply = json.loads(await asyncio.wait_for(merged.readline(), 2))
+      self.assertEqual(reply['id'], 2)
+      self.assertEqual(reply['registers'], [0, 1])
+      reply = json.loads(await asyncio.wait_for(queued.readline(), 2))
+      self.assertEqual(reply['id'], 3)
+      self.assertEqual(reply['registers'], [10, 11])
+      self.assertEqual(self.client.calls, 2)
+      for writer in (mergedWriter, queuedWriter):
+         writer.close()
+         await writer.wait_closed()
+
+   async def test_live_socket_is_not_removed(self):
+      with self.assertRaises(RuntimeError):
+         await Broker(self.client, self.path).serve()
+      self.assertTrue(os.path.exists(self.path))
+
+if __name__ == '__main__':
+   unittest.main()
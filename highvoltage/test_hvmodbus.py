@@ -0,0 +1,99 @@
+import argparse
+import socket
+import unittest
+
+from hvasync import AsyncHVModbus
+from hvmodbus import HVModbus, SNAPSHOT_COUNT, closeClient
+from hvsim import HVSimulator
+
+LEGACY = 2
+
+def freePort():
+   with socket.socket() as s:
+      s.bind(('127.0.0.1', 0))
+      return s.getsockname()[1]
+
+class SimulatorTest(unittest.TestCase):
+   """Boards 1...3 on an in-process simulator, board LEGACY with older firmware"""
+
+   @classmethod
+   def setUpClass(cls):
+      port = freePort()
+      cls.sim = HVSimulator(range(1, 4), seed=1)
+      cls.sim.board(LEGACY).legacy = True
+      cls.sim.start(tcp=('127.0.0.1', port))
+      cls.param = argparse.Namespace(mode='tcp', host='127.0.0.1', tcpport=port)
+
+   @classmethod
+   def tearDownClass(cls):
+      closeClient(cls.param)
+      cls.sim.stop()
+
+class SnapshotTest(SimulatorTest):
+
+   def test_single_read(self):
+      hv = HVModbus(self.param)
+      snap = hv.snapshot(1)
+      self.assertEqual(len(snap.registers), SNAPSHOT_COUNT)
+      self.assertEqual(snap.pmtsn.strip(), 'PMT0001')
+      self.assertEqual(hv.splitSnapshot, set())
+
+   def test_split_on_illegal_address(self):
+      hv = HVModbus(self.param)
+      for _ in range(2):
+         snap = hv.snapshot(LEGACY)
+         self.assertEqual(len(snap.registers), SNAPSHOT_COUNT)
+         self.assertEqual(snap.pmtsn.strip(), f'PMT{LEGACY:04d}')
+         self.assertEqual(snap.calib()[:2], (1.0, 0.0))
+         self.assertEqual(hv.splitSnapshot, {LEGACY})
+
+class AsyncSnapshotTest(SimulatorTest, unittest.IsolatedAsyncioTestCase):
+
+   async def test_split_on_illegal_address(self):
+      hv = AsyncHVModbus(self.param, inflight=2)
+      self.assertTrue(await hv.connect())
+      try:
+         snaps = await hv.poll_all([1, LEGACY, 3])
+      finally:
+         hv.close()
+      for addr, snap in snaps.items():
+         self.assertEqual(len(snap.registers), SNAPSHOT_COUNT)
+         self.assertEqual(snap.pmtsn.strip(), f'PMT{addr:04d}')
+      self.assertEqual(hv.splitSnapshot, {LEGACY})
+
+class StagedTest(SimulatorTest):
+
+   def setUp(self):
+      self.hv = HVModbus(self.param)
+      self.hv.open(1)
+
+   def test_flush_on_exit(self):
+      with self.hv.staged():
+         self.hv.setRateRampup(20)
+         self.hv.setRateRampdown(30)
+         self.hv.setVoltageSet(40)
+         self.assertEqual(self.hv.pending, {1: {0x23: 20, 0x24: 30, 0x26: 40}})
+      self.assertEqual(self.hv.pending, {})
+      self.assertEqual(self.hv.mismatch, {})
+      board = self.sim.board(1)
+      self.assertEqual((board.rateUP, board.rateDN, board.vset), (20, 30, 40))
+
+   def test_coil_while_staging(self):
+      vset = self.sim.board(1).vset
+      with self.assertRaises(RuntimeError):
+         with self.hv.staged():
+            self.hv.setVoltageSet(vset + 5)
+            self.hv.powerOn()
+      self.assertEqual(self.hv.pending, {})
+      self.assertEqual(self.sim.board(1).vset, vset)
+      self.assertFalse(self.sim.board(1).power)
+
+   def test_refused_write_without_verify(self):
+      # one write_registers across 0x2F...0x30, refused by the older firmware
+      with self.hv.staged(verify=False):
+         self.hv.writeRegister(0x2F, 50, slave=LEGACY)
+         self.hv.writeRegister(0x30, 0, slave=LEGACY)
+      self.assertEqual(self.hv.mismatch, {LEGACY: [0x2F, 0x30]})
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from hvsettle import SettleDetector
+
+def feed(detector, values):
+   """Add values until the detector is done - returns the number of samples taken"""
+   for n, value in enumerate(values, 1):
+      detector.add(value)
+      if detector.done():
+         return n
+   return len(values)
+
+class SettleDetectorTest(unittest.TestCase):
+
+   def test_quiet_value_stops_at_min_samples(self):
+      rng = random.Random(1)
+      detector = SettleDetector(tolerance=0.05, minSamples=4, maxSamples=10)
+      n = feed(detector, [100 + rng.gauss(0, 0.01) for _ in range(20)])
+      self.assertEqual(n, 4)
+      self.assertTrue(detector.stable)
+      self.assertAlmostEqual(detector.mean, 100, delta=0.05)
+
+   def test_min_samples_floor(self):
+      detector = SettleDetector(minSamples=1)
+      self.assertFalse(detector.add(100))
+      self.assertFalse(detector.add(100))
+      self.assertTrue(detector.add(100))
+
+   def test_ramp_is_not_stable(self):
+      detector = SettleDetector(tolerance=0.05, minSamples=4, maxSamples=10)
+      n = feed(detector, [100 + 0.1 * k for k in range(20)])
+      self.assertEqual(n, 10)
+      self.assertFalse(detector.stable)
+      self.assertAlmostEqual(detector.drift(), 0.9)
+
+   def test_noise_is_not_stable(self):
+      rng = random.Random(1)
+      detector = SettleDetector(tolerance=0.05, minSamples=4, maxSamples=10)
+      n = feed(detector, [100 + rng.gauss(0, 1) for _ in range(20)])
+      self.assertEqual(n, 10)
+      self.assertFalse(detector.stable)
+
+   def test_settles_after_ramp(self):
+      # ramping toward 100, then flat: stable once the ramp leaves the window
+      values = [90 + 2 * k for k in range(5)] + [100] * 15
+      detector = SettleDetector(tolerance=0.05, window=5, minSamples=4, maxSamples=20)
+      n = feed(detector, values)
+      self.assertTrue(detector.stable)
+      self.assertEqual(n, 10)
+      self.assertEqual(detector.mean, 100)
+
+   def test_running_sums_match_window(self):
+      rng = random.Random(2)
+      detector = SettleDetector(window=6)
+      for _ in range(50):
+         detector.add(rng.uniform(0, 1000))
+      values = list(detector.values)
+      n = len(values)
+      mean = sum(values) / n
+      center = (n - 1) / 2
+      slope = sum((k - center) * v for k, v in enumerate(values)) / sum((k - center) ** 2 for k in range(n))
+      noise = (sum((v - mean) ** 2 for v in values) / (n - 1)) ** 0.5
+      self.assertAlmostEqual(detector.drift(), slope * (n - 1), places=6)
+      self.assertAlmostEqual(detector.noise(), noise, places=6)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -11,7 +11,6 @@ import os
 import cmd2.ansi
 from cmd2 import with_category
 from cmd2.table_creator import (Column, BorderedTable, HorizontalAlignment)
-from colorama import Fore, Style
 import time
 
 class RunControlApp(cmd2.Cmd):
@@ -39,6 +38,8 @@ class RunControlApp(cmd2.Cmd):
             self.perror("UIO device not found")
             sys.exit(-1)
         self.regs = mmap.mmap(self.fid.fileno(), 0x10000)
+        # 32-bit word view on the mapping - no copies, native byte order (the Zynq PS is little-endian)
+        self.words = memoryview(self.regs).cast('I')
 
         cmd2.categorize(
             (cmd2.Cmd.do_alias, cmd2.Cmd.do_help, cmd2.Cmd.do_history, cmd2.Cmd.do_quit, cmd2.Cmd.do_set, cmd2.Cmd.do_run_script, cmd2.Cmd.do_shell),
@@ -58,13 +59,26 @@ class RunControlApp(cmd2.Cmd):
     # read register
     #
     def read_reg(self, add) -> int:
-        return int.from_bytes(self.regs[add*4:(add*4)+4], byteorder='little')
+        # outside the map reads as 0, like the byte slice it replaced
+        if add < 0 or add >= len(self.words):
+            return 0
+        return self.words[add]
+
+    #
+    # read consecutive registers
+    #
+    def read_block(self, start, count) -> memoryview:
+        """Registers start...start+count-1 as a live view - tolist() takes a snapshot"""
+        return self.words[start:start+count]
 
     #
     # write register
     #
     def write_reg(self, add, value) -> None:
-        self.regs[add*4:(add*4)+4] = int.to_bytes(value, 4, byteorder='little')
+        # a negative index would wrap to the end of the map
+        if add < 0 or add >= len(self.words):
+            raise IndexError(f'register {add} out of range')
+        self.words[add] = value
 
     #
     # read UIO register parser
@@ -77,8 +91,9 @@ class RunControlApp(cmd2.Cmd):
     def do_read(self, args) -> None:
         """Read UIO register"""
         for channel in args.address:
-            value = self.read_reg(channel)
-            self.poutput(f'0x{value:08x} ({value})')
+            if self.checkRange(channel, 0, len(self.words)-1):
+                value = self.read_reg(channel)
+                self.poutput(f'0x{value:08x} ({value})')
 
     #
     # write UIO register parser
@@ -108,7 +123,9 @@ class RunControlApp(cmd2.Cmd):
     @cmd2.with_category("UIO commands")
     def do_dump(self, args) -> None:
         """Dump UIO register"""
-        value = self.regs[args.address*4:(args.address*4)+4]
+        if not self.checkRange(args.address, 0, len(self.words)-1):
+            return
+        value = self.read_reg(args.address).to_bytes(4, byteorder='little')
         data_list = [[format(value[3], '08b'), format(value[2], '08b'), format(value[1], '08b'), format(value[0], '08b')],
                      [f'0x{value[3]:02x}', f'0x{value[2]:02x}', f'0x{value[1]:02x}', f'0x{value[0]:02x}', ]]
         table = self.bt.generate_table(data_list)
@@ -120,12 +137,11 @@ class RunControlApp(cmd2.Cmd):
     @cmd2.with_category("Monitoring commands")
     def do_status(self, _) -> None:
         """Show 19 channel status"""
+        from colorama import Fore, Style
         ch_en_reg = format(self.read_reg(0), '019b')
         pow_en_reg = format(self.read_reg(1), '019b')
-        ratemeters = []
-        for i in range(8, 27):
-            ratemeters.append(self.read_reg(i))
-        deadtime = round((65535 - self.read_reg(27))/65535*100)
+        ratemeters = self.read_block(8, 20).tolist()
+        deadtime = round((65535 - ratemeters[19])/65535*100)
         def ch(channel):
             on = Fore.GREEN + f"{channel+1:02}" if pow_en_reg[18-channel] == '1' else Fore.RED + f"{channel+1:02}"
             enabled = Fore.GREEN + "•" if ch_en_reg[18-channel] == '1' else Fore.RED + "•"
@@ -263,8 +279,9 @@ class RunControlApp(cmd2.Cmd):
         """Check clock registers"""
         self.print_clockreg()
 
-    def print_clockreg(self) -> None:
-        clock_reg = self.read_reg(3)
+    def print_clockreg(self, clock_reg=None) -> None:
+        if clock_reg is None:
+            clock_reg = self.read_reg(3)
         self.poutput(f"PLL: {'locked' if (clock_reg&0x2) > 0 else 'free running'} and {'unstable' if (clock_reg&0x8000) > 0 else 'stable'}")
         self.poutput(f"Cable 1: {'OK' if (clock_reg&0x80) > 0 else 'not OK'}, {'Lost' if (clock_reg&0x40) > 0 else 'not Lost'}, {'Found' if (clock_reg&0x20) > 0 else 'not Found'}")
         self.poutput(f"Cable 2: {'OK' if (clock_reg&0x10) > 0 else 'not OK'}, {'Lost' if (clock_reg&0x8) > 0 else 'not Lost'}, {'Found' if (clock_reg&0x4) > 0 else 'not Found'}")
@@ -279,8 +296,9 @@ class RunControlApp(cmd2.Cmd):
         """Check Tr32 registers"""
         self.print_trreg()
 
-    def print_trreg(self) -> None:
-        clock_reg = self.read_reg(3)
+    def print_trreg(self, clock_reg=None) -> None:
+        if clock_reg is None:
+            clock_reg = self.read_reg(3)
         self.poutput(f"Tr32: {'not received' if (clock_reg&0x800) > 0 else 'received'} and {'not aligned' if (clock_reg&0x400) > 0 else 'aligned'} - counted: {self.read_reg(45)}")
         self.poutput(f"TagT: {'not received' if (clock_reg&0x2000) > 0 else 'received'} and {'not aligned' if (clock_reg&0x1000) > 0 else 'aligned'} ({'parity not ok' if (clock_reg&0x4000) > 0 else 'parity ok'})\n")
 
@@ -527,10 +545,12 @@ class RunControlApp(cmd2.Cmd):
     @cmd2.with_category("Monitoring commands")
     def do_hk(self, _) -> None:
         """Show house-keeping registers"""
-        self.poutput(f"Temperature: {(self.read_reg(56) >> 12)/100}°C")
-        self.poutput(f"Relative humidity: {(self.read_reg(56) & 0xFFF)/100}%")
-        self.poutput(f"Power: {'not OK' if self.read_reg(61)&0x2 > 0 else 'OK'}")
-        self.poutput(f"Voltage: {'not OK' if self.read_reg(61)&0x1 > 0 else 'OK'}")
+        hk_reg = self.read_reg(56)
+        power_reg = self.read_reg(61)
+        self.poutput(f"Temperature: {(hk_reg >> 12)/100}°C")
+        self.poutput(f"Relative humidity: {(hk_reg & 0xFFF)/100}%")
+        self.poutput(f"Power: {'not OK' if power_reg&0x2 > 0 else 'OK'}")
+        self.poutput(f"Voltage: {'not OK' if power_reg&0x1 > 0 else 'OK'}")
 
     #
     # FIFO regs
@@ -626,11 +646,9 @@ class RunControlApp(cmd2.Cmd):
     @cmd2.with_category("Monitoring commands")
     def do_printall(self, _) -> None:
         """Print all the registers"""
+        regs = self.read_block(0, 64).tolist()
         for row in range(8):
-            self.poutput(f"Register{(row*8):02}: {self.read_reg(row*8):08x}  Register{(row*8)+1:02}: {self.read_reg((row*8)+1):08x}  "
-                         f"Register{(row*8)+2:02}: {self.read_reg((row*8)+2):08x}  Register{(row*8)+3:02}: {self.read_reg((row*8)+3):08x}  "
-                         f"Register{(row*8)+4:02}: {self.read_reg((row*8)+4):08x}  Register{(row*8)+5:02}: {self.read_reg((row*8)+5):08x}  "
-                         f"Register{(row*8)+6:02}: {self.read_reg((row*8)+6):08x}  Register{(row*8)+7:02}: {self.read_reg((row*8)+7):08x}")
+            self.poutput("  ".join(f"Register{(row*8)+col:02}: {regs[(row*8)+col]:08x}" for col in range(8)))
 
     #
     # monitoring
@@ -643,24 +661,25 @@ class RunControlApp(cmd2.Cmd):
     def do_mon(self, args: argparse.Namespace) -> None:
         """Monitor monitored values"""
         for i in range(0, args.seconds):
-            ratemeters = []
-            for j in range(8, 27):
-                ratemeters.append(self.read_reg(j))
-            deadtime = round((65535 - self.read_reg(27)) / 65535 * 100)
+            # ratemeters (8-26) and deadtime (27) in one block, the rest once per refresh
+            ratemeters = self.read_block(8, 20).tolist()
+            deadtime = round((65535 - ratemeters[19]) / 65535 * 100)
             fifodata = self.read_reg(43)
-            temp = (self.read_reg(56) >> 12)/100
-            hum = (self.read_reg(56) & 0xFFF)/100
+            clock_reg = self.read_reg(3)
+            hk_reg = self.read_reg(56)
+            temp = (hk_reg >> 12)/100
+            hum = (hk_reg & 0xFFF)/100
             if i % 10 == 0:
                 self.poutput(cmd2.ansi.style(f"Temperature: {temp}°C   Relative humidity: {hum}%", fg=cmd2.ansi.Fg.LIGHT_CYAN))
                 self.poutput("-------------------------------------------------------------------------------------------------------------------------------")
             self.pwarning("Rates (Hz):")
             self.poutput(f"CH1:  {ratemeters[0]:08},  CH2: {ratemeters[1]:08},  CH3: {ratemeters[2]:08},  CH4: {ratemeters[3]:08},  CH5: {ratemeters[4]:08},  CH6: {ratemeters[5]:08},  CH7: {ratemeters[6]:08},  CH8: {ratemeters[7]:08},")
             self.poutput(f"CH9:  {ratemeters[8]:08}, CH10: {ratemeters[9]:08}, CH11: {ratemeters[10]:08}, CH12: {ratemeters[11]:08}, CH13: {ratemeters[12]:08}, CH14: {ratemeters[13]:08}, CH15: {ratemeters[14]:08}, CH16: {ratemeters[15]:08},")
-            self.poutput(f"CH17: {ratemeters[16]:08}, CH18: {ratemeters[17]:08}, CH19: {ratemeters[18]:08}  --  Deadtime: {deadtime}%  --  FIFO: {fifodata} words ({'FULL' if self.read_reg(3)&0x1 > 0 else 'not FULL'}) \n")
+            self.poutput(f"CH17: {ratemeters[16]:08}, CH18: {ratemeters[17]:08}, CH19: {ratemeters[18]:08}  --  Deadtime: {deadtime}%  --  FIFO: {fifodata} words ({'FULL' if clock_reg&0x1 > 0 else 'not FULL'}) \n")
             self.pwarning("Tr32 status:")
-            self.print_trreg()
+            self.print_trreg(clock_reg)
             self.pwarning("Clock status:")
-            self.print_clockreg()
+            self.print_clockreg(clock_reg)
             self.poutput("-------------------------------------------------------------------------------------------------------------------------------")
             time.sleep(1)
 